@@ -1,14 +1,23 @@
+import datetime
 import json
 import os
 import sqlite3
+import threading
 import time
 
 import pandas as pd
 import streamlit as st
 from openai import OpenAI
 
+from support.audit_archive import query_audit
+from support.audit_query import COLUMNS as AUDIT_COLUMNS
+from support.audit_query import AuditFilter, fetch_newer, tool_names
 from support.prompts import DASHBOARD_INSTRUCTIONS, DATA_DICTIONARY_HTML, WORKFLOW_INSTRUCTIONS
 
+AUDIT_DB_PATH = os.getenv("AUDIT_DB_PATH", "audit.db")
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
+AUDIT_REFRESH_SECONDS = 5.0
+
 # Server URL configuration:
 # - In production: Use SERVER_URL environment variable
 # - In development: Read from config.json (created by ngrok tunnel in Makefile)
@@ -40,6 +49,8 @@ if "last_resp_id" not in st.session_state:
     st.session_state.last_resp_id = None
 if "input_key" not in st.session_state:
     st.session_state.input_key = 0
+if "audit_view" not in st.session_state:
+    st.session_state.audit_view = {}
 
 st.set_page_config(page_title="CLIN 9000", page_icon="🩺", layout="centered")
 
@@ -53,22 +64,205 @@ def inject_css():
 
 inject_css()
 
+
+def assistant_bubble(text: str) -> str:
+    return f'<div class="clinical-bubble-assistant"><b>Assistant:</b> {text}</div>'
+
+
+def timing_caption(meta: dict) -> str:
+    """One line under an answer: time to first token, total time and the MCP tools used."""
+    parts = []
+    if meta.get("ttft") is not None:
+        parts.append(f"first token {meta['ttft']:.2f} s")
+    parts.append(f"total {meta['total']:.2f} s")
+    if meta.get("tools"):
+        parts.append("tools: " + ", ".join(meta["tools"]))
+    return " · ".join(parts)
+
+
+def describe_tool_call(item, seconds: float) -> str:
+    """Markdown line for a finished MCP tool call (the SQL for run_sql and run_sql_batch)."""
+    line = f"🔧 `{item.name}` {'failed' if item.error else 'done'} in {seconds:.2f} s"
+    try:
+        arguments = json.loads(item.arguments or "{}")
+    except json.JSONDecodeError:
+        arguments = {}
+    if arguments.get("query"):
+        line += f"\n```sql\n{arguments['query']}\n```"
+    for query in arguments.get("queries") or []:
+        if isinstance(query, dict) and query.get("query"):
+            line += f"\n```sql\n{query['query']}\n```"
+    return line
+
+
+def stream_answer(req: dict, status_text, tool_log, answer) -> tuple[str | None, str, dict]:
+    """Consume a streamed Responses API call, rendering tool calls and text as they arrive.
+
+    Returns (response id, answer text, timings) where timings holds the time to first
+    token, the total time and the MCP tools called. The id is None if the response failed.
+    """
+    started = time.perf_counter()
+    resp_id, text = None, ""
+    meta = {"ttft": None, "total": 0.0, "tools": []}
+    tool_started: dict[str, float] = {}
+
+    for event in client.responses.create(**req, stream=True):
+        if event.type == "response.created":
+            resp_id = event.response.id
+        elif event.type == "response.mcp_list_tools.in_progress":
+            status_text.text("Listing MCP tools...")
+        elif event.type == "response.output_item.added" and event.item.type == "mcp_call":
+            tool_started[event.item.id] = time.perf_counter()
+            status_text.text(f"Calling {event.item.name}...")
+        elif event.type == "response.output_item.done" and event.item.type == "mcp_call":
+            seconds = time.perf_counter() - tool_started.pop(event.item.id, started)
+            meta["tools"].append(event.item.name)
+            tool_log.markdown(describe_tool_call(event.item, seconds))
+            status_text.text("Waiting for the assistant...")
+        elif event.type == "response.output_text.delta":
+            if meta["ttft"] is None:
+                meta["ttft"] = time.perf_counter() - started
+                status_text.text(f"First token after {meta['ttft']:.2f} s")
+            text += event.delta
+            answer.markdown(assistant_bubble(text), unsafe_allow_html=True)
+        elif event.type == "response.completed":
+            resp_id = event.response.id
+            text = event.response.output_text or text
+        elif event.type in ("response.failed", "error"):
+            if event.type == "error":
+                error = event.message
+            else:
+                error = event.response.error.message if event.response.error else "unknown error"
+            status_text.text(f"Request failed: {error}")
+            text = text or f"Sorry, the request failed: {error}"
+            resp_id = None  # a failed response cannot be continued from
+            break
+
+    meta["total"] = time.perf_counter() - started
+    return resp_id, text, meta
+
+
 st.image("icon/banner.png", use_container_width=True)
 
 st.markdown(DASHBOARD_INSTRUCTIONS, unsafe_allow_html=True)
 
 
+@st.cache_resource
+def audit_connection(identity: tuple[int, int]) -> tuple[sqlite3.Connection, threading.Lock]:
+    """One read-only connection shared across reruns and sessions (per database file)."""
+    conn = sqlite3.connect(AUDIT_DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA query_only=ON;")
+    return conn, threading.Lock()
+
+
+def audit_filter_controls(known_tools: list[str]) -> tuple[AuditFilter, int]:
+    """Filter widgets for the audit viewer; returns the filter and the page size."""
+    col_tools, col_approved, col_dates, col_size = st.columns([3, 2, 3, 1])
+    with col_tools:
+        tools = st.multiselect("Tools", known_tools, placeholder="All tools")
+    with col_approved:
+        approval = st.selectbox("Approval", ["All", "Approved", "Not approved"])
+    with col_dates:
+        dates = st.date_input("Date range", value=(), format="YYYY-MM-DD")
+    with col_size:
+        page_size = st.selectbox("Rows", [25, 50, 100, 250], index=1)
+    since = until = None
+    if len(dates) >= 1:
+        since = dates[0].isoformat()
+    if len(dates) == 2:
+        until = (dates[1] + datetime.timedelta(days=1)).isoformat()
+    flt = AuditFilter(
+        tools=tuple(tools),
+        approved=None if approval == "All" else approval == "Approved",
+        since=since,
+        until=until,
+    )
+    return flt, page_size
+
+
+def show_audit_log() -> None:
+    """Audit viewer: filtered, id-paginated, and incremental on the newest page.
+
+    Older pages continue past the live table into the compressed archives.
+    """
+    try:
+        st_db = os.stat(AUDIT_DB_PATH)
+        conn, lock = audit_connection((st_db.st_dev, st_db.st_ino))
+        with lock:
+            known_tools = tool_names(conn)
+    except (OSError, sqlite3.Error) as e:
+        st.info(f"No audit log yet ({e}). Start the MCP server and use the chat.")
+        return
+    flt, page_size = audit_filter_controls(known_tools)
+
+    # Pages are anchored on ids; a new filter or page size starts again from the newest
+    view = st.session_state.audit_view
+    if view.get("key") != (flt, page_size):
+        view.clear()
+        view.update(key=(flt, page_size), anchors=[None], head=None, new=0)
+
+    page = len(view["anchors"]) - 1
+    with lock:
+        if page == 0 and view["head"] is not None:
+            # Newest page: fetch only what arrived since the last refresh
+            newest = view["head"][0][0] if view["head"] else 0
+            new_rows = fetch_newer(conn, flt, newest, page_size + 1)
+            rows = (new_rows + view["head"])[: page_size + 1]
+            view["new"] = len(new_rows)
+        else:
+            rows = query_audit(conn, AUDIT_ARCHIVE_DIR, flt, view["anchors"][-1], page_size + 1)
+    if page == 0:
+        view["head"] = rows
+    has_older = len(rows) > page_size
+    rows = rows[:page_size]
+
+    col_newer, col_older, col_info = st.columns([1, 1, 4])
+    with col_newer:
+        if st.button("◀ Newer", disabled=page == 0):
+            view["anchors"].pop()
+            st.rerun(scope="fragment")
+    with col_older:
+        if st.button("Older ▶", disabled=not has_older):
+            view["anchors"].append(rows[-1][0])
+            st.rerun(scope="fragment")
+    with col_info:
+        note = f" · {view['new']} new" if page == 0 and view["new"] else ""
+        st.caption(f"Page {page + 1} · {len(rows)} entries{note}")
+
+    if not rows:
+        st.info("No audit log entries found. Start using the chat to generate log entries.")
+        return
+    st.dataframe(
+        pd.DataFrame(rows, columns=AUDIT_COLUMNS),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "timestamp": "Timestamp",
+            "tool_name": "Tool Name",
+            "arguments": "Arguments",
+            "approved": "Approved",
+            "policy_path": "Policy Path",
+            "result_cache": "Result Cache",
+            "cost_guard": "Cost Guard",
+            "query_rewrite": "Query Rewrite",
+            "stage_timings": "Stage Timings (ms)",
+            "k_anonymity": "Min. Subjects",
+            "engine": "Engine",
+            "admission": "Admission",
+        },
+    )
+
+
 tab1, tab2, tab3, tab4 = st.tabs(["Chat", "Data Dictionary", "Study Protocol", "Audit Log"])
 with tab1:
-    for user_msg, assistant_msg in st.session_state.history:
+    for user_msg, assistant_msg, meta in st.session_state.history:
         st.markdown(
             f'<div class="clinical-bubble-user"><b>You:</b> {user_msg}</div>',
             unsafe_allow_html=True,
         )
-        st.markdown(
-            f'<div class="clinical-bubble-assistant"><b>Assistant:</b> {assistant_msg}</div>',
-            unsafe_allow_html=True,
-        )
+        st.markdown(assistant_bubble(assistant_msg), unsafe_allow_html=True)
+        if meta:
+            st.caption(timing_caption(meta))
 
     col_space, col2 = st.columns([1, 4])
 
@@ -80,27 +274,21 @@ with tab1:
 
     if submitted and user_input:
         with col2:
-            progress_bar = st.progress(0)
             status_text = st.empty()
+            tool_log = st.container()
+            answer = st.empty()
 
-            status_text.text("Preparing request...")
-            progress_bar.progress(20)
             req = dict(model="gpt-4o", tools=tools, instructions=instructions, input=user_input)
             if st.session_state.last_resp_id:
                 req["previous_response_id"] = st.session_state.last_resp_id
 
             status_text.text("Sending to LLM...")
-            progress_bar.progress(50)
-            resp = client.responses.create(**req)
-
-            st.session_state.last_resp_id = resp.id
-            st.session_state.history.append([user_input, resp.output_text])
-            status_text.text("Complete!")
-            progress_bar.progress(100)
+            resp_id, text, meta = stream_answer(req, status_text, tool_log, answer)
 
+            if resp_id:
+                st.session_state.last_resp_id = resp_id
+            st.session_state.history.append([user_input, text, meta])
             st.session_state.input_key += 1
-            time.sleep(0.5)
-
             st.rerun()
 
     if st.button("Clear Chat"):
@@ -120,48 +308,6 @@ with tab3:
 
 with tab4:
     st.header("MCP Tool Usage Audit Log")
-
-    def load_audit_log() -> pd.DataFrame:
-        """Return last 100 audit rows ordered by most recent first."""
-        query = (
-            "SELECT id, timestamp, tool_name, arguments, approved "
-            "FROM audit_log "
-            "ORDER BY timestamp DESC "
-            "LIMIT 100"
-        )
-
-        try:
-            conn = sqlite3.connect("clinical.db")
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            return df
-        except Exception as e:
-            st.error(f"Error loading audit log from SQLite: {e}")
-            return pd.DataFrame(
-                columns=[
-                    "id",
-                    "timestamp",
-                    "tool_name",
-                    "arguments",
-                    "approved",
-                ]
-            )
-
-    audit_df = load_audit_log()
-
-    if not audit_df.empty:
-        st.dataframe(
-            audit_df,
-            use_container_width=True,
-            column_config={
-                "timestamp": "Timestamp",
-                "tool_name": "Tool Name",
-                "arguments": "Arguments",
-                "approved": "Approved",
-            },
-        )
-
-        if st.button("Refresh Audit Log"):
-            st.rerun()
-    else:
-        st.info("No audit log entries found. Start using the chat to generate log entries.")
+    tail = st.toggle("Live tail", help=f"Fetch new entries every {AUDIT_REFRESH_SECONDS:g} seconds")
+    # Only the viewer reruns on refresh, not the whole page
+    st.fragment(run_every=AUDIT_REFRESH_SECONDS if tail else None)(show_audit_log)()
@@ -1,27 +1,262 @@
 import asyncio
+import contextlib
+import contextvars
 import datetime
 import functools
 import json
+import os
+import random
 import sqlite3
+import sys
+import time
+from typing import Awaitable, NamedTuple
 
 import aiosqlite
+import httpx
 import openai
+import uvicorn
 from fastmcp.server import FastMCP
+from fastmcp.server.dependencies import get_context
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from support.admission import AdmissionController, Overloaded
+from support.audit import AuditWriter
+from support.audit_archive import AuditArchiver
+from support.balancer import serve
+from support.cost_guard import ExecutionBudget, QueryTooExpensive, assess_plan
+from support.db_pool import ConnectionPool
+from support.engines import ENGINES, EngineError
+from support.k_anonymity import (
+    SubjectCheck,
+    TooFewSubjects,
+    count_sql,
+    small_classes_sql,
+    subject_probe,
+    subjects_sql,
+    suppress,
+)
+from support.metrics import Metrics, flatten_numbers
+from support.policy_cache import PolicyCache
+from support.policy_prompt import (
+    BATCH_RESPONSE_FORMAT,
+    RESPONSE_FORMAT,
+    build_batch_messages,
+    build_messages,
+    parse_verdict,
+    parse_verdicts,
+    system_prompt,
+)
+from support.result_cache import ResultCache, result_key
+from support.results import (
+    RESULT_FORMATS,
+    CursorStore,
+    encode_page,
+    paged_query,
+    row_overhead,
+    take_within_budget,
+    to_json,
+)
+from support.rollups import ROLLUP_TABLE, rewrite
+from support.schema_cache import SchemaCache
+from support.snapshot import Snapshot
+from support.sql_policy import ALLOW, DENY, precheck
 
 # Paths to files
 DB_PATH = "clinical.db"
 PROTOCOL_FILE = "support/study_protocol.md"
+POLICY_CACHE_PATH = os.getenv("POLICY_CACHE_PATH", "policy_cache.db")
+
+# SQLite connection pools: read-only connections for tools, one writer for audit.db
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+# Serve tool reads from an in-memory copy of clinical.db (support/snapshot.py), reloaded
+# in the background when the file changes (checked on use and every poll interval)
+DB_SNAPSHOT = os.getenv("DB_SNAPSHOT", "0").lower() in ("1", "true", "yes")
+DB_SNAPSHOT_POLL_SECONDS = float(os.getenv("DB_SNAPSHOT_POLL_SECONDS", "2"))
+
+# Audit rows are committed by a background task in batches; "sync" commits before returning
+AUDIT_DURABILITY = os.getenv("AUDIT_DURABILITY", "batched")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "0.05"))
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+# Store each call's per-stage timings (JSON, milliseconds) in audit_log.stage_timings
+AUDIT_STAGE_TIMINGS = os.getenv("AUDIT_STAGE_TIMINGS", "0").lower() in ("1", "true", "yes")
+# The audit log has its own database; old rows move to monthly .jsonl.gz archives
+AUDIT_DB_PATH = os.getenv("AUDIT_DB_PATH", "audit.db")
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
+AUDIT_RETENTION_DAYS = float(os.getenv("AUDIT_RETENTION_DAYS", "90"))
+AUDIT_MAX_LIVE_BYTES = int(os.getenv("AUDIT_MAX_LIVE_BYTES", str(256 * 1024 * 1024)))
+AUDIT_MAINTENANCE_SECONDS = float(os.getenv("AUDIT_MAINTENANCE_SECONDS", "3600"))
+
+# run_sql paging: default rows per page, hard caps per result (rows) and per response (bytes)
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "500"))
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "10000"))
+RESULT_MAX_BYTES = int(os.getenv("RESULT_MAX_BYTES", str(512 * 1024)))
+RESULT_CURSOR_TTL_SECONDS = float(os.getenv("RESULT_CURSOR_TTL_SECONDS", "600"))
+# Memory budget for cached result pages (0 disables the cache)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Speculative mode: run_sql starts reading rows on a sandbox connection while the policy
+# check is in flight (only for a single SELECT the local rules do not deny); rows and
+# audit details are released only once the query is allowed
+RUN_SQL_SPECULATIVE = os.getenv("RUN_SQL_SPECULATIVE", "0").lower() in ("1", "true", "yes")
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", "2"))
+
+# Answer matching aggregate queries over clinical from clinical_rollup when it exists
+RUN_SQL_ROLLUPS = os.getenv("RUN_SQL_ROLLUPS", "1").lower() in ("1", "true", "yes")
+
+# Backend for the other aggregate queries: "sqlite", or "duckdb" for a columnar copy of
+# clinical.db (mirrored in memory, or DUCKDB_PARQUET_DIR from generate_clinical --parquet)
+RUN_SQL_ENGINE = os.getenv("RUN_SQL_ENGINE", "sqlite")
+DUCKDB_PARQUET_DIR = os.getenv("DUCKDB_PARQUET_DIR") or None
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))  # 0: one per CPU core
+
+# Cost guard: plan-based admission of full-scan joins (estimated rows visited) and a
+# per-statement execution budget enforced by SQLite's progress handler (0 disables each)
+COST_GUARD_WARN_ROWS = int(os.getenv("COST_GUARD_WARN_ROWS", "1000000"))
+COST_GUARD_REJECT_ROWS = int(os.getenv("COST_GUARD_REJECT_ROWS", "50000000"))
+COST_GUARD_MAX_SECONDS = float(os.getenv("COST_GUARD_MAX_SECONDS", "10"))
+COST_GUARD_MAX_VM_STEPS = int(os.getenv("COST_GUARD_MAX_VM_STEPS", "200000000"))
+
+# MCP_WORKERS > 1 runs that many server processes behind support/balancer.py; the
+# balancer sets MCP_WORKER_SOCKET and MCP_WORKER_INDEX for each of them
+MCP_WORKERS = int(os.getenv("MCP_WORKERS", "1"))
+WORKER_SOCKET = os.getenv("MCP_WORKER_SOCKET")
+WORKER_INDEX = int(os.getenv("MCP_WORKER_INDEX", "0"))
+# On shutdown, in-flight calls get this long to finish (and be audited)
+MCP_SHUTDOWN_GRACE_SECONDS = float(os.getenv("MCP_SHUTDOWN_GRACE_SECONDS", "3"))
+
+# Protocol §4 minimum subjects, checked on the executed result of subject-level queries:
+# "reject" refuses results with fewer subjects, "suppress" also drops rows whose values
+# fewer than that many subjects share, "off" leaves the rule to the policy LLM
+K_ANONYMITY_MODE = os.getenv("K_ANONYMITY_MODE", "reject")
+K_ANONYMITY_MIN_SUBJECTS = int(os.getenv("K_ANONYMITY_MIN_SUBJECTS", "5"))
+
+# Policy LLM client settings (OPENAI_BASE_URL is honoured, e.g. for support/stub_llm.py)
+POLICY_MODEL = os.getenv("POLICY_MODEL", "gpt-4o")
+POLICY_MAX_INFLIGHT = int(os.getenv("POLICY_MAX_INFLIGHT", "8"))
+POLICY_TIMEOUT_SECONDS = float(os.getenv("POLICY_TIMEOUT_SECONDS", "20"))
+POLICY_MAX_RETRIES = int(os.getenv("POLICY_MAX_RETRIES", "3"))
+
+# Admission control for run_sql / fetch_more (support/admission.py): calls per second and
+# burst per MCP session (0 disables), concurrent calls per tool, and how many calls may
+# wait for a slot (per tool, and per session and tool) and for how long before they are
+# turned away with a retry_after hint
+ADMISSION_RATE_PER_SECOND = float(os.getenv("ADMISSION_RATE_PER_SECOND", "5"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "20"))
+ADMISSION_CONCURRENCY = {
+    "run_sql": int(os.getenv("ADMISSION_RUN_SQL_CONCURRENCY", "16")),
+    "fetch_more": int(os.getenv("ADMISSION_FETCH_MORE_CONCURRENCY", "16")),
+    "run_sql_batch": int(os.getenv("ADMISSION_RUN_SQL_BATCH_CONCURRENCY", "4")),
+}
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_SESSION_MAX_QUEUE = int(os.getenv("ADMISSION_SESSION_MAX_QUEUE", "8"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+
+# Most queries one run_sql_batch call may carry
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "10"))
+
+# Datasets that carry subject identifiers (see the data dictionary in the protocol)
+SUBJECT_TABLES = ("clinical",)
+
+_pool_options = dict(
+    cache_size_kib=DB_CACHE_SIZE_KIB,
+    mmap_size=DB_MMAP_SIZE,
+    cached_statements=DB_STATEMENT_CACHE,
+)
+read_pool = ConnectionPool(DB_PATH, DB_READ_POOL_SIZE, read_only=True, **_pool_options)
+# One long-lived connection, so its PRAGMA data_version sees every external commit
+version_pool = ConnectionPool(DB_PATH, 1, read_only=True)
+audit_pool = ConnectionPool(
+    AUDIT_DB_PATH,
+    1,
+    synchronous="FULL" if AUDIT_DURABILITY == "sync" else "NORMAL",
+)
+# Separate read-only connections for speculative reads, so they never starve allowed queries
+sandbox_pool = ConnectionPool(DB_PATH, SANDBOX_POOL_SIZE, read_only=True, **_pool_options)
+# version_pool stays on the file: its data_version is how changes are noticed
+snapshot = Snapshot(DB_PATH, (read_pool, sandbox_pool)) if DB_SNAPSHOT else None
+
+if RUN_SQL_ENGINE != "sqlite" and RUN_SQL_ENGINE not in ENGINES:
+    raise ValueError(f"RUN_SQL_ENGINE must be one of: sqlite, {', '.join(ENGINES)}")
+analytic_engine = (
+    ENGINES[RUN_SQL_ENGINE](DB_PATH, DUCKDB_PARQUET_DIR, DUCKDB_THREADS)
+    if RUN_SQL_ENGINE != "sqlite"
+    else None
+)
+
+# Latency histograms per tool and per stage, served on /metrics and by server_stats
+metrics = Metrics("clinical_mcp")
+
+admission = AdmissionController(
+    ADMISSION_RATE_PER_SECOND,
+    ADMISSION_BURST,
+    ADMISSION_CONCURRENCY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    session_max_queue=ADMISSION_SESSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
 
 # ---------------------------------------------------------------------------
 # 0️⃣  Audit log setup
 # ---------------------------------------------------------------------------
 
 
+# Optional columns added after the original schema; older databases are migrated in place
+AUDIT_EXTRA_COLUMNS = {
+    "policy_path": "TEXT",  # "local", "cache" or "llm" for run_sql, NULL for other tools
+    "result_cache": "TEXT",  # "hit" or "miss" for run_sql/fetch_more rows and list_schema
+    "cost_guard": "TEXT",  # "ok", "warn: ...", "reject: ..." or "interrupt: ..." when a query ran
+    "query_rewrite": "TEXT",  # "rollup" when run_sql/fetch_more read from clinical_rollup
+    "stage_timings": "TEXT",  # {"stage": ms, ...} JSON when AUDIT_STAGE_TIMINGS is on
+    "k_anonymity": "TEXT",  # "ok: N subjects", "suppress: ..." or "reject: ..." for row queries
+    "engine": "TEXT",  # with RUN_SQL_ENGINE set: "duckdb", or "sqlite: <why>" for the rest
+    "admission": "TEXT",  # "queued: N ms" or "rejected: <why>" when admission control acted
+}
+
+AUDIT_INDEXES = {
+    "idx_audit_log_timestamp": "timestamp",
+    "idx_audit_log_tool": "tool_name, id",
+    "idx_audit_log_approved": "approved, id",
+}
+
+# Per-call details that a tool can attach to its audit_log row
+_audit_details: contextvars.ContextVar[dict] = contextvars.ContextVar("audit_details")
+
+AUDIT_COLUMNS = ("timestamp", "tool_name", "arguments", "approved", *AUDIT_EXTRA_COLUMNS)
+audit_writer = AuditWriter(
+    audit_pool,
+    (
+        f"INSERT INTO audit_log ({', '.join(AUDIT_COLUMNS)}) "
+        f"VALUES ({', '.join(':' + c for c in AUDIT_COLUMNS)})"
+    ),
+    durability=AUDIT_DURABILITY,
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_INTERVAL,
+    max_queue=AUDIT_QUEUE_MAX,
+)
+audit_archiver = AuditArchiver(
+    AUDIT_DB_PATH,
+    AUDIT_ARCHIVE_DIR,
+    retention_days=AUDIT_RETENTION_DAYS,
+    max_live_bytes=AUDIT_MAX_LIVE_BYTES,
+)
+_audit_maintenance: asyncio.Task | None = None
+
+
 async def setup_audit_log():
-    """Create (or recreate) the audit_log table.
-    The table is cleared on every server start so each session has a fresh log.
+    """Create the audit_log table in audit.db, keeping the history of earlier runs.
+
+    Rows from the audit_log table older versions kept inside clinical.db are moved
+    over once; rows past the retention policy are then archived (support/audit_archive.py).
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with aiosqlite.connect(AUDIT_DB_PATH) as db:
+        # WAL lets the dashboard read while the audit writer commits
+        await db.execute("PRAGMA journal_mode=WAL;")
         await db.execute("""
         CREATE TABLE IF NOT EXISTS audit_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -31,113 +266,257 @@ async def setup_audit_log():
             approved BOOLEAN NOT NULL
         )
         """)
-        # Clear previous logs so each run starts fresh
-        await db.execute("DELETE FROM audit_log;")
+        cur = await db.execute("PRAGMA table_info(audit_log);")
+        existing = {row[1] for row in await cur.fetchall()}
+        for column, decl in AUDIT_EXTRA_COLUMNS.items():
+            if column not in existing:
+                await db.execute(f"ALTER TABLE audit_log ADD COLUMN {column} {decl};")
+        # For the dashboard's filtered, id-paginated audit viewer (support/audit_query.py)
+        for name, columns in AUDIT_INDEXES.items():
+            await db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON audit_log ({columns});")
         await db.commit()
+        if os.path.exists(DB_PATH):
+            await _migrate_legacy_audit_log(db)
+    await asyncio.to_thread(audit_archiver.run)
+
+
+async def _migrate_legacy_audit_log(db: aiosqlite.Connection) -> None:
+    """Move an audit_log table left in clinical.db into audit.db, then drop it there."""
+    await db.execute("ATTACH DATABASE ? AS legacy;", (DB_PATH,))
+    try:
+        cur = await db.execute("PRAGMA legacy.table_info(audit_log);")
+        legacy = {row[1] for row in await cur.fetchall()}
+        if legacy:
+            names = ", ".join(c for c in AUDIT_COLUMNS if c in legacy)
+            await db.execute(
+                f"INSERT INTO main.audit_log ({names}) "
+                f"SELECT {names} FROM legacy.audit_log ORDER BY id;"
+            )
+            await db.execute("DROP TABLE legacy.audit_log;")
+            await db.commit()
+    finally:
+        await db.execute("DETACH DATABASE legacy;")
+
+
+async def _audit_maintenance_loop() -> None:
+    while True:
+        await asyncio.sleep(AUDIT_MAINTENANCE_SECONDS)
+        await asyncio.to_thread(audit_archiver.run)
+
 
+# Tools whose calls are approved only if they return no "error"
+QUERY_TOOLS = ("run_sql", "run_sql_batch")
 
-def audit_log(func):
-    """Decorator to log tool usage."""
+
+def audit_log(func=None, *, name: str | None = None):
+    """Decorator to log tool usage (as tool *name*, by default the function's name)."""
+    if func is None:
+        return functools.partial(audit_log, name=name)
 
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
         # Get tool name from the function
-        tool_name = func.__name__
+        tool_name = name or func.__name__
 
         arguments = json.dumps({"args": args, "kwargs": kwargs}, default=str)
 
-        # All tools except run_sql are approved
-        approved = tool_name != "run_sql"
+        # All tools except the query tools are approved
+        approved = tool_name not in QUERY_TOOLS
 
         # Call the original function
-        result = await func(*args, **kwargs)
+        details_token = _audit_details.set({})
+        started = time.perf_counter()
+        try:
+            with metrics.call_stages() as stages:
+                result = await func(*args, **kwargs)
+            details = _audit_details.get()
+        finally:
+            _audit_details.reset(details_token)
+            metrics.observe("tool", "tool", tool_name, time.perf_counter() - started)
 
-        # For run_sql, check if it was approved based on result
-        if tool_name == "run_sql" and isinstance(result, dict) and "error" not in result:
+        # For the query tools, check if it was approved based on result
+        if tool_name in QUERY_TOOLS and isinstance(result, dict) and "error" not in result:
             approved = True
 
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                (
-                    "INSERT INTO audit_log (timestamp, tool_name, arguments, approved) "
-                    "VALUES (?, ?, ?, ?)"
-                ),
-                (
-                    datetime.datetime.now(),
-                    tool_name,
-                    arguments,
-                    approved,
-                ),
-            )
-            await db.commit()
-
+        await write_audit_entry(tool_name, arguments, approved, details, stages)
         return result
 
     return wrapper
 
 
+async def write_audit_entry(
+    tool_name: str, arguments: str, approved: bool, details: dict, stages: dict | None = None
+) -> None:
+    """Queue one audit_log row (``audit_log`` does this for each decorated tool call)."""
+    if AUDIT_STAGE_TIMINGS and stages:
+        details["stage_timings"] = json.dumps(
+            {stage: round(seconds * 1000, 3) for stage, seconds in stages.items()}
+        )
+
+    global _audit_maintenance
+    # One archiver per audit.db: only the first worker runs it
+    if WORKER_INDEX == 0 and (_audit_maintenance is None or _audit_maintenance.done()):
+        _audit_maintenance = asyncio.create_task(
+            _audit_maintenance_loop(), name="audit-maintenance"
+        )
+    with metrics.span("audit.write"):
+        await audit_writer.write(
+            {
+                "timestamp": datetime.datetime.now(),
+                "tool_name": tool_name,
+                "arguments": arguments,
+                "approved": approved,
+                **{column: details.get(column) for column in AUDIT_EXTRA_COLUMNS},
+            }
+        )
+
+
+def session_key() -> str:
+    """The MCP session of the current tool call, for per-session admission control."""
+    try:
+        context = get_context()
+        request = context.request_context.request
+    except (RuntimeError, ValueError, LookupError):
+        return "local"  # called outside an MCP request
+    if request is not None:
+        # Streamable HTTP sends the session in a header, SSE in the message URL
+        session = request.headers.get("mcp-session-id") or request.query_params.get("session_id")
+        if session:
+            return session
+    return f"session-{id(context.session)}"
+
+
+def admitted(func):
+    """Run the tool under admission control; an overloaded call returns an error at once."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        details = _audit_details.get({})
+        try:
+            async with admission.admit(func.__name__, session_key()) as waited:
+                if waited >= 0.001:
+                    metrics.record("admission.wait", waited)
+                    details["admission"] = f"queued: {waited * 1000:.0f} ms"
+                return await func(*args, **kwargs)
+        except Overloaded as e:
+            details["admission"] = f"rejected: {e.reason}"
+            return overloaded(e)
+
+    return wrapper
+
+
+def overloaded(e: Overloaded) -> dict:
+    return {
+        "error": f"Server busy: {e.reason}. Retry after {e.retry_after:g} s.",
+        "error_type": "overloaded",
+        "retry_after": e.retry_after,
+        "rows": [],
+        "rowcount": 0,
+    }
+
+
 # ---------------------------------------------------------------------------
 # Helper: LLM policy gate
 # ---------------------------------------------------------------------------
 
+# Verdicts survive restarts and are dropped automatically when the protocol changes
+policy_cache = PolicyCache(
+    POLICY_CACHE_PATH,
+    max_entries=int(os.getenv("POLICY_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("POLICY_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+)
+
+
+# Errors worth another attempt; anything else (bad request, auth, ...) fails immediately
+_RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_policy_client: openai.AsyncOpenAI | None = None
+_policy_slots = asyncio.Semaphore(POLICY_MAX_INFLIGHT)
+_protocol: tuple[tuple[int, int], str] | None = None
+
+
+def read_protocol() -> str:
+    """Return the protocol text, re-reading the file only when it has changed on disk."""
+    global _protocol
+    st = os.stat(PROTOCOL_FILE)
+    version = (st.st_mtime_ns, st.st_size)
+    if _protocol is None or _protocol[0] != version:
+        with open(PROTOCOL_FILE, "r", encoding="utf-8") as f:
+            _protocol = (version, f.read())
+    return _protocol[1]
+
+
+def policy_client() -> openai.AsyncOpenAI:
+    """Shared async client; one pooled HTTP connection set for every policy call."""
+    global _policy_client
+    if _policy_client is None:
+        _policy_client = openai.AsyncOpenAI(
+            timeout=POLICY_TIMEOUT_SECONDS,
+            max_retries=0,  # retries are handled in _complete_with_retry
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=POLICY_MAX_INFLIGHT,
+                    max_keepalive_connections=POLICY_MAX_INFLIGHT,
+                ),
+            ),
+        )
+    return _policy_client
+
+
+async def _complete_with_retry(
+    messages: list[dict], response_format: dict = RESPONSE_FORMAT
+) -> str:
+    """Run one chat completion with bounded concurrency and jittered exponential backoff.
+
+    The reply must follow *response_format*; a refusal raises ``ValueError``.
+    """
+    for attempt in range(POLICY_MAX_RETRIES + 1):
+        try:
+            queued = time.perf_counter()
+            async with _policy_slots:
+                started = time.perf_counter()
+                metrics.record("llm.queue", started - queued)
+                with metrics.span("llm.request"):
+                    resp = await policy_client().chat.completions.create(
+                        model=POLICY_MODEL,
+                        temperature=0,
+                        messages=messages,
+                        response_format=response_format,
+                        timeout=POLICY_TIMEOUT_SECONDS,
+                    )
+                policy_cache.record_llm_call(time.perf_counter() - started, resp.usage)
+            message = resp.choices[0].message
+            if getattr(message, "refusal", None):
+                raise ValueError(f"the policy model refused: {message.refusal}")
+            return message.content
+        except _RETRYABLE_ERRORS:
+            if attempt == POLICY_MAX_RETRIES:
+                raise
+            # "Full jitter" backoff: 0.5s, 1s, 2s, ... caps, randomised to avoid lockstep
+            await asyncio.sleep(random.uniform(0, min(8.0, 0.5 * 2**attempt)))
+
 
 async def llm_policy_check(sql: str) -> tuple[bool, str]:
-    """Ask GPT-4o whether the SQL violates the study protocol.
+    """Ask the policy LLM (GPT-4o by default) whether the SQL violates the study protocol.
+
+    Successful verdicts are stored in ``policy_cache``; failures are never cached.
 
     Returns:
         (allowed, reason)
     """
 
-    with open(PROTOCOL_FILE, "r", encoding="utf-8") as f:
-        protocol_text = f.read()
+    protocol_text = read_protocol()
 
-    # Build prompt – keep it short and deterministic
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                "You are a data-governance gatekeeper. "
-                "Given a study protocol and a SQL query, respond with JSON: "
-                '{"allowed": true/false, "reason": "..."}. '
-                "If any rule is violated, set allowed to false and provide the specific reason "
-                "based on the protocol. "
-                "Unless a rule is explicitly and clearly violated, set allowed to true."
-            ),
-        },
-        {"role": "system", "content": protocol_text},
-        {
-            "role": "user",
-            "content": f"SQL query to evaluate:\n{sql}\nDoes it violate the study protocol?",
-        },
-    ]
+    # Rules digest first and the SQL last, so every request shares a cacheable prefix
+    messages = build_messages(protocol_text, sql)
 
     try:
-        client = openai.OpenAI()
-        resp = client.chat.completions.create(model="gpt-4o", temperature=0, messages=messages)
-        reply = resp.choices[0].message.content.strip()
-
-        # Strip markdown code blocks if present
-        if reply.startswith("```json") and reply.endswith("```"):
-            reply = reply[7:-3].strip()
-        elif reply.startswith("```") and reply.endswith("```"):
-            reply = reply[3:-3].strip()
-
-        try:
-            data = json.loads(reply)
-            allowed = bool(data.get("allowed"))
-            reason = data.get("reason")
-        except json.JSONDecodeError as e:
-            # If we can't parse the JSON, treat it as a failure in the LLM check
-            raise Exception(f"Failed to parse LLM response as JSON: {e}. Response was: {reply}")
-
-        if not reason or reason == "No reason returned.":
-            if allowed:
-                reason = "Query complies with all study protocol requirements."
-            else:
-                reason = (
-                    "Query potentially violates study protocol. Please review and ensure "
-                    "it doesn't expose subject identifiers."
-                )
+        allowed, reason = parse_verdict(await _complete_with_retry(messages))
+        allowed, reason = await _store_verdict(sql, protocol_text, allowed, reason)
     except Exception as exc:
         # Fail-safe: deny if LLM check fails
         allowed = False
@@ -146,14 +525,568 @@ async def llm_policy_check(sql: str) -> tuple[bool, str]:
     return allowed, reason
 
 
+async def llm_policy_check_batch(sqls: list[str]) -> list[tuple[bool, str]]:
+    """``llm_policy_check`` for several queries at once: one LLM call, one verdict each.
+
+    Returns:
+        [(allowed, reason), ...] in the order of *sqls*
+    """
+    if len(sqls) == 1:
+        return [await llm_policy_check(sqls[0])]
+
+    protocol_text = read_protocol()
+    messages = build_batch_messages(protocol_text, sqls)
+    try:
+        reply = await _complete_with_retry(messages, BATCH_RESPONSE_FORMAT)
+        return [
+            await _store_verdict(sql, protocol_text, allowed, reason)
+            for sql, (allowed, reason) in zip(sqls, parse_verdicts(reply, len(sqls)))
+        ]
+    except Exception as exc:
+        # Fail-safe: deny every query if the LLM check fails
+        return [(False, f"LLM policy check failed: {exc}")] * len(sqls)
+
+
+async def _store_verdict(
+    sql: str, protocol_text: str, allowed: bool, reason: str
+) -> tuple[bool, str]:
+    """Fill in a missing reason and cache the verdict in ``policy_cache``."""
+    if not reason or reason == "No reason returned.":
+        if allowed:
+            reason = "Query complies with all study protocol requirements."
+        else:
+            reason = (
+                "Query potentially violates study protocol. Please review and ensure "
+                "it doesn't expose subject identifiers."
+            )
+    try:
+        await policy_cache.put(sql, system_prompt(protocol_text), allowed, reason)
+    except sqlite3.Error:
+        pass  # a cache failure must not turn a verdict into a denial
+    return allowed, reason
+
+
+async def policy_check(sql: str) -> tuple[bool, str, str, bool]:
+    """Check *sql* against the study protocol, locally first and via the LLM if needed.
+
+    Clear-cut queries (non-SELECT, USUBJID projected, plain aggregates, ...) are
+    decided by ``support.sql_policy`` without a network call. So are plain
+    subject-level row queries: the minimum-subjects rule is then checked on the
+    result instead (``check_subjects``). Everything else is answered from
+    ``policy_cache`` or escalated to ``llm_policy_check``.
+
+    Returns:
+        (allowed, reason, path, check_subjects) where *path* is ``"local"``,
+        ``"cache"`` or ``"llm"``, and *check_subjects* asks the caller to enforce
+        the minimum-subjects rule on the result.
+    """
+    decided = await _policy_check_without_llm(sql)
+    if decided is not None:
+        return decided
+    with metrics.span("policy.llm"):
+        allowed, reason = await llm_policy_check(sql)
+    return allowed, reason, "llm", False
+
+
+async def policy_check_batch(sqls: list[str]) -> list[tuple[bool, str, str, bool]]:
+    """``policy_check`` for several queries; those left to the LLM share one call."""
+    decisions = [await _policy_check_without_llm(sql) for sql in sqls]
+    undecided = list(dict.fromkeys(sql for sql, d in zip(sqls, decisions) if d is None))
+    if undecided:
+        with metrics.span("policy.llm"):
+            verdicts = dict(zip(undecided, await llm_policy_check_batch(undecided)))
+        decisions = [d or (*verdicts[sql], "llm", False) for sql, d in zip(sqls, decisions)]
+    return decisions
+
+
+async def _policy_check_without_llm(sql: str) -> tuple[bool, str, str, bool] | None:
+    """``policy_check``'s answer from the local rules or the cache, or ``None``."""
+    with metrics.span("policy.precheck"):
+        decision = precheck(sql, subject_tables=SUBJECT_TABLES)
+    if decision.verdict in (ALLOW, DENY):
+        return decision.verdict == ALLOW, decision.reason, "local", False
+    if decision.row_level and K_ANONYMITY_MODE != "off" and subject_probe(sql) is not None:
+        reason = "Subject-level rows from one dataset; minimum subjects are checked on the result."
+        return True, reason, "local", True
+    try:
+        with metrics.span("policy.cache"):
+            cached = await policy_cache.get(sql, system_prompt(read_protocol()))
+    except sqlite3.Error:
+        cached = None
+    if cached is not None:
+        return *cached, "cache", False
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Helper: paged query execution
+# ---------------------------------------------------------------------------
+
+cursors = CursorStore(ttl_seconds=RESULT_CURSOR_TTL_SECONDS)
+_db_identity: tuple[int, int] | None = None
+
+
+async def db_version() -> tuple | None:
+    """Token that changes whenever the clinical data or schema may have changed.
+
+    Combines the database file's identity (a regenerated clinical.db is a new file,
+    so the pools are recycled) with ``PRAGMA data_version`` read on a dedicated
+    connection that never writes, so it reports every commit made elsewhere, and
+    ``PRAGMA schema_version``. Returns ``None`` while the file is missing.
+
+    With ``DB_SNAPSHOT``, a new version starts a snapshot reload, and the token
+    returned is that of the snapshot being read until the reload completes.
+    """
+    global _db_identity
+    try:
+        st = os.stat(DB_PATH)
+    except FileNotFoundError:
+        return None
+    identity = (st.st_dev, st.st_ino)
+    if identity != _db_identity:
+        if _db_identity is not None:
+            for pool in (read_pool, version_pool, sandbox_pool):
+                pool.recycle()
+        _db_identity = identity
+    async with version_pool.acquire() as db:
+        cur = await db.execute("PRAGMA data_version;")
+        (data_version,) = await cur.fetchone()
+        cur = await db.execute("PRAGMA schema_version;")
+        (schema_version,) = await cur.fetchone()
+    version = identity, data_version, schema_version
+    if snapshot is not None:
+        if version != snapshot.version:
+            snapshot.refresh(version)
+        if snapshot.uri is not None:
+            return snapshot.version
+    return version
+
+
+async def _snapshot_watch_loop() -> None:
+    while True:
+        await asyncio.sleep(DB_SNAPSHOT_POLL_SECONDS)
+        await db_version()
+
+
+result_cache = ResultCache(db_version, max_bytes=RESULT_CACHE_MAX_BYTES)
+schema_cache = SchemaCache(read_pool, db_version, exclude=("audit_log",))
+
+
+def _page_limit(offset: int, page_size: int) -> int:
+    return max(1, min(page_size, RESULT_MAX_ROWS - offset))
+
+
+class FetchedPage(NamedTuple):
+    columns: list[str]
+    rows: list[tuple]  # up to one page plus a look-ahead row
+    cache_key: str
+    db_version: tuple | None
+    cache_hit: bool
+    warning: str | None = None
+
+
+async def admit_query(
+    db: aiosqlite.Connection, sql: str, args: list, row_counts: dict[str, int]
+) -> str | None:
+    """Check the query plan; raise ``QueryTooExpensive`` or return a warning (or None)."""
+    cur = await db.execute(f"EXPLAIN QUERY PLAN {sql}", args)
+    assessment = assess_plan([tuple(r) for r in await cur.fetchall()], row_counts)
+    if not assessment.full_scan_join:
+        return None
+    estimate = assessment.estimated_rows
+    if COST_GUARD_REJECT_ROWS and estimate > COST_GUARD_REJECT_ROWS:
+        raise QueryTooExpensive(
+            "plan",
+            f"full-scan join would visit ~{estimate:,} rows (limit {COST_GUARD_REJECT_ROWS:,})",
+            estimated_rows=estimate,
+            limit_rows=COST_GUARD_REJECT_ROWS,
+            full_scans=assessment.scans,
+        )
+    if COST_GUARD_WARN_ROWS and estimate > COST_GUARD_WARN_ROWS:
+        return f"full-scan join visits ~{estimate:,} rows; consider filtering before joining"
+    return None
+
+
+async def fetch_page(
+    pool: ConnectionPool, query: str, params: list, offset: int, limit: int
+) -> FetchedPage:
+    """Read one page window (plus a look-ahead row) from ``result_cache`` or *pool*.
+
+    Nothing is stored in the cache here (entries are keyed on the query as sent).
+    Aggregates the rollup can answer are rewritten to read ``clinical_rollup``;
+    other portable aggregates go to ``analytic_engine`` when one is configured.
+    Uncached first pages pass the cost guard's plan check, and every statement
+    runs under an ``ExecutionBudget``; if the task is cancelled mid-query the
+    statement is interrupted.
+    """
+    key = result_key(query, params, offset, limit)
+    with metrics.span("result_cache.lookup"):
+        cached, version = await result_cache.get(key)
+    if cached is not None:
+        return FetchedPage(*cached, key, version, True)
+
+    details = _audit_details.get({})
+    guarded = offset == 0 and (COST_GUARD_WARN_ROWS or COST_GUARD_REJECT_ROWS)
+    row_counts = None
+    rewritten = None
+    if guarded or RUN_SQL_ROLLUPS:
+        # Fetched before taking a connection: a schema rebuild needs one from read_pool
+        with metrics.span("schema.snapshot"):
+            schema, _ = await schema_cache.get()
+        if guarded:
+            row_counts = {table: info["row_count"] for table, info in schema.items()}
+        if RUN_SQL_ROLLUPS and ROLLUP_TABLE in schema and (rewritten := rewrite(query)):
+            query = rewritten
+            details["query_rewrite"] = "rollup"
+    if analytic_engine is not None:
+        reason = "rollup" if rewritten else await engine_unavailable(query)
+        details["engine"] = f"sqlite: {reason}" if reason else None
+        if reason is None and (
+            page := await engine_page(pool, query, params, offset, limit, row_counts)
+        ):
+            columns, rows, warning = page
+            return FetchedPage(columns, rows, key, version, False, warning)
+
+    if offset:
+        sql, args = paged_query(query), [*params, limit + 1, offset]
+    else:
+        sql, args = query, params
+
+    warning = None
+    started = time.perf_counter()
+    async with pool.acquire() as db:
+        metrics.record("db.acquire", time.perf_counter() - started)
+        if row_counts is not None:
+            try:
+                with metrics.span("db.plan"):
+                    warning = await admit_query(db, sql, args, row_counts)
+            except QueryTooExpensive as e:
+                details["cost_guard"] = f"reject: {e.reason}"
+                raise
+        budget = ExecutionBudget(COST_GUARD_MAX_SECONDS, COST_GUARD_MAX_VM_STEPS)
+        await db.set_progress_handler(budget.check, budget.interval)
+        try:
+            started = time.perf_counter()
+            async with db.execute(sql, args) as cur:
+                # execute() runs the statement to its first row; fetchmany() does the rest
+                metrics.record("sqlite.execute", time.perf_counter() - started)
+                columns = [d[0] for d in cur.description or ()]
+                with metrics.span("rows.fetch"):
+                    fetched = [tuple(r) for r in await cur.fetchmany(limit + 1)]
+        except asyncio.CancelledError:
+            # The worker thread keeps running the statement unless SQLite is told to stop
+            await db.interrupt()
+            raise
+        except sqlite3.OperationalError as e:
+            if budget.tripped is None:
+                raise
+            exceeded = budget.exceeded()
+            details["cost_guard"] = f"interrupt: {exceeded.reason}"
+            raise exceeded from e
+        finally:
+            await db.set_progress_handler(None, 0)
+    details["cost_guard"] = f"warn: {warning}" if warning else "ok"
+    return FetchedPage(columns, fetched, key, version, False, warning)
+
+
+async def engine_unavailable(query: str) -> str | None:
+    """Why *query* stays on SQLite rather than ``analytic_engine``, or ``None`` to use it.
+
+    Freshness is checked against ``db_version()`` itself: the version ``result_cache``
+    returns is ``None`` whenever the cache is disabled.
+    """
+    if reason := analytic_engine.unportable(query):
+        return reason
+    if not analytic_engine.ready(await db_version()):
+        return f"{analytic_engine.name} data not current"
+    return None
+
+
+async def engine_page(
+    pool: ConnectionPool,
+    query: str,
+    params: list,
+    offset: int,
+    limit: int,
+    row_counts: dict | None,
+) -> tuple[list[str], list[tuple], str | None] | None:
+    """``(columns, rows, warning)`` computed by ``analytic_engine``, or ``None`` if it failed.
+
+    SQLite still checks the plan and names the columns (a ``LIMIT 0`` read, so
+    errors and column names are the same whichever engine computes the rows).
+    """
+    details = _audit_details.get({})
+    warning = None
+    started = time.perf_counter()
+    async with pool.acquire() as db:
+        metrics.record("db.acquire", time.perf_counter() - started)
+        if row_counts is not None:
+            try:
+                with metrics.span("db.plan"):
+                    warning = await admit_query(db, query, params, row_counts)
+            except QueryTooExpensive as e:
+                details["cost_guard"] = f"reject: {e.reason}"
+                raise
+        with metrics.span("db.describe"):
+            async with db.execute(paged_query(query), [*params, 0, 0]) as cur:
+                columns = [d[0] for d in cur.description or ()]
+    details["engine"] = analytic_engine.name
+    try:
+        with metrics.span("engine.execute"):
+            rows = await analytic_engine.fetch(
+                query, params, offset, limit + 1, COST_GUARD_MAX_SECONDS
+            )
+    except QueryTooExpensive as e:
+        details["cost_guard"] = f"interrupt: {e.reason}"
+        raise
+    except EngineError as e:
+        details["engine"] = f"sqlite: {analytic_engine.name} error: {e}"[:200]
+        return None
+    details["cost_guard"] = f"warn: {warning}" if warning else "ok"
+    return columns, rows, warning
+
+
+async def check_subjects(query: str, params: list, width: int) -> SubjectCheck:
+    """Count the subjects behind *query*'s result, and in suppress mode find its small classes.
+
+    Runs the companion queries from ``support.k_anonymity`` under the same
+    execution budget as the query itself.
+    """
+    probe = subject_probe(query)
+    k = K_ANONYMITY_MIN_SUBJECTS
+    async with read_pool.acquire() as db:
+        budget = ExecutionBudget(COST_GUARD_MAX_SECONDS, COST_GUARD_MAX_VM_STEPS)
+        await db.set_progress_handler(budget.check, budget.interval)
+        try:
+            with metrics.span("k_anonymity.check"):
+                small = []
+                if K_ANONYMITY_MODE != "suppress":
+                    # Reject mode only needs to know whether k subjects are reached
+                    async with db.execute(subjects_sql(probe, k), params) as cur:
+                        (subjects,) = await cur.fetchone()
+                    rows = None
+                else:
+                    async with db.execute(count_sql(probe), params) as cur:
+                        subjects, rows = await cur.fetchone()
+                if K_ANONYMITY_MODE == "suppress" and subjects >= k:
+                    sql = small_classes_sql(probe, width, k, RESULT_MAX_ROWS + 1)
+                    async with db.execute(sql, params) as cur:
+                        small = await cur.fetchall()
+        except asyncio.CancelledError:
+            await db.interrupt()
+            raise
+        except sqlite3.OperationalError as e:
+            if budget.tripped is None:
+                raise
+            raise budget.exceeded() from e
+        finally:
+            await db.set_progress_handler(None, 0)
+    return SubjectCheck(
+        subjects, rows, frozenset(tuple(r[:-1]) for r in small), sum(r[-1] for r in small)
+    )
+
+
+async def enforce_min_subjects(query: str, params: list, page: FetchedPage) -> frozenset[tuple]:
+    """Apply protocol §4 to a subject-level result; returns the value combinations to suppress.
+
+    Raises ``TooFewSubjects`` when a non-empty result covers fewer than
+    ``K_ANONYMITY_MIN_SUBJECTS`` subjects (or, in suppress mode, when almost
+    nothing would be left). In reject mode a cached page has passed already.
+    """
+    details = _audit_details.get({})
+    if page.cache_hit and K_ANONYMITY_MODE != "suppress":
+        details["k_anonymity"] = "ok: cached"
+        return frozenset()
+    check = await check_subjects(query, params, len(page.columns))
+    k = K_ANONYMITY_MIN_SUBJECTS
+    if 0 < check.subjects < k:
+        details["k_anonymity"] = f"reject: {check.subjects} subjects"
+        raise TooFewSubjects(
+            f"the result covers {check.subjects} unique subjects; subject-level results "
+            f"must cover at least {k}",
+            check.subjects,
+            k,
+        )
+    if len(check.small_classes) > RESULT_MAX_ROWS or (
+        check.rows and check.suppressed_rows == check.rows
+    ):
+        # The classes query stops past RESULT_MAX_ROWS, so the row count is a lower bound
+        details["k_anonymity"] = f"reject: {check.suppressed_rows}+ of {check.rows} rows small"
+        raise TooFewSubjects(
+            f"at least {check.suppressed_rows:,} of its {check.rows:,} rows have values shared "
+            f"by fewer than {k} subjects; too many to suppress",
+            check.subjects,
+            k,
+        )
+    at_least = "+" if check.rows is None and check.subjects >= k else ""  # counted up to k
+    details["k_anonymity"] = f"ok: {check.subjects}{at_least} subjects"
+    if check.small_classes:
+        details["k_anonymity"] = (
+            f"suppress: {check.suppressed_rows} of {check.rows} rows, {check.subjects} subjects"
+        )
+    return check.small_classes
+
+
+async def read_page(
+    query: str,
+    params: list,
+    offset: int,
+    page_size: int,
+    fmt: str = "rows",
+    prefetched: Awaitable | None = None,
+    min_subjects: bool = False,
+    small_classes: frozenset = frozenset(),
+) -> dict:
+    """Execute *query* and return one page of rows starting at *offset*, encoded as *fmt*.
+
+    Rows are pulled with ``fetchmany`` so at most one page (plus a look-ahead row)
+    is materialised, and the raw page is kept in ``result_cache`` until the data
+    changes. The page stops early at ``RESULT_MAX_BYTES`` of JSON, and no
+    continuation is offered past ``RESULT_MAX_ROWS`` rows in total.
+
+    *prefetched* is a ``fetch_page`` awaitable already started for the same page
+    (see speculative mode in ``run_sql``). With *min_subjects*, the result must
+    pass ``enforce_min_subjects`` before anything is cached or returned; rows in
+    *small_classes* are left out (continuations carry them along).
+    """
+    limit = _page_limit(offset, page_size)
+    page = await (prefetched or fetch_page(read_pool, query, params, offset, limit))
+    columns, fetched = page.columns, page.rows
+    _audit_details.get({})["result_cache"] = "hit" if page.cache_hit else "miss"
+    if min_subjects:
+        small_classes = await enforce_min_subjects(query, params, page)
+    if not page.cache_hit:
+        result_cache.put(page.cache_key, columns, fetched, page.db_version)
+
+    with metrics.span("result.encode"):
+        overhead = row_overhead(columns, fmt)
+        kept, positions = suppress(fetched[:limit], small_classes)
+        rows, cut = take_within_budget(kept, RESULT_MAX_BYTES, overhead)
+        # Offsets count the query's rows, suppressed ones included
+        end = offset + (positions[len(rows) - 1] + 1 if cut else len(fetched[:limit]))
+        more = cut or len(fetched) > limit
+        result = {
+            **encode_page(columns, rows, fmt),
+            "rowcount": len(rows),
+            "truncated": cut or (more and end >= RESULT_MAX_ROWS),
+            "next_token": (
+                cursors.register(query, params, end, page_size, fmt, small_classes)
+                if more and end < RESULT_MAX_ROWS
+                else None
+            ),
+        }
+        if len(kept) < len(fetched[:limit]):
+            result["suppressed_rows"] = len(fetched[:limit]) - len(kept)
+    if page.warning:
+        result["warning"] = page.warning
+    return result
+
+
+def too_expensive(e: QueryTooExpensive) -> dict:
+    """Structured error for the agent: what tripped, the numbers, and how to recover."""
+    return {
+        "error": (
+            f"Query too expensive: {e.reason}. Narrow it with WHERE filters, aggregate "
+            f"before joining, or join on indexed columns (see list_schema)."
+        ),
+        "error_type": "query_too_expensive",
+        "stage": e.stage,
+        **e.details,
+        "rows": [],
+        "rowcount": 0,
+    }
+
+
+speculation_stats = {"started": 0, "used": 0, "discarded": 0}
+
+
+def may_speculate(query: str) -> bool:
+    """True if *query* may run before its verdict: one SELECT the local rules do not deny."""
+    decision = precheck(query, subject_tables=SUBJECT_TABLES)
+    return decision.single_select and decision.verdict != DENY
+
+
+async def speculate(
+    query: str, params: list, page_size: int, details: dict, stages: list
+) -> FetchedPage:
+    """``fetch_page`` on ``sandbox_pool``, keeping its audit details and stages to itself.
+
+    Audit details go to *details* and stage timings to *stages*, for the caller to
+    merge only if the page is used.
+    """
+    _audit_details.set(details)  # this task's own copy of the context
+    metrics.hold(stages)
+    return await fetch_page(sandbox_pool, query, params, 0, _page_limit(0, page_size))
+
+
+async def discard_speculation(task: asyncio.Task) -> None:
+    """Cancel a speculative read (interrupting SQLite) and drop whatever it produced."""
+    task.cancel()
+    await asyncio.wait([task])
+    if not task.cancelled():
+        task.exception()  # mark any error as retrieved; rows go away with the task
+    speculation_stats["discarded"] += 1
+
+
 # ---------------------------------------------------------------------------
 # 1️⃣  Build the server
 # ---------------------------------------------------------------------------
 
+
+def serialize_result(data) -> str:
+    # Runs after the tool returns, so it is in the histogram but not a call's stage timings
+    with metrics.span("result.serialize"):
+        return to_json(data)
+
+
 mcp = FastMCP(
     name="Clinical SQL MCP",
+    # compact JSON: the default serializer indents with 2 spaces, inflating large results
+    tool_serializer=serialize_result,
 )
 
+
+def collect_stats() -> dict:
+    """Operational counters for the running server."""
+    return {
+        "worker": {"index": WORKER_INDEX, "pid": os.getpid()},
+        "policy_cache": policy_cache.stats(),
+        "db_pools": {
+            "read": read_pool.stats(),
+            "version": version_pool.stats(),
+            "audit": audit_pool.stats(),
+            "sandbox": sandbox_pool.stats(),
+        },
+        "audit_writer": audit_writer.stats(),
+        "audit_archive": audit_archiver.stats(),
+        "snapshot": snapshot.stats() if snapshot is not None else {"serving": "file"},
+        "result_cache": result_cache.stats(),
+        "schema_cache": schema_cache.stats(),
+        "open_cursors": len(cursors),
+        "speculation": {"enabled": RUN_SQL_SPECULATIVE, **speculation_stats},
+        "admission": admission.stats(),
+        "engine": {
+            "name": RUN_SQL_ENGINE,
+            **(analytic_engine.stats() if analytic_engine is not None else {}),
+        },
+    }
+
+
+@mcp.custom_route("/stats", methods=["GET"])
+async def stats_route(request: Request) -> JSONResponse:
+    """Expose ``collect_stats()`` as JSON (not an MCP tool, so agents never see it)."""
+    return JSONResponse(collect_stats())
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_route(request: Request) -> PlainTextResponse:
+    """Latency histograms and numeric ``collect_stats()`` counters for Prometheus."""
+    return PlainTextResponse(
+        metrics.render_prometheus(flatten_numbers(collect_stats())),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 # ---------------------------------------------------------------------------
 # 2️⃣  Tool: list_schema
 # ---------------------------------------------------------------------------
@@ -165,30 +1098,26 @@ async def list_schema() -> dict:
     """Return a dictionary of table schemas including *column names* and *data types*.
 
     This tool should be called **first** so the assistant can understand which
-    tables and columns exist _and_ what data type each column holds.
+    tables and columns exist _and_ what data type each column holds. Each table
+    also lists its row count, indexes and an estimate of the number of distinct
+    values per column, which helps choose filters and GROUP BY columns.
 
     Returns format:
         {
             "table_name": {
-                "COLUMN_A": "TEXT",
-                "COLUMN_B": "INTEGER",
-                ...
+                "columns": {"COLUMN_A": "TEXT", "COLUMN_B": "INTEGER", ...},
+                "row_count": 2000,
+                "indexes": [{"name": "...", "columns": ["COLUMN_A"], "unique": false}],
+                "cardinality": {"COLUMN_A": 25, "COLUMN_B": 2000, ...}
             },
             ...
         }
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        tbl_cur = await db.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';"
-        )
-        tables = [row[0] for row in await tbl_cur.fetchall() if row[0].lower() != "audit_log"]
-
-        schema: dict[str, dict[str, str]] = {}
-        for t in tables:
-            col_cur = await db.execute(f"PRAGMA table_info({t});")
-            # SQLite PRAGMA table_info columns: cid, name, type, notnull, dflt_value, pk
-            schema[t] = {row[1]: row[2] for row in await col_cur.fetchall()}
-        return schema
+    # Built once and reused until the schema or data changes
+    schema, cached = await schema_cache.get()
+    _audit_details.get({})["result_cache"] = "hit" if cached else "miss"
+    # The rollup is an implementation detail of run_sql, not something to query directly
+    return {table: info for table, info in schema.items() if table != ROLLUP_TABLE}
 
 
 # ---------------------------------------------------------------------------
@@ -204,10 +1133,7 @@ async def get_study_protocol() -> str:
     The server provides this document to explain the data governance rules
     defined in *study_protocol.md*.
     """
-    # Read protocol file contents
-    with open(PROTOCOL_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
-    return content
+    return read_protocol()
 
 
 # ---------------------------------------------------------------------------
@@ -217,16 +1143,37 @@ async def get_study_protocol() -> str:
 
 @mcp.tool(name="run_sql")
 @audit_log
-async def run_sql(query: str, params: list | None = None) -> dict:
+@admitted
+async def run_sql(
+    query: str,
+    params: list | None = None,
+    page_size: int | None = None,
+    format: str = "rows",
+) -> dict:
     """Execute a SQL query against the clinical database and return the results.
 
     Parameters:
         query: A SQL SELECT statement (only SELECT statements are allowed)
         params: Optional list of parameters for parameterized queries
+        page_size: Optional number of rows per page (default 500)
+        format: "rows" (default, list of row dictionaries), "columnar" (column names
+            and types once, then rows as value lists - much smaller for wide or long
+            results), or "arrow" / "parquet" (base64-encoded binary for bulk export)
 
     Returns:
-        A dictionary with "rows" (list of row dictionaries) and "rowcount" (number of rows)
+        A dictionary with the page in the requested format ("rows" for "rows";
+        "columns", "types" and "data" for "columnar"; "columns" plus a base64
+        "arrow" or "parquet" payload otherwise), "rowcount" (rows in this page),
+        "next_token" (pass to fetch_more for the next page, or null when done)
+        and "truncated" (true if a server-side size limit cut the result short),
+        plus "warning" if the query is costly but was allowed to run, and
+        "suppressed_rows" if rows shared by too few subjects were left out
         Or a dictionary with "error" (error message) if the query violates the protocol
+        ("error_type": "too_few_subjects" when its rows cover fewer than 5 subjects),
+        or with "error_type": "query_too_expensive" (and the estimate or budget that
+        was exceeded) if it would be, or became, too expensive to run, or with
+        "error_type": "overloaded" and "retry_after" (seconds) if the server is busy
+        or this session is sending calls too fast
 
     Always call list_schema first to verify table and column names.
 
@@ -235,46 +1182,342 @@ async def run_sql(query: str, params: list | None = None) -> dict:
         study_protocol.md. The client MUST consult and adhere to that
         protocol before issuing queries.
     """
-    # Ask LLM if the query is allowed under the study protocol
-    allowed, reason = await llm_policy_check(query)
+    if format not in RESULT_FORMATS:
+        return {
+            "error": f"Unknown format {format!r}. Use one of: {', '.join(RESULT_FORMATS)}.",
+            "rows": [],
+            "rowcount": 0,
+        }
+
+    params, page_size = params or [], page_size or RESULT_PAGE_SIZE
+    speculation = None
+    # Audit details and stage timings of the speculative read, kept only if allowed
+    speculated: dict = {}
+    speculated_stages: list = []
+    if RUN_SQL_SPECULATIVE and may_speculate(query):
+        # Read the first page while the policy check runs; the rows stay inside this
+        # task (not cached, not returned) until the verdict is known
+        speculation = asyncio.create_task(
+            speculate(query, params, page_size, speculated, speculated_stages)
+        )
+        speculation_stats["started"] += 1
+
+    # Check the query against the study protocol (local rules first, then the LLM)
+    try:
+        allowed, reason, path, min_subjects = await policy_check(query)
+    except BaseException:
+        if speculation is not None:
+            await discard_speculation(speculation)
+        raise
+    _audit_details.get({})["policy_path"] = path
     if not allowed:
+        if speculation is not None:
+            await discard_speculation(speculation)
         # Return a message instead of raising an error
+        return protocol_violation(reason)
+
+    if speculation is not None:
+        speculation_stats["used"] += 1
+    result = await execute_allowed(query, params, page_size, format, speculation, min_subjects)
+    _audit_details.get({}).update(speculated)
+    metrics.replay(speculated_stages)
+    return result
+
+
+def protocol_violation(reason: str) -> dict:
+    return {
+        "error": (
+            f"Protocol violation: {reason}. You can view the study protocol "
+            f"with the get_study_protocol tool."
+        ),
+        "rows": [],
+        "rowcount": 0,
+    }
+
+
+async def execute_allowed(
+    query: str,
+    params: list,
+    page_size: int,
+    format: str,
+    speculation: asyncio.Task | None = None,
+    min_subjects: bool = False,
+) -> dict:
+    """First page of a query that passed the policy check, or a run_sql error dictionary."""
+    try:
+        return await read_page(
+            query, params, 0, page_size, format, speculation, min_subjects=min_subjects
+        )
+    except QueryTooExpensive as e:
+        return too_expensive(e)
+    except TooFewSubjects as e:
         return {
             "error": (
-                f"Protocol violation: {reason}. You can view the study protocol "
-                f"with the get_study_protocol tool."
+                f"Protocol violation: {e.reason} (study protocol §4). Widen the filter or "
+                f"aggregate (COUNT, AVG, ... with GROUP BY) instead of returning rows."
             ),
+            "error_type": "too_few_subjects",
+            "subjects": e.subjects,
+            "min_subjects": e.k,
+            "rows": [],
+            "rowcount": 0,
+        }
+    except sqlite3.DatabaseError as e:
+        # Surface a clear message so the assistant can correct itself (this includes
+        # "not authorized" for statements the read-only connections refuse)
+        return {
+            "error": f"SQL error: {e}. Did you check list_schema first?",
             "rows": [],
             "rowcount": 0,
         }
+    except ValueError as e:
+        # Arrow/Parquet unavailable or the column values have mixed types
+        return {"error": f"Encoding error: {e}. Try format='columnar'.", "rows": [], "rowcount": 0}
+
+
+# ---------------------------------------------------------------------------
+# 4️⃣  Tool: fetch_more
+# ---------------------------------------------------------------------------
+
+
+@mcp.tool(name="fetch_more")
+@audit_log
+@admitted
+async def fetch_more(next_token: str) -> dict:
+    """Return the next page of a run_sql result.
+
+    Parameters:
+        next_token: The "next_token" value from a previous run_sql or fetch_more response
+
+    Returns:
+        The same shape as the originating run_sql call (same format), with
+        "rowcount", "next_token" and "truncated". Tokens are single-use and
+        expire after a few minutes. If the server is busy, an "error" with
+        "error_type": "overloaded" and "retry_after" (seconds); the token stays valid.
+    """
+    continuation = cursors.take(next_token)
+    if continuation is None:
+        return {
+            "error": "Unknown or expired next_token. Re-run the query with run_sql.",
+            "rows": [],
+            "rowcount": 0,
+        }
+    try:
+        return await read_page(
+            continuation.query,
+            continuation.params,
+            continuation.offset,
+            continuation.page_size,
+            continuation.fmt,
+            small_classes=continuation.small_classes,
+        )
+    except QueryTooExpensive as e:
+        return too_expensive(e)
+    except sqlite3.DatabaseError as e:
+        return {"error": f"SQL error: {e}.", "rows": [], "rowcount": 0}
+    except ValueError as e:
+        return {"error": f"Encoding error: {e}.", "rows": [], "rowcount": 0}
+
+
+# ---------------------------------------------------------------------------
+# 5️⃣  Tool: run_sql_batch
+# ---------------------------------------------------------------------------
+
+
+@mcp.tool(name="run_sql_batch")
+async def run_sql_batch(
+    queries: list[dict],
+    page_size: int | None = None,
+    format: str = "rows",
+) -> dict:
+    """Execute several independent SQL queries in one call and return each result.
+
+    Use this instead of consecutive run_sql calls when a question needs several
+    queries that do not depend on each other's results (e.g. counts by site and
+    counts by month). They are checked against the study protocol together and
+    run concurrently.
+
+    Parameters:
+        queries: A list of up to 10 objects, each {"query": "SELECT ...", "params": [...]}
+            ("params" is optional)
+        page_size: Optional number of rows per page for every query (default 500)
+        format: Result format for every query, as for run_sql
+
+    Returns:
+        {"results": [...]} with one entry per query, in the order given: exactly
+        what run_sql would return for that query (a page of rows with
+        "next_token" for fetch_more, or a dictionary with "error")
+        Or a dictionary with "error" if the batch itself is malformed or the
+        server is busy ("error_type": "overloaded" with "retry_after")
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    Always call list_schema first to verify table and column names, and follow
+    study_protocol.md: every query is subject to the same rules as in run_sql.
+    """
+    if batch_problem(queries, format) is not None:
+        return await invalid_batch(queries=queries, page_size=page_size, format=format)
+
+    items = [(q["query"], q.get("params") or []) for q in queries]
+    page_size = page_size or RESULT_PAGE_SIZE
+    try:
+        async with admission.admit("run_sql_batch", session_key(), len(items)) as waited:
+            if waited >= 0.001:
+                metrics.record("admission.wait", waited)
+            # Local rules and cached verdicts first; one LLM call for all the rest
+            checking = asyncio.create_task(policy_check_batch([query for query, _ in items]))
+            results = await run_batch_queries(items, page_size, format, checking, waited)
+    except Overloaded as e:
+        await run_batch_queries(items, page_size, format, e, 0.0)
+        return {**overloaded(e), "results": []}
+    return {"results": results}
+
+
+def batch_problem(queries: list, format: str) -> str | None:
+    """What is wrong with a ``run_sql_batch`` call's arguments, or ``None``."""
+    if not queries or len(queries) > BATCH_MAX_QUERIES:
+        return f"Send between 1 and {BATCH_MAX_QUERIES} queries."
+    if not all(
+        isinstance(q, dict)
+        and isinstance(q.get("query"), str)
+        and isinstance(q.get("params") or [], list)
+        for q in queries
+    ):
+        return 'Each item must be {"query": "SELECT ...", "params": [...]}.'
+    if format not in RESULT_FORMATS:
+        return f"Unknown format {format!r}. Use one of: {', '.join(RESULT_FORMATS)}."
+    return None
+
+
+@audit_log(name="run_sql_batch")
+async def invalid_batch(queries: list, page_size: int | None, format: str) -> dict:
+    """The error for a malformed ``run_sql_batch`` call (audited as one row)."""
+    return {"error": batch_problem(queries, format), "results": []}
+
+
+async def run_batch_queries(
+    items: list[tuple[str, list]],
+    page_size: int,
+    format: str,
+    decided: asyncio.Task | Overloaded,
+    waited: float,
+) -> list[dict]:
+    """Run each query of a batch as its own ``audit_log`` call: one audit row per query.
+
+    *decided* is the batch's ``policy_check_batch`` task, or the ``Overloaded``
+    that turned the whole batch away.
+    """
+
+    @audit_log(name="run_sql_batch")
+    async def run_query(query: str, params: list, page_size: int, format: str, batch: dict) -> dict:
+        details = _audit_details.get({})
+        if isinstance(decided, Overloaded):
+            details["admission"] = f"rejected: {decided.reason}"
+            return overloaded(decided)
+        if waited >= 0.001:
+            details["admission"] = f"queued: {waited * 1000:.0f} ms"
         try:
-            async with db.execute(query, params or []) as cur:
-                rows = [dict(r) async for r in cur]
-        except sqlite3.OperationalError as e:
-            # Surface a clear message so the assistant can correct itself
-            return {
-                "error": f"SQL error: {e}. Did you check list_schema first?",
-                "rows": [],
-                "rowcount": 0,
-            }
+            verdict = (await asyncio.shield(decided))[batch["index"]]
+        except Exception as exc:
+            # Fail-safe: deny if the policy check itself fails
+            verdict = False, f"Policy check failed: {exc}", "error", False
+        allowed, reason, path, min_subjects = verdict
+        details["policy_path"] = path
+        if not allowed:
+            return protocol_violation(reason)
+        return await execute_allowed(query, params, page_size, format, min_subjects=min_subjects)
 
-    result = {"rows": rows, "rowcount": len(rows)}
+    return await asyncio.gather(
+        *(
+            run_query(
+                query=query,
+                params=params,
+                page_size=page_size,
+                format=format,
+                batch={"index": i, "size": len(items)},
+            )
+            for i, (query, params) in enumerate(items)
+        )
+    )
 
-    return result
+
+# ---------------------------------------------------------------------------
+# 6️⃣  Tool: server_stats
+# ---------------------------------------------------------------------------
+
+
+@mcp.tool(name="server_stats")
+@audit_log
+async def server_stats() -> dict:
+    """Return server latency and cache statistics, for diagnosing slow queries.
+
+    Returns format:
+        {
+            "latency": {
+                "tool": {"run_sql": {"count": 12, "mean_ms": ..., "p50_ms": ...,
+                                     "p95_ms": ..., "p99_ms": ...}, ...},
+                "stage": {"policy.llm": {...}, "sqlite.execute": {...}, ...}
+            },
+            "policy_cache": {...}, "db_pools": {...}, "result_cache": {...}, ...
+        }
+
+    Percentiles are estimated from histogram buckets.
+    """
+    return {"latency": metrics.snapshot(), **collect_stats()}
 
 
 # ---------------------------------------------------------------------------
-# 5️⃣  Entrypoint
+# 7️⃣  Entrypoint
 # ---------------------------------------------------------------------------
 
+
+def create_app() -> Starlette:
+    """Both transports on one app: SSE (``/sse``, ``/messages/``) and streamable HTTP (``/mcp``)."""
+    app = mcp.http_app(transport="streamable-http")
+    custom = set(map(id, mcp._additional_http_routes))
+    app.router.routes.extend(
+        route for route in mcp.http_app(transport="sse").routes if id(route) not in custom
+    )
+    mcp_lifespan = app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        async with mcp_lifespan(app):
+            system_prompt(read_protocol())  # compile the policy rules digest up front
+            watcher = None
+            if snapshot is not None:
+                await db_version()  # starts the first load; reads use the file until it is done
+                watcher = asyncio.create_task(_snapshot_watch_loop(), name="snapshot-watch")
+            if analytic_engine is not None:
+                analytic_engine.ready(await db_version())  # start building the mirror now
+            try:
+                yield
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+                    snapshot.close()
+                # Commit queued audit rows and cache hit counts before the process exits
+                await audit_writer.close()
+                await policy_cache.close()
+
+    app.router.lifespan_context = lifespan
+    return app
+
+
 if __name__ == "__main__":
-    asyncio.run(setup_audit_log())
-    # Always use port 8000 for MCP server
-    port = 8000
+    # Port 8000 unless overridden (e.g. by support/bench_load.py)
+    port = int(os.getenv("MCP_PORT", "8000"))
     # Always bind to all interfaces in container environment
     host = "0.0.0.0"
-    print(f"Starting MCP server on {host}:{port}")
-    mcp.run(transport="sse", host=host, port=port)
+    grace = MCP_SHUTDOWN_GRACE_SECONDS
+    if WORKER_SOCKET:
+        # A worker behind support/balancer.py, which already ran setup_audit_log
+        uvicorn.run(
+            create_app(), uds=WORKER_SOCKET, timeout_graceful_shutdown=grace, log_level="warning"
+        )
+    elif MCP_WORKERS > 1:
+        asyncio.run(setup_audit_log())
+        print(f"Starting MCP server on {host}:{port} with {MCP_WORKERS} workers")
+        serve(MCP_WORKERS, host, port, [sys.executable, os.path.abspath(__file__)], grace)
+    else:
+        asyncio.run(setup_audit_log())
+        print(f"Starting MCP server on {host}:{port}")
+        uvicorn.run(create_app(), host=host, port=port, timeout_graceful_shutdown=grace)
@@ -0,0 +1,262 @@
+"""
+Admission control for the MCP server's expensive tools (``run_sql``, ``fetch_more``).
+
+Each call passes two checks before it runs:
+
+* a token bucket per MCP session (``rate`` calls per second, bursts of up to
+  ``burst``), so one agent looping on a tool cannot take the policy LLM budget
+  and the SQLite connections from everyone else;
+* a concurrency limit per tool. Calls beyond it wait in a fair queue: a freed
+  slot goes to the session that has waited longest for its turn (round-robin
+  across sessions, FIFO within one), not to whichever session queued the most.
+
+When the bucket is empty, the queue is full (``max_queue`` per tool,
+``session_max_queue`` per session and tool) or a call waits longer than
+``queue_timeout``, ``Overloaded`` is raised at once with a ``retry_after`` hint
+instead of letting work pile up. A call turned away by the queue gets its rate
+tokens back, so rejections do not use up the session's budget. ``stats()``
+reports queue depth, waits and rejections by reason.
+"""
+
+import asyncio
+import collections
+import contextlib
+import time
+from typing import AsyncIterator
+
+MAX_SESSIONS = 10_000  # least recently seen sessions' buckets are forgotten beyond this
+
+
+class Overloaded(Exception):
+    """A call was refused by admission control; retrying after ``retry_after`` s may succeed."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``; starts full."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Take *cost* tokens and return 0, or return the seconds until they are available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost: float) -> None:
+        """Give back *cost* tokens taken for a call that did not run."""
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class FairGate:
+    """At most ``limit`` concurrent holders; waiters are served round-robin by session."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self.queued = 0
+        self._waiting: collections.OrderedDict[str, collections.deque[asyncio.Future]] = (
+            collections.OrderedDict()
+        )
+
+    def queued_for(self, session: str) -> int:
+        return len(self._waiting.get(session, ()))
+
+    async def acquire(self, session: str, timeout: float) -> bool:
+        """Take a slot, waiting up to *timeout* s; ``False`` if it timed out."""
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(session, collections.deque()).append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # granted just as we gave up: pass the slot on
+            else:
+                self._forget(session, waiter)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            return False
+
+    def release(self) -> None:
+        self.active -= 1
+        while self._waiting:
+            # The session at the front has waited longest for its turn
+            session, waiters = self._waiting.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting[session] = waiters
+            self.queued -= 1
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+                return
+
+    def _forget(self, session: str, waiter: asyncio.Future) -> None:
+        waiters = self._waiting.get(session)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self.queued -= 1
+            if not waiters:
+                del self._waiting[session]
+
+
+class AdmissionController:
+    """Per-session rate limits plus per-tool fair concurrency limits (see the module docstring).
+
+    ``rate=0`` turns rate limiting off; tools missing from *concurrency* are not limited.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        concurrency: dict[str, int],
+        *,
+        max_queue: int = 64,
+        session_max_queue: int = 8,
+        queue_timeout: float = 10.0,
+    ):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_queue = max_queue
+        self.session_max_queue = session_max_queue
+        self.queue_timeout = queue_timeout
+        self.gates = {tool: FairGate(limit) for tool, limit in concurrency.items()}
+        self._buckets: collections.OrderedDict[str, TokenBucket] = collections.OrderedDict()
+        # Mean seconds a call holds its slot (exponentially weighted), for retry_after hints
+        self._hold_seconds = {tool: 0.1 for tool in self.gates}
+        self.counters = {
+            tool: {
+                "admitted": 0,
+                "queued": 0,
+                "wait_seconds_total": 0.0,
+                "wait_seconds_max": 0.0,
+                "queue_depth_max": 0,
+                "rejected": {"rate_limit": 0, "queue_full": 0, "queue_timeout": 0},
+            }
+            for tool in self.gates
+        }
+
+    def _bucket(self, session: str) -> TokenBucket:
+        bucket = self._buckets.get(session)
+        if bucket is None:
+            bucket = self._buckets[session] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > MAX_SESSIONS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(session)
+        return bucket
+
+    def _reject(self, tool: str, reason: str, message: str, retry_after: float) -> Overloaded:
+        if tool in self.counters:
+            self.counters[tool]["rejected"][reason] += 1
+        return Overloaded(message, round(max(retry_after, 0.1), 1))
+
+    def _queue_retry_after(self, tool: str) -> float:
+        gate = self.gates[tool]
+        return self._hold_seconds[tool] * (gate.queued + 1) / gate.limit
+
+    @contextlib.asynccontextmanager
+    async def admit(self, tool: str, session: str, cost: float = 1.0) -> AsyncIterator[float]:
+        """Hold an admission for one *tool* call of *session*; yields the seconds queued.
+
+        *cost* is the number of rate-limit tokens the call takes (e.g. one per query
+        of a batch, capped at ``burst``). Raises ``Overloaded`` on entry if the call
+        must not run now.
+        """
+        bucket, cost = None, min(cost, self.burst)
+        if self.rate > 0:
+            bucket = self._bucket(session)
+            wait = bucket.take(cost)
+            if wait:
+                raise self._reject(
+                    tool, "rate_limit", f"more than {self.rate:g} calls/s from this session", wait
+                )
+        gate = self.gates.get(tool)
+        if gate is None:
+            yield 0.0
+            return
+
+        try:
+            waited = await self._enter(tool, gate, session)
+        except (Overloaded, asyncio.CancelledError):
+            if bucket is not None:
+                bucket.refund(cost)
+            raise
+        admitted = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            gate.release()
+            held = time.perf_counter() - admitted
+            self._hold_seconds[tool] += 0.1 * (held - self._hold_seconds[tool])
+
+    async def _enter(self, tool: str, gate: FairGate, session: str) -> float:
+        """Take a slot of *gate*, queueing if need be; returns the seconds waited."""
+        c = self.counters[tool]
+        if gate.active >= gate.limit or gate.queued:
+            if gate.queued >= self.max_queue:
+                raise self._reject(
+                    tool,
+                    "queue_full",
+                    f"{gate.queued} {tool} calls already queued",
+                    self._queue_retry_after(tool),
+                )
+            if gate.queued_for(session) >= self.session_max_queue:
+                raise self._reject(
+                    tool,
+                    "queue_full",
+                    f"{gate.queued_for(session)} {tool} calls from this session already queued",
+                    self._queue_retry_after(tool),
+                )
+            c["queued"] += 1
+            c["queue_depth_max"] = max(c["queue_depth_max"], gate.queued + 1)
+        started = time.perf_counter()
+        if not await gate.acquire(session, self.queue_timeout):
+            raise self._reject(
+                tool,
+                "queue_timeout",
+                f"no {tool} slot within {self.queue_timeout:g} s",
+                self._queue_retry_after(tool),
+            )
+        waited = time.perf_counter() - started
+        c["admitted"] += 1
+        c["wait_seconds_total"] += waited
+        c["wait_seconds_max"] = max(c["wait_seconds_max"], waited)
+        return waited
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "sessions": len(self._buckets),
+            "tools": {
+                tool: {
+                    "limit": gate.limit,
+                    "active": gate.active,
+                    "queue_depth": gate.queued,
+                    **self.counters[tool],
+                    "wait_seconds_avg": self.counters[tool]["wait_seconds_total"]
+                    / self.counters[tool]["admitted"]
+                    if self.counters[tool]["admitted"]
+                    else 0.0,
+                }
+                for tool, gate in self.gates.items()
+            },
+        }
@@ -0,0 +1,148 @@
+"""
+Background writer for the ``audit_log`` table.
+
+Tool calls hand their audit row to ``AuditWriter.write()`` and return immediately;
+a single background task drains the queue in FIFO order and inserts rows in
+batched transactions, flushing when ``batch_size`` rows are waiting or
+``flush_interval`` seconds have passed since the first one arrived.
+
+* Ordering is preserved: one consumer, one writer connection, FIFO queue.
+* Backpressure: the queue is bounded, so callers wait once it is full.
+* Shutdown: queued rows are written when the task is cancelled or ``close()``d.
+* ``durability="sync"`` skips the queue and commits before ``write()`` returns.
+"""
+
+import asyncio
+import logging
+import time
+
+from support.db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ("batched", "sync")
+
+
+class AuditWriter:
+    """Queue audit rows (dicts keyed by column name) and insert them in batches."""
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        insert_sql: str,
+        *,
+        durability: str = "batched",
+        batch_size: int = 200,
+        flush_interval: float = 0.05,
+        max_queue: int = 10_000,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, got {durability!r}")
+        self.pool = pool
+        self.insert_sql = insert_sql
+        self.durability = durability
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_queue)
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._batch: list[dict] = []
+        self._inflight: asyncio.Future | None = None
+        self.counters = {
+            "written": 0,
+            "batches": 0,
+            "max_batch": 0,
+            "backpressure_waits": 0,
+            "errors": 0,
+            "flush_seconds_total": 0.0,
+        }
+
+    async def write(self, row: dict) -> None:
+        """Record one audit row (batched mode returns before it is committed)."""
+        if self.durability == "sync":
+            await self._insert([row])
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="audit-writer")
+        if self._queue.full():
+            self.counters["backpressure_waits"] += 1
+        await self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+
+    async def flush(self) -> None:
+        """Wait until every queued row has been committed."""
+        if self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Flush queued rows and stop the background task."""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _insert(self, rows: list[dict]) -> None:
+        started = time.perf_counter()
+        async with self.pool.acquire() as db:
+            await db.executemany(self.insert_sql, rows)
+            await db.commit()
+        self.counters["written"] += len(rows)
+        self.counters["batches"] += 1
+        self.counters["max_batch"] = max(self.counters["max_batch"], len(rows))
+        self.counters["flush_seconds_total"] += time.perf_counter() - started
+
+    async def _commit_batch(self) -> None:
+        rows, self._batch = self._batch, []
+        try:
+            # Shielded: once a batch is handed to SQLite, cancellation must not abandon it
+            self._inflight = asyncio.ensure_future(self._insert(rows))
+            await asyncio.shield(self._inflight)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.counters["errors"] += 1
+            logger.exception("Failed to write %d audit rows", len(rows))
+        finally:
+            for _ in rows:
+                self._queue.task_done()
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                self._batch.append(await self._queue.get())
+                if self._queue.qsize() + 1 < self.batch_size:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                self._full.clear()
+                while len(self._batch) < self.batch_size and not self._queue.empty():
+                    self._batch.append(self._queue.get_nowait())
+                await self._commit_batch()
+        except asyncio.CancelledError:
+            # Shutdown: commit the batch in hand and everything still queued
+            if self._inflight is not None and not self._inflight.done():
+                await asyncio.wait([self._inflight])
+            while not self._queue.empty():
+                self._batch.append(self._queue.get_nowait())
+            if self._batch:
+                rows, self._batch = self._batch, []
+                await self._insert(rows)
+                for _ in rows:
+                    self._queue.task_done()
+            raise
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            "durability": self.durability,
+            "queued": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            **c,
+            "avg_batch": c["written"] / c["batches"] if c["batches"] else 0.0,
+        }
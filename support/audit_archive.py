@@ -0,0 +1,195 @@
+"""
+Retention and compressed archival for the audit log.
+
+The live ``audit_log`` table lives in its own SQLite file (``audit.db``), so audit
+writes never contend with reads of ``clinical.db``. ``AuditArchiver.run()`` moves
+rows out of it into monthly partitions under ``archive_dir``
+(``audit_log-YYYY-MM.jsonl.gz``: one JSON object per row, one gzip member per pass):
+
+* by age: rows older than ``retention_days``;
+* by size: whole months, oldest first, while the live data exceeds
+  ``max_live_bytes`` (the current month always stays live).
+
+Rows are appended to their partition and fsynced before they are deleted from the
+live table, in small transactions so the writer is never blocked for long. A crash
+in between leaves a row in both places; ``query_audit`` returns the live copy.
+
+``query_audit`` pages newest-first through the live table and then the archives,
+with the same ``AuditFilter`` the dashboard uses.
+"""
+
+import datetime
+import functools
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import time
+
+from support.audit_query import COLUMNS, AuditFilter, fetch_page
+
+PARTITION_FORMAT = "audit_log-{month}.jsonl.gz"
+
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+
+def archive_partitions(archive_dir: str) -> list[tuple[str, str]]:
+    """``(month, path)`` for every archive partition, newest first."""
+    paths = glob.glob(os.path.join(archive_dir, PARTITION_FORMAT.format(month="*")))
+    months = [(os.path.basename(p)[len("audit_log-") : -len(".jsonl.gz")], p) for p in paths]
+    return sorted(months, reverse=True)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_partition(path: str, mtime_ns: int, size: int) -> tuple[dict, ...]:
+    rows: dict[int, dict] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            rows.setdefault(row["id"], row)  # a re-archived duplicate keeps the first copy
+    return tuple(sorted(rows.values(), key=lambda r: r["id"], reverse=True))
+
+
+def read_partition(path: str) -> tuple[dict, ...]:
+    """Rows of one partition, newest first (parsed once per file version)."""
+    st = os.stat(path)
+    return _load_partition(path, st.st_mtime_ns, st.st_size)
+
+
+def query_audit(
+    conn: sqlite3.Connection,
+    archive_dir: str,
+    flt: AuditFilter,
+    before_id: int | None = None,
+    limit: int = 50,
+) -> list[tuple]:
+    """Up to *limit* matching rows with ``id < before_id``, newest first, live and archived.
+
+    Partitions are read newest first and reading stops at one whose ids all sort
+    below the page already collected (ids grow with time).
+    """
+    rows = fetch_page(conn, flt, before_id, limit)
+    for month, path in archive_partitions(archive_dir):
+        if flt.until and f"{month}-01" >= flt.until:
+            continue
+        if flt.since and f"{_next_month(month)}-01" <= flt.since:
+            break  # this and every older partition end before the range
+        partition = read_partition(path)
+        if len(rows) >= limit and (not partition or partition[0]["id"] < rows[-1][0]):
+            break
+        found = []
+        for row in partition:
+            if before_id is not None and row["id"] >= before_id:
+                continue
+            if flt.matches(row):
+                found.append(row)
+                if len(found) >= limit:
+                    break
+        if found:
+            # A crash between archiving and deleting leaves a row in both places
+            marks = ", ".join("?" * len(found))
+            live = conn.execute(
+                f"SELECT id FROM audit_log WHERE id IN ({marks});", [r["id"] for r in found]
+            )
+            duplicates = {i for (i,) in live}
+            rows += [tuple(r.get(c) for c in COLUMNS) for r in found if r["id"] not in duplicates]
+            rows = sorted(rows, key=lambda r: r[0], reverse=True)[:limit]
+    return rows
+
+
+class AuditArchiver:
+    """Moves aged-out (or, over the size budget, oldest) audit rows into compressed partitions."""
+
+    def __init__(
+        self,
+        db_path: str,
+        archive_dir: str,
+        *,
+        retention_days: float = 90,
+        max_live_bytes: int = 256 * 1024 * 1024,
+        batch_rows: int = 5000,
+    ):
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.max_live_bytes = max_live_bytes
+        self.batch_rows = batch_rows
+        self.counters = {"runs": 0, "archived_rows": 0, "seconds_total": 0.0, "last_run": None}
+
+    def run(self, now: datetime.datetime | None = None) -> int:
+        """One retention pass (blocking; call via ``asyncio.to_thread``). Returns rows archived."""
+        started = time.perf_counter()
+        now = now or datetime.datetime.now()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        moved = 0
+        try:
+            if self.retention_days > 0:
+                cutoff = str(now - datetime.timedelta(days=self.retention_days))
+                moved += self._archive(conn, cutoff)
+            current = now.strftime("%Y-%m")
+            while self.max_live_bytes > 0 and self.live_bytes(conn) > self.max_live_bytes:
+                (oldest,) = conn.execute("SELECT MIN(timestamp) FROM audit_log;").fetchone()
+                if oldest is None or oldest[:7] >= current:
+                    break
+                archived = self._archive(conn, f"{_next_month(oldest[:7])}-01")
+                if not archived:
+                    break
+                moved += archived
+        finally:
+            conn.close()
+        self.counters["runs"] += 1
+        self.counters["archived_rows"] += moved
+        self.counters["seconds_total"] += time.perf_counter() - started
+        self.counters["last_run"] = now.isoformat(timespec="seconds")
+        return moved
+
+    @staticmethod
+    def live_bytes(conn: sqlite3.Connection) -> int:
+        """Bytes in use by the live database (free pages excluded)."""
+        (page_size,) = conn.execute("PRAGMA page_size;").fetchone()
+        (pages,) = conn.execute("PRAGMA page_count;").fetchone()
+        (free,) = conn.execute("PRAGMA freelist_count;").fetchone()
+        return page_size * (pages - free)
+
+    def _archive(self, conn: sqlite3.Connection, before: str) -> int:
+        """Move every row with ``timestamp < before`` into its month's partition."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        moved = 0
+        while True:
+            cur = conn.execute(
+                "SELECT * FROM audit_log WHERE timestamp < ? ORDER BY id LIMIT ?;",
+                (before, self.batch_rows),
+            )
+            names = [d[0] for d in cur.description]
+            rows = [dict(zip(names, r)) for r in cur.fetchall()]
+            if not rows:
+                return moved
+            by_month: dict[str, list[dict]] = {}
+            for row in rows:
+                by_month.setdefault(str(row["timestamp"])[:7], []).append(row)
+            for month, group in by_month.items():
+                path = os.path.join(self.archive_dir, PARTITION_FORMAT.format(month=month))
+                with open(path, "ab") as raw:
+                    with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                        for row in group:
+                            gz.write((json.dumps(row, default=str) + "\n").encode("utf-8"))
+                    raw.flush()
+                    os.fsync(raw.fileno())
+            with conn:
+                conn.execute(
+                    "DELETE FROM audit_log WHERE id BETWEEN ? AND ? AND timestamp < ?;",
+                    (rows[0]["id"], rows[-1]["id"], before),
+                )
+            moved += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "retention_days": self.retention_days,
+            "max_live_bytes": self.max_live_bytes,
+            "partitions": len(archive_partitions(self.archive_dir)),
+        }
@@ -0,0 +1,98 @@
+"""
+Read-side queries for the live ``audit_log`` table (the dashboard's Audit Log tab).
+
+Pages are keyset-paginated on ``id``, newest first, and a refresh fetches only
+rows with ``id`` above the newest one already shown, so nothing is re-read.
+Filters are served by the indexes ``clinical_mcp.setup_audit_log`` creates on
+``timestamp``, ``(tool_name, id)`` and ``(approved, id)``. Archived rows are
+read through ``support.audit_archive.query_audit``.
+"""
+
+import sqlite3
+from dataclasses import dataclass
+
+COLUMNS = (
+    "id",
+    "timestamp",
+    "tool_name",
+    "arguments",
+    "approved",
+    "policy_path",
+    "result_cache",
+    "cost_guard",
+    "query_rewrite",
+    "stage_timings",
+    "k_anonymity",
+    "engine",
+    "admission",
+)
+
+
+@dataclass(frozen=True)
+class AuditFilter:
+    tools: tuple[str, ...] = ()  # empty: every tool
+    approved: bool | None = None
+    since: str | None = None  # ISO timestamp, inclusive
+    until: str | None = None  # ISO timestamp, exclusive
+
+    def where(self) -> tuple[list[str], list]:
+        clauses: list[str] = []
+        args: list = []
+        if self.tools:
+            clauses.append(f"tool_name IN ({', '.join('?' * len(self.tools))})")
+            args.extend(self.tools)
+        if self.approved is not None:
+            clauses.append("approved = ?")
+            args.append(self.approved)
+        if self.since:
+            clauses.append("timestamp >= ?")
+            args.append(self.since)
+        if self.until:
+            clauses.append("timestamp < ?")
+            args.append(self.until)
+        return clauses, args
+
+    def matches(self, row: dict) -> bool:
+        """Same test as ``where()``, for rows read from an archive."""
+        if self.tools and row.get("tool_name") not in self.tools:
+            return False
+        if self.approved is not None and bool(row.get("approved")) != self.approved:
+            return False
+        timestamp = str(row.get("timestamp") or "")
+        if self.since and timestamp < self.since:
+            return False
+        return not (self.until and timestamp >= self.until)
+
+
+def _select(conn: sqlite3.Connection, clauses: list[str], args: list, limit: int) -> list[tuple]:
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    cur = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM audit_log {where}ORDER BY id DESC LIMIT ?;",
+        [*args, limit],
+    )
+    return cur.fetchall()
+
+
+def fetch_page(
+    conn: sqlite3.Connection, flt: AuditFilter, before_id: int | None = None, limit: int = 50
+) -> list[tuple]:
+    """Up to *limit* matching rows with ``id < before_id`` (or the newest), newest first."""
+    clauses, args = flt.where()
+    if before_id is not None:
+        clauses.append("id < ?")
+        args.append(before_id)
+    return _select(conn, clauses, args, limit)
+
+
+def fetch_newer(
+    conn: sqlite3.Connection, flt: AuditFilter, after_id: int, limit: int = 50
+) -> list[tuple]:
+    """Up to *limit* matching rows with ``id > after_id``, newest first."""
+    clauses, args = flt.where()
+    clauses.append("id > ?")
+    args.append(after_id)
+    return _select(conn, clauses, args, limit)
+
+
+def tool_names(conn: sqlite3.Connection) -> list[str]:
+    return [row[0] for row in conn.execute("SELECT DISTINCT tool_name FROM audit_log ORDER BY 1;")]
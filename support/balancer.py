@@ -0,0 +1,381 @@
+"""
+Session-affine front end for running the MCP server as several worker processes.
+
+With ``MCP_WORKERS=N`` (N > 1), ``clinical_mcp.py`` serves this balancer on the public
+port and starts N copies of itself, each serving the same app on a private Unix
+socket. An MCP session's state (its SSE stream or streamable-HTTP session, and the
+``fetch_more`` cursors it opened) lives in one process, so every request of a
+session is sent to the worker that created it:
+
+* SSE: ``GET /sse`` goes to the least busy worker. The session id in the stream's
+  ``endpoint`` event is remembered, and ``POST /messages/?session_id=...`` goes
+  to the same worker.
+* Streamable HTTP: the ``mcp-session-id`` header returned by ``initialize`` is
+  remembered, and later requests carrying it go to the same worker.
+
+Requests outside a session go to the least busy worker. ``/stats`` and ``/metrics``
+combine the output of every worker. A worker that exits is restarted; the sessions
+it held are dropped and their clients must reconnect. New requests go only to
+workers that answer: a restarted worker rejoins once its socket serves ``/stats``.
+"""
+
+import asyncio
+import collections
+import contextlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+import anyio
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+SESSION_HEADER = "mcp-session-id"
+MAX_SESSIONS = 10_000  # least recently used sessions are forgotten beyond this
+_SSE_SESSION = re.compile(rb"session_id=([0-9a-fA-F]+)")
+# Per-connection headers; httpx and uvicorn set their own. Host is kept, so redirects
+# issued by a worker (e.g. /mcp -> /mcp/) point back at the balancer
+_HOP_HEADERS = {
+    "connection",
+    "content-length",
+    "keep-alive",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+_ALL_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"]
+
+
+class Worker:
+    """One server process listening on a Unix socket."""
+
+    def __init__(self, index: int, socket_path: str, command: list[str]):
+        self.index = index
+        self.socket_path = socket_path
+        self.command = command
+        self.process: subprocess.Popen | None = None
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=socket_path),
+            base_url="http://worker",
+            timeout=httpx.Timeout(None, connect=5.0),  # SSE streams stay open indefinitely
+        )
+        self.active = 0  # open requests and streams
+        self.ready = False  # serving on its socket; new requests go only to ready workers
+        self.counters = {"requests": 0, "restarts": 0}
+
+    def start(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+        env = {**os.environ, "MCP_WORKER_INDEX": str(self.index)}
+        env["MCP_WORKER_SOCKET"] = self.socket_path
+        # Own session: a terminal Ctrl+C reaches the balancer, which then stops the workers
+        self.process = subprocess.Popen(self.command, env=env, start_new_session=True)
+
+    async def wait_ready(self, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"worker {self.index} exited with {self.process.returncode}")
+            try:
+                response = await self.client.get("/stats")
+                if response.status_code == 200:
+                    self.ready = True
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"worker {self.index} not ready after {timeout:.0f}s")
+            await asyncio.sleep(0.2)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()  # uvicorn shuts down and the audit writer flushes
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "pid": self.process.pid if self.process else None,
+            "ready": self.ready,
+            "active": self.active,
+        }
+
+
+class Balancer:
+    """Routes each MCP session to one worker (see the module docstring)."""
+
+    def __init__(self, workers: list[Worker]):
+        self.workers = workers
+        self.sessions: collections.OrderedDict[str, Worker] = collections.OrderedDict()
+        self.counters = {"requests": 0, "unknown_sessions": 0, "worker_errors": 0}
+        self._monitor: asyncio.Task | None = None
+        self._restarts: dict[int, asyncio.Task] = {}
+
+    # -- routing -------------------------------------------------------------
+
+    def pick(self) -> Worker:
+        candidates = [w for w in self.workers if w.ready] or self.workers
+        return min(candidates, key=lambda w: (w.active, w.counters["requests"]))
+
+    def remember(self, session_id: str, worker: Worker) -> None:
+        self.sessions[session_id] = worker
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > MAX_SESSIONS:
+            self.sessions.popitem(last=False)
+
+    def lookup(self, session_id: str) -> Worker | None:
+        worker = self.sessions.get(session_id)
+        if worker is not None:
+            self.sessions.move_to_end(session_id)
+        else:
+            self.counters["unknown_sessions"] += 1
+        return worker
+
+    async def forward(self, request: Request, worker: Worker, on_chunk=None, on_close=None):
+        """Proxy *request* to *worker*, streaming the response back."""
+        self.counters["requests"] += 1
+        worker.counters["requests"] += 1
+        url = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        headers = [(k, v) for k, v in request.headers.raw if k.decode().lower() not in _HOP_HEADERS]
+        outgoing = worker.client.build_request(
+            request.method, url, headers=headers, content=await request.body()
+        )
+        worker.active += 1
+        try:
+            upstream = await worker.client.send(outgoing, stream=True)
+        except httpx.TransportError as e:
+            worker.active -= 1
+            self.counters["worker_errors"] += 1
+            if isinstance(e, httpx.ConnectError):
+                worker.ready = False  # e.g. it just crashed; _watch brings it back
+            return JSONResponse({"error": f"worker {worker.index} unavailable: {e}"}, 502)
+
+        async def body():
+            try:
+                async for chunk in upstream.aiter_raw():
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+                    yield chunk
+            finally:
+                worker.active -= 1
+                if on_close is not None:
+                    on_close()
+                with anyio.CancelScope(shield=True):
+                    await upstream.aclose()
+
+        return StreamingResponse(
+            body(),
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_HEADERS},
+        )
+
+    async def sse(self, request: Request) -> Response:
+        worker = self.pick()
+        state = {"buffer": b"", "session": None}
+
+        def on_chunk(chunk: bytes) -> None:
+            # The first event names the session's message endpoint
+            if state["session"] is None and len(state["buffer"]) < 4096:
+                state["buffer"] += chunk
+                match = _SSE_SESSION.search(state["buffer"])
+                if match:
+                    state["session"] = match.group(1).decode()
+                    self.remember(state["session"], worker)
+
+        def on_close() -> None:
+            if state["session"] is not None:
+                self.sessions.pop(state["session"], None)
+
+        return await self.forward(request, worker, on_chunk, on_close)
+
+    async def sse_message(self, request: Request) -> Response:
+        worker = self.lookup(request.query_params.get("session_id", ""))
+        if worker is None:
+            return Response("Could not find session", status_code=404)
+        return await self.forward(request, worker)
+
+    async def other(self, request: Request) -> Response:
+        """Streamable HTTP (affine on ``mcp-session-id``) and any other route."""
+        session_id = request.headers.get(SESSION_HEADER)
+        if session_id:
+            worker = self.lookup(session_id)
+            if worker is None:
+                return Response("Session not found", status_code=404)
+        else:
+            worker = self.pick()
+        response = await self.forward(request, worker)
+        created = response.headers.get(SESSION_HEADER)
+        if created and not session_id:
+            self.remember(created, worker)
+        if session_id and request.method == "DELETE" and response.status_code < 300:
+            self.sessions.pop(session_id, None)
+        return response
+
+    # -- aggregated endpoints ------------------------------------------------
+
+    async def _gather(self, path: str) -> dict[int, httpx.Response | None]:
+        async def get(worker: Worker) -> httpx.Response | None:
+            try:
+                return await worker.client.get(path, timeout=10.0)
+            except httpx.TransportError:
+                return None
+
+        responses = await asyncio.gather(*(get(w) for w in self.workers))
+        return {w.index: r for w, r in zip(self.workers, responses)}
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "sessions": len(self.sessions),
+            "workers": {w.index: w.stats() for w in self.workers},
+        }
+
+    async def stats_route(self, request: Request) -> JSONResponse:
+        gathered = await self._gather("/stats")
+        return JSONResponse(
+            {
+                "balancer": self.stats(),
+                "workers": {i: r.json() if r is not None else None for i, r in gathered.items()},
+            }
+        )
+
+    async def metrics_route(self, request: Request) -> PlainTextResponse:
+        gathered = await self._gather("/metrics")
+        texts = {i: r.text for i, r in gathered.items() if r is not None}
+        gauges = {
+            "balancer_sessions": len(self.sessions),
+            "balancer_workers_up": len(texts),
+            **{f"balancer_{k}": v for k, v in self.counters.items()},
+        }
+        return PlainTextResponse(
+            merge_prometheus(texts, gauges), media_type="text/plain; version=0.0.4"
+        )
+
+    # -- lifecycle -----------------------------------------------------------
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            for worker in self.workers:
+                restart = self._restarts.get(worker.index)
+                if restart is not None and not restart.done():
+                    continue
+                if worker.process is not None and worker.process.poll() is not None:
+                    rejoin = self._restart(worker)
+                elif not worker.ready:
+                    rejoin = self._rejoin(worker)  # running, but refused a connection
+                else:
+                    continue
+                self._restarts[worker.index] = asyncio.create_task(
+                    rejoin, name=f"balancer-rejoin-{worker.index}"
+                )
+
+    async def _restart(self, worker: Worker) -> None:
+        """Restart an exited worker; it gets new requests once it is ready, as at startup."""
+        worker.ready = False
+        for session_id, owner in list(self.sessions.items()):
+            if owner is worker:
+                del self.sessions[session_id]
+        worker.counters["restarts"] += 1
+        worker.start()
+        await self._rejoin(worker)
+
+    async def _rejoin(self, worker: Worker) -> None:
+        try:
+            await worker.wait_ready()
+        except RuntimeError:
+            # Exited again or never came up: make sure it is gone, and _watch retries
+            await asyncio.to_thread(worker.stop)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app: Starlette):
+        for worker in self.workers:
+            worker.start()
+        try:
+            await asyncio.gather(*(w.wait_ready() for w in self.workers))
+            self._monitor = asyncio.create_task(self._watch(), name="balancer-watch")
+            yield
+        finally:
+            if self._monitor is not None:
+                self._monitor.cancel()
+            for restart in self._restarts.values():
+                restart.cancel()
+            await asyncio.gather(*(asyncio.to_thread(w.stop) for w in self.workers))
+            for worker in self.workers:
+                await worker.client.aclose()
+
+    def app(self, sse_path: str = "/sse", message_path: str = "/messages/") -> Starlette:
+        return Starlette(
+            routes=[
+                Route("/stats", self.stats_route, methods=["GET"]),
+                Route("/metrics", self.metrics_route, methods=["GET"]),
+                Route(sse_path, self.sse, methods=["GET"]),
+                Route(message_path, self.sse_message, methods=["POST"]),
+                Route("/{path:path}", self.other, methods=_ALL_METHODS),
+            ],
+            lifespan=self.lifespan,
+        )
+
+
+def merge_prometheus(texts: dict[int, str], gauges: dict[str, float], namespace="clinical_mcp"):
+    """Combine per-worker exposition texts, labelling every sample with ``worker``."""
+    headers: dict[str, list[str]] = {}
+    samples: dict[str, list[str]] = {}
+    for index, text in sorted(texts.items()):
+        family = None
+        for line in text.splitlines():
+            if line.startswith("#"):
+                parts = line.split(None, 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = parts[2]
+                    if line not in headers.setdefault(family, []):
+                        headers[family].append(line)
+                continue
+            if not line.strip():
+                continue
+            series, _, value = line.rpartition(" ")
+            label = f'worker="{index}"'
+            if "{" in series:
+                series = series.replace("{", "{" + label + ",", 1)
+            else:
+                series = f"{series}{{{label}}}"
+            samples.setdefault(family or series, []).append(f"{series} {value}")
+    lines = []
+    for family in dict.fromkeys([*headers, *samples]):
+        lines += headers.get(family, [])
+        lines += samples.get(family, [])
+    for key, number in sorted(gauges.items()):
+        name = f"{namespace}_{key}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {float(number)!r}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(
+    workers: int, host: str, port: int, command: list[str], shutdown_grace: float = 3.0
+) -> None:
+    """Run *workers* copies of *command* behind the balancer on ``host:port`` (blocking)."""
+    socket_dir = tempfile.mkdtemp(prefix="clinical_mcp-")
+    try:
+        balancer = Balancer(
+            [
+                Worker(i, os.path.join(socket_dir, f"worker-{i}.sock"), command)
+                for i in range(workers)
+            ]
+        )
+        uvicorn.run(balancer.app(), host=host, port=port, timeout_graceful_shutdown=shutdown_grace)
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
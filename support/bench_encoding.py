@@ -0,0 +1,98 @@
+"""
+Compare the size and encode time of ``run_sql`` result formats.
+
+Reads rows from ``clinical.db`` and encodes them the way the MCP server would:
+
+* ``rows/indent``  - row dicts through FastMCP's default serializer (indent=2)
+* ``rows``         - row dicts, compact JSON (the server's serializer)
+* ``columnar``     - column names/types once, rows as value lists
+* ``arrow`` / ``parquet`` - base64 binary payloads (skipped without pyarrow)
+
+    python -m support.bench_encoding --rows 500 2000 --repeat 20
+"""
+
+import argparse
+import json
+import sqlite3
+import statistics
+import time
+
+import pydantic_core
+
+from support.results import encode_page, to_json
+
+
+def load_rows(db_path: str, limit: int) -> tuple[list[str], list[tuple]]:
+    with sqlite3.connect(db_path) as conn:
+        cur = conn.execute("SELECT * FROM clinical LIMIT ?;", (limit,))
+        return [d[0] for d in cur.description], cur.fetchall()
+
+
+def encoders() -> dict:
+    def indented(columns, rows):
+        page = encode_page(columns, rows, "rows")
+        return pydantic_core.to_json(page, fallback=str, indent=2).decode()
+
+    cases = {
+        "rows/indent": indented,
+        "rows": lambda c, r: to_json(encode_page(c, r, "rows")),
+        "columnar": lambda c, r: to_json(encode_page(c, r, "columnar")),
+    }
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return cases
+    cases["arrow"] = lambda c, r: to_json(encode_page(c, r, "arrow"))
+    cases["parquet"] = lambda c, r: to_json(encode_page(c, r, "parquet"))
+    return cases
+
+
+def measure(columns: list[str], rows: list[tuple], repeat: int) -> list[dict]:
+    results = []
+    baseline = None
+    for name, encode in encoders().items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            payload = encode(columns, rows)
+            timings.append(time.perf_counter() - started)
+        size = len(payload.encode("utf-8"))
+        baseline = baseline or size
+        results.append(
+            {
+                "format": name,
+                "rows": len(rows),
+                "bytes": size,
+                "vs_indent": size / baseline,
+                "encode_ms_median": statistics.median(timings) * 1000,
+            }
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="clinical.db")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for limit in args.rows:
+        columns, rows = load_rows(args.db, limit)
+        results.extend(measure(columns, rows, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'format':<12} {'rows':>6} {'bytes':>10} {'vs indent':>10} {'encode ms':>10}")
+    for r in results:
+        print(
+            f"{r['format']:<12} {r['rows']:>6} {r['bytes']:>10} "
+            f"{r['vs_indent']:>10.2f} {r['encode_ms_median']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measure the cost of run_sql's minimum-subjects check (support/k_anonymity.py).
+
+For subject-level queries of growing result size, compares reading the first
+page (what run_sql does without the check) with the companion queries of each
+mode:
+
+* ``page``     - execute the query and fetch one page plus a look-ahead row
+* ``reject``   - ``subjects_sql``: distinct subjects, counted up to ``k``
+* ``suppress`` - ``count_sql`` plus ``small_classes_sql`` over the whole result
+
+The reject check stops once ``k`` subjects are found, so its cost stays close to
+the page's whatever the result size. Suppress mode reads the whole result while
+the page reads only its first rows; run it on a large database (see
+``support.generate_clinical --rows``) to see how far apart they get.
+
+    python -m support.bench_k_anonymity --db clinical.db --repeat 10
+"""
+
+import argparse
+import json
+import sqlite3
+import statistics
+import time
+
+from support.k_anonymity import count_sql, small_classes_sql, subject_probe, subjects_sql
+
+QUERIES = {
+    "limit 500": "SELECT AGE, SEX FROM clinical ORDER BY ENRLDT DESC LIMIT 500",
+    "one site": "SELECT AGE, SEX, RACE FROM clinical WHERE SITEID = ?",
+    "evaluable": "SELECT AGE, SEX, RACE FROM clinical WHERE EVALFLAG = 1",
+    "all rows": "SELECT AGE, SEX, RACE, SITEID FROM clinical",
+}
+
+
+def timed(conn: sqlite3.Connection, sql: str, params: list, fetch: int | None) -> float:
+    started = time.perf_counter()
+    cur = conn.execute(sql, params)
+    cur.fetchmany(fetch) if fetch else cur.fetchall()
+    return time.perf_counter() - started
+
+
+def measure(conn: sqlite3.Connection, page_size: int, k: int, repeat: int) -> list[dict]:
+    (site,) = conn.execute("SELECT SITEID FROM clinical LIMIT 1;").fetchone()
+    results = []
+    for name, sql in QUERIES.items():
+        params = [site] if "?" in sql else []
+        probe = subject_probe(sql)
+        width = len(conn.execute(sql, params).description)
+        subjects, rows = conn.execute(count_sql(probe), params).fetchone()
+        cases = {
+            "page": [(sql, page_size + 1)],
+            "reject": [(subjects_sql(probe, k), None)],
+            "suppress": [
+                (count_sql(probe), None),
+                (small_classes_sql(probe, width, k, 10_000 + 1), None),
+            ],
+        }
+        timings = {case: [] for case in cases}
+        for _ in range(repeat):
+            for case, statements in cases.items():
+                timings[case].append(sum(timed(conn, s, params, f) for s, f in statements))
+        medians = {case: statistics.median(t) * 1000 for case, t in timings.items()}
+        results.append(
+            {
+                "query": name,
+                "rows": rows,
+                "subjects": subjects,
+                **{f"{case}_ms": ms for case, ms in medians.items()},
+                "reject_vs_page": medians["reject"] / medians["page"],
+                "suppress_vs_page": medians["suppress"] / medians["page"],
+            }
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="clinical.db")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.db) as conn:
+        results = measure(conn, args.page_size, args.k, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        f"{'query':<10} {'rows':>10} {'page ms':>9} {'reject ms':>10} {'suppress ms':>12} "
+        f"{'reject x':>9} {'suppress x':>11}"
+    )
+    for r in results:
+        print(
+            f"{r['query']:<10} {r['rows']:>10} {r['page_ms']:>9.2f} {r['reject_ms']:>10.2f} "
+            f"{r['suppress_ms']:>12.2f} {r['reject_vs_page']:>9.2f} {r['suppress_vs_page']:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+End-to-end load benchmark for the MCP server.
+
+Starts ``support/stub_llm.py`` and ``clinical_mcp.py`` (SSE) as local processes,
+then runs ``--concurrency`` simulated agents, each with its own MCP session,
+through a seeded mix of list_schema / get_study_protocol / run_sql calls.
+run_sql statements answer the example questions in ``support/prompts.py``; their
+parameters (e.g. the six-month enrolment window) are taken from the current
+``clinical.db``, and the dataset size is recorded with the results, so runs
+against datasets from ``generate_clinical.py --rows ...`` stay comparable.
+
+The examples are all decided by the local pre-check, so a share (``--novel``) of
+run_sql calls is replaced by a query the agent has not sent before, which goes to
+the stub policy LLM and misses the result cache.
+
+    python -m support.bench_load --concurrency 8 --requests 400 --output before.json
+    python -m support.bench_load --concurrency 8 --requests 400 --compare before.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from support.bench_speculative import percentile
+from support.prompts import DASHBOARD_INSTRUCTIONS
+
+DB_FILE = "clinical.db"
+
+# Example question -> (tool, SQL). Prohibited questions are expected to be denied.
+EXAMPLES = {
+    "Describe the dataset and its columns.": ("list_schema", None),
+    "Summarise the data-governance rules in the study protocol.": ("get_study_protocol", None),
+    "How many evaluable subjects have enrolled in total?": (
+        "run_sql",
+        "SELECT COUNT(*) AS evaluable FROM clinical WHERE EVALFLAG = 1",
+    ),
+    "What is the average age by site?": (
+        "run_sql",
+        "SELECT SITEID, AVG(AGE) AS mean_age FROM clinical GROUP BY SITEID ORDER BY SITEID",
+    ),
+    "How many subjects enrolled each month during the past six months?": (
+        "run_sql",
+        "SELECT strftime('%Y-%m', ENRLDT) AS month, COUNT(*) AS subjects FROM clinical "
+        "WHERE ENRLDT >= ? GROUP BY month ORDER BY month",
+    ),
+    "Among evaluable subjects, what is the male-to-female ratio by race at each site?": (
+        "run_sql",
+        "SELECT SITEID, RACE, SUM(SEX = 'M') * 1.0 / NULLIF(SUM(SEX = 'F'), 0) AS m_to_f "
+        "FROM clinical WHERE EVALFLAG = 1 GROUP BY SITEID, RACE ORDER BY SITEID, RACE",
+    ),
+    "Provide the subject IDs for the last 10 subjects enrolled in the study.": (
+        "run_sql",
+        "SELECT USUBJID FROM clinical ORDER BY ENRLDT DESC LIMIT 10",
+    ),
+    "Can you add a record for a new subject with the following information: Site002, "
+    "45 years old,female, Asian?": (
+        "run_sql",
+        "INSERT INTO clinical (SITEID, AGE, SEX, RACE) VALUES ('Site002', 45, 'F', 'Asian')",
+    ),
+}
+TOOLS = ("list_schema", "get_study_protocol", "run_sql")
+
+# Escalated by the pre-check (scalar subquery); the alias makes every call distinct
+NOVEL_SQL = (
+    "SELECT SITEID, COUNT(*) AS older_{i} FROM clinical "
+    "WHERE AGE > (SELECT AVG(AGE) FROM clinical) GROUP BY SITEID"
+)
+
+
+def example_questions() -> list[str]:
+    """The questions listed in the dashboard instructions, whitespace-normalised."""
+    items = re.findall(r"<li>(.*?)</li>", DASHBOARD_INSTRUCTIONS, re.S)
+    questions = [" ".join(item.split()) for item in items]
+    unmapped = [q for q in questions if q not in EXAMPLES]
+    if unmapped:
+        raise SystemExit(f"No benchmark SQL for example question(s): {unmapped}")
+    return questions
+
+
+def dataset_profile(db_file: str) -> dict:
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    rows, sites, latest = conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT SITEID), MAX(ENRLDT) FROM clinical;"
+    ).fetchone()
+    conn.close()
+    since = datetime.date.fromisoformat(latest[:10]) - datetime.timedelta(days=183)
+    return {"rows": rows, "sites": sites, "six_months_ago": since.isoformat()}
+
+
+def plan_workload(
+    requests: int, mix: dict[str, float], novel: float, seed: int, profile: dict
+) -> list:
+    """A seeded list of ``(tool, arguments)`` calls."""
+    rng = random.Random(seed)
+    sql_examples = [sql for tool, sql in EXAMPLES.values() if tool == "run_sql"]
+    calls = []
+    for i, tool in enumerate(rng.choices(list(mix), weights=list(mix.values()), k=requests)):
+        if tool != "run_sql":
+            calls.append((tool, {}))
+            continue
+        sql = NOVEL_SQL.format(i=i) if rng.random() < novel else rng.choice(sql_examples)
+        params = [profile["six_months_ago"]] if "?" in sql else None
+        calls.append((tool, {"query": sql, "params": params}))
+    return calls
+
+
+async def drive(url: str, calls: list, concurrency: int) -> tuple[dict, float]:
+    """Run *calls* across *concurrency* MCP sessions; return latencies per outcome and wall time."""
+    from fastmcp import Client
+
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    queue = iter(calls)
+
+    async def agent() -> None:
+        async with Client(url) as client:
+            for tool, arguments in queue:
+                started = time.perf_counter()
+                try:
+                    reply = await client.call_tool(tool, arguments)
+                except Exception:
+                    errors[tool] = errors.get(tool, 0) + 1
+                    continue
+                elapsed = time.perf_counter() - started
+                key = tool
+                if tool == "run_sql" and "error" in (data := json.loads(reply[0].text)):
+                    overloaded = data.get("error_type") == "overloaded"
+                    key = "run_sql (overloaded)" if overloaded else "run_sql (denied)"
+                latencies.setdefault(key, []).append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(agent() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}, time.perf_counter() - started
+
+
+def summarise(outcome: dict, wall: float) -> dict:
+    summary = {}
+    for key, timings in sorted(outcome["latencies"].items()):
+        summary[key] = {
+            "count": len(timings),
+            "errors": outcome["errors"].get(key, 0),
+            "throughput_rps": len(timings) / wall,
+            "p50_ms": statistics.median(timings) * 1000,
+            "p95_ms": percentile(timings, 0.95) * 1000,
+            "p99_ms": percentile(timings, 0.99) * 1000,
+            "mean_ms": statistics.fmean(timings) * 1000,
+        }
+    for key, count in outcome["errors"].items():
+        summary.setdefault(key, {"count": 0, "errors": count})
+    return summary
+
+
+def _wait_for(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Process exited with {process.returncode} before {url} was up")
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def print_report(results: dict, baseline: dict | None) -> None:
+    ds = results["dataset"]
+    print(
+        f"{ds['rows']:,} rows, {results['config']['concurrency']} agents, "
+        f"{results['throughput_rps']:.1f} calls/s over {results['wall_seconds']:.1f} s"
+    )
+    print(f"{'tool':<20} {'calls':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for key, r in results["tools"].items():
+        line = f"{key:<20} {r['count']:>6} {r['errors']:>4}"
+        if r["count"]:
+            line += f" {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}"
+        old = (baseline or {}).get("tools", {}).get(key)
+        if old and old.get("count") and r["count"]:
+            change = (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f"   p95 {change:+.0f}% vs {baseline.get('commit') or 'baseline'}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=4, help="Simulated agents")
+    parser.add_argument("--requests", type=int, default=200, help="Total tool calls")
+    parser.add_argument(
+        "--mix",
+        default="list_schema=1,get_study_protocol=1,run_sql=4",
+        help="Relative weights of the tools",
+    )
+    parser.add_argument(
+        "--novel", type=float, default=0.2, help="Share of run_sql calls that need the LLM"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub LLM seconds per call")
+    parser.add_argument("--verdict", choices=["allow", "deny", "auto"], default="auto")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Stub LLM HTTP 500 rate")
+    parser.add_argument(
+        "--no-result-cache", action="store_true", help="Run with RESULT_CACHE_MAX_BYTES=0"
+    )
+    parser.add_argument(
+        "--session-rate",
+        type=float,
+        default=0.0,
+        help="ADMISSION_RATE_PER_SECOND for the server (default 0: agents are not rate limited)",
+    )
+    parser.add_argument("--port", type=int, default=8020, help="MCP server port")
+    parser.add_argument("--llm-port", type=int, default=8021, help="Stub LLM port")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    mix = {}
+    for part in args.mix.split(","):
+        tool, _, weight = part.partition("=")
+        if tool.strip() not in TOOLS:
+            parser.error(f"--mix tools must be among {', '.join(TOOLS)}")
+        mix[tool.strip()] = float(weight or 1)
+    example_questions()
+    profile = dataset_profile(DB_FILE)
+    calls = plan_workload(args.requests, mix, args.novel, args.seed, profile)
+
+    env = {
+        **os.environ,
+        "MCP_PORT": str(args.port),
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "stub"),
+        # A cold verdict cache per run, so the policy LLM is actually exercised
+        "POLICY_CACHE_PATH": os.path.join(tempfile.mkdtemp(), "policy_cache.db"),
+        # Agents call back to back, far faster than a person; rate limits only on request
+        "ADMISSION_RATE_PER_SECOND": str(args.session_rate),
+    }
+    if args.no_result_cache:
+        env["RESULT_CACHE_MAX_BYTES"] = "0"
+    stub_cmd = [sys.executable, "support/stub_llm.py", "--port", str(args.llm_port)]
+    stub_cmd += ["--latency", str(args.latency), "--verdict", args.verdict]
+    stub_cmd += ["--error-rate", str(args.error_rate)]
+    processes = [subprocess.Popen(stub_cmd, stdout=subprocess.DEVNULL)]
+    try:
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "clinical_mcp.py"], env=env, stdout=subprocess.DEVNULL
+            )
+        )
+        base = f"http://127.0.0.1:{args.port}"
+        _wait_for(f"{base}/stats", processes[1])
+        outcome, wall = asyncio.run(drive(f"{base}/sse", calls, args.concurrency))
+        with urllib.request.urlopen(f"{base}/stats", timeout=5) as response:
+            server_stats = json.load(response)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "dataset": profile,
+        "wall_seconds": wall,
+        "throughput_rps": sum(len(t) for t in outcome["latencies"].values()) / wall,
+        "tools": summarise(outcome, wall),
+        "server_stats": server_stats,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
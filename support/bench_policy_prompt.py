@@ -0,0 +1,133 @@
+"""
+Compare the size of policy-gate prompts (support/policy_prompt.py) with the
+previous layout.
+
+The previous layout sent the instructions, then the whole study protocol as a
+second system message, then the SQL wrapped in a question. The current one
+sends the instructions and the compiled rules digest as one system message,
+then the bare SQL. For each sample query this prints the prompt tokens of both
+layouts, and checks that every current prompt shares a byte-identical prefix
+(the part a provider can cache).
+
+Tokens are counted with tiktoken's ``o200k_base`` encoding (GPT-4o) when it
+can be loaded; otherwise they are estimated at 4 characters per token. Either
+way, add about 3 tokens of framing per message.
+
+    python -m support.bench_policy_prompt --protocol support/study_protocol.md
+"""
+
+import argparse
+import json
+import time
+from collections.abc import Callable
+
+from support.policy_prompt import build_messages, compile_digest, system_prompt
+
+SAMPLE_SQL = [
+    "SELECT SITEID, COUNT(*) FROM clinical GROUP BY SITEID",
+    "SELECT AGE, SEX, RACE FROM clinical WHERE SITEID = 'S001'",
+    "SELECT c.SITEID, s.n FROM clinical c JOIN (SELECT SITEID, COUNT(*) AS n FROM clinical "
+    "GROUP BY SITEID) s ON s.SITEID = c.SITEID",
+    "SELECT * FROM clinical WHERE ENRLDT >= '2024-01-01' ORDER BY ENRLDT LIMIT 20",
+]
+MESSAGE_OVERHEAD = 3
+
+LEGACY_INSTRUCTIONS = (
+    "You are a data-governance gatekeeper. "
+    "Given a study protocol and a SQL query, respond with JSON: "
+    '{"allowed": true/false, "reason": "..."}. '
+    "If any rule is violated, set allowed to false and provide the specific reason "
+    "based on the protocol. "
+    "Unless a rule is explicitly and clearly violated, set allowed to true."
+)
+
+
+def legacy_messages(protocol_text: str, sql: str) -> list[dict]:
+    return [
+        {"role": "system", "content": LEGACY_INSTRUCTIONS},
+        {"role": "system", "content": protocol_text},
+        {
+            "role": "user",
+            "content": f"SQL query to evaluate:\n{sql}\nDoes it violate the study protocol?",
+        },
+    ]
+
+
+def token_counter() -> tuple[Callable[[str], int], str]:
+    """A text -> token count function, and a label saying how it counts."""
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("o200k_base")
+        return (lambda text: len(encoding.encode(text))), "tiktoken o200k_base"
+    except Exception:  # not installed, or the encoding could not be downloaded
+        return (lambda text: -(-len(text) // 4)), "estimate: 4 characters per token"
+
+
+def prompt_tokens(messages: list[dict], count: Callable[[str], int]) -> int:
+    return sum(count(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+def measure(protocol_text: str, count: Callable[[str], int]) -> dict:
+    compile_digest.cache_clear()
+    started = time.perf_counter()
+    prefix = system_prompt(protocol_text)
+    compile_ms = (time.perf_counter() - started) * 1000
+    queries = []
+    for sql in SAMPLE_SQL:
+        messages = build_messages(protocol_text, sql)
+        if messages[0]["content"] != prefix:
+            raise SystemExit(f"prefix differs for {sql!r}")
+        queries.append(
+            {
+                "sql": sql,
+                "legacy_tokens": prompt_tokens(legacy_messages(protocol_text, sql), count),
+                "tokens": prompt_tokens(messages, count),
+            }
+        )
+    legacy = sum(q["legacy_tokens"] for q in queries) / len(queries)
+    current = sum(q["tokens"] for q in queries) / len(queries)
+    return {
+        "protocol_chars": len(protocol_text),
+        "prefix_chars": len(prefix),
+        "prefix_tokens": count(prefix) + MESSAGE_OVERHEAD,
+        "compile_ms": compile_ms,
+        "queries": queries,
+        "avg_legacy_tokens": legacy,
+        "avg_tokens": current,
+        "reduction": 1 - current / legacy,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--protocol", default="support/study_protocol.md")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(args.protocol, encoding="utf-8") as f:
+        protocol_text = f.read()
+    count, method = token_counter()
+    result = {"token_count": method, **measure(protocol_text, count)}
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"Token counts: {method}")
+    print(
+        f"Protocol {result['protocol_chars']} chars; shared prefix {result['prefix_chars']} chars, "
+        f"{result['prefix_tokens']} tokens, compiled in {result['compile_ms']:.2f} ms "
+        f"(byte-identical for all {len(result['queries'])} queries)"
+    )
+    print(f"{'sql':<50} {'before':>7} {'after':>7}")
+    for q in result["queries"]:
+        sql = q["sql"] if len(q["sql"]) <= 50 else q["sql"][:47] + "..."
+        print(f"{sql:<50} {q['legacy_tokens']:>7} {q['tokens']:>7}")
+    print(
+        f"{'average':<50} {result['avg_legacy_tokens']:>7.0f} {result['avg_tokens']:>7.0f}  "
+        f"({result['reduction']:.0%} fewer prompt tokens per call)"
+    )
+
+
+if __name__ == "__main__":
+    main()
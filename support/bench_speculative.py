@@ -0,0 +1,111 @@
+"""
+Compare run_sql latency with and without speculative execution.
+
+Starts ``stub_llm.py`` in-process with a fixed latency, points the policy gate at it
+and calls ``run_sql`` through an in-memory MCP client. Each query needs an LLM
+verdict (it is not decided by the local pre-check, and the verdict and result
+caches are bypassed), so the difference between the modes is the overlap of the
+policy call with query execution.
+
+    python -m support.bench_speculative --latency 0.3 --repeat 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from support.stub_llm import serve
+
+# Each needs the LLM: a scalar subquery and self-joins are escalated by the pre-check
+QUERIES = {
+    "light": (
+        "SELECT SITEID, COUNT(*) AS n_{i} FROM clinical "
+        "WHERE AGE > (SELECT AVG(AGE) FROM clinical) GROUP BY SITEID"
+    ),
+    "heavy": (
+        "SELECT a.SITEID, COUNT(*) AS triples_{i} FROM clinical a "
+        "JOIN clinical b ON a.SITEID = b.SITEID AND a.SEX = b.SEX "
+        "JOIN clinical c ON b.SITEID = c.SITEID AND b.RACE = c.RACE GROUP BY a.SITEID"
+    ),
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+async def run(repeat: int, verdict: str) -> list[dict]:
+    from fastmcp import Client
+
+    import clinical_mcp
+
+    await clinical_mcp.setup_audit_log()
+    results = []
+    counter = 0
+    async with Client(clinical_mcp.mcp) as client:
+        for name, template in QUERIES.items():
+            for speculative in (False, True):
+                clinical_mcp.RUN_SQL_SPECULATIVE = speculative
+                timings = []
+                for _ in range(repeat):
+                    counter += 1  # distinct alias -> distinct verdict/result cache keys
+                    started = time.perf_counter()
+                    reply = await client.call_tool("run_sql", {"query": template.format(i=counter)})
+                    timings.append(time.perf_counter() - started)
+                    body = json.loads(reply[0].text)
+                    if verdict == "allow" and "error" in body:
+                        raise RuntimeError(body["error"])
+                results.append(
+                    {
+                        "query": name,
+                        "mode": "speculative" if speculative else "sequential",
+                        "p50_ms": statistics.median(timings) * 1000,
+                        "p95_ms": percentile(timings, 0.95) * 1000,
+                        "mean_ms": statistics.fmean(timings) * 1000,
+                    }
+                )
+    await clinical_mcp.audit_writer.close()
+    results.append({"speculation": clinical_mcp.speculation_stats})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub LLM seconds per call")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--verdict", choices=["allow", "deny"], default="allow")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    server = serve("127.0.0.1", args.port, args.latency, args.verdict, 0.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    os.environ["POLICY_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "policy_cache.db")
+
+    results = asyncio.run(run(args.repeat, args.verdict))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"stub LLM latency {args.latency * 1000:.0f} ms, verdict {args.verdict}")
+    print(f"{'query':<7} {'mode':<12} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for r in results[:-1]:
+        print(
+            f"{r['query']:<7} {r['mode']:<12} {r['p50_ms']:>8.1f} "
+            f"{r['p95_ms']:>8.1f} {r['mean_ms']:>8.1f}"
+        )
+    print("speculation:", results[-1]["speculation"])
+
+
+if __name__ == "__main__":
+    main()
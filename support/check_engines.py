@@ -0,0 +1,186 @@
+"""
+Result-equivalence suite for the run_sql execution backends (support/engines.py).
+
+Runs every query in ``QUERIES`` on SQLite and on the DuckDB engine (a fresh
+mirror of ``--db``, or the ``--parquet`` export) and compares the results:
+columns, row count, values (floats to 1e-9 relative) and, for queries with an
+ORDER BY, row order. Each query is also read in small pages to check that
+paging returns the same rows. ``FALLBACK`` lists queries that must stay on
+SQLite. Exits non-zero on any difference.
+
+    python -m support.check_engines --db clinical.db
+    python -m support.check_engines --db clinical.db --parquet clinical_parquet
+"""
+
+import argparse
+import asyncio
+import math
+import sqlite3
+import sys
+import time
+
+from support.engines import DuckDBEngine, has_order_by, unportable
+
+QUERIES = {
+    "count by site": "SELECT SITEID, COUNT(*) AS n FROM clinical GROUP BY SITEID ORDER BY SITEID",
+    "unordered groups": "SELECT SEX, RACE, AVG(AGE) FROM clinical GROUP BY SEX, RACE",
+    "rounded stats": (
+        "SELECT RACE, ROUND(AVG(AGE), 2) AS mean_age, MIN(AGE), MAX(AGE) "
+        "FROM clinical GROUP BY RACE ORDER BY mean_age DESC"
+    ),
+    "integer division": (
+        "SELECT SITEID, SUM(EVALFLAG) * 100 / COUNT(*) AS pct FROM clinical GROUP BY SITEID"
+    ),
+    "float literal": (
+        "SELECT SEX, 100.0 * SUM(EVALFLAG) / COUNT(*) AS pct FROM clinical GROUP BY SEX"
+    ),
+    "division by zero": (
+        "SELECT SEX, SUM(AGE) / 0 AS x, AVG(AGE) / 0 AS y FROM clinical GROUP BY SEX"
+    ),
+    "month substr": (
+        "SELECT SUBSTR(ENRLDT, 1, 7) AS month, COUNT(*) FROM clinical WHERE AGE >= ? "
+        "GROUP BY month ORDER BY month"
+    ),
+    "having": (
+        "SELECT SITEID, COUNT(DISTINCT RACE) AS races FROM clinical "
+        "GROUP BY SITEID HAVING COUNT(*) > 70"
+    ),
+    "case bands": (
+        "SELECT CASE WHEN AGE < 40 THEN 'young' WHEN AGE < 65 THEN 'mid' ELSE 'old' END AS band, "
+        "COUNT(*) FROM clinical GROUP BY band ORDER BY 2 DESC, 1"
+    ),
+    "comparison column": "SELECT SEX, COUNT(*) > 900 AS large FROM clinical GROUP BY SEX",
+    "null ordering": (
+        "SELECT NULLIF(RACE, 'Other') AS race, COUNT(*) FROM clinical GROUP BY 1 ORDER BY 1"
+    ),
+    "null ordering desc": (
+        "SELECT NULLIF(RACE, 'Other') AS race, COUNT(*) FROM clinical GROUP BY 1 ORDER BY 1 DESC"
+    ),
+    "derived table": (
+        "SELECT COUNT(*) FROM (SELECT SITEID FROM clinical GROUP BY SITEID HAVING AVG(AGE) > 50)"
+    ),
+    "cte": (
+        "WITH s AS (SELECT SITEID, COUNT(*) AS n FROM clinical GROUP BY SITEID) "
+        "SELECT MIN(n), MAX(n), AVG(n) FROM s"
+    ),
+    "top n": (
+        "SELECT SITEID, COUNT(*) AS n FROM clinical GROUP BY SITEID ORDER BY n DESC, SITEID LIMIT 5"
+    ),
+    "empty groups": "SELECT SEX, COUNT(*) FROM clinical WHERE AGE > 200 GROUP BY SEX",
+    "empty totals": "SELECT COUNT(*), SUM(AGE), AVG(AGE), MIN(SEX) FROM clinical WHERE AGE > 200",
+    "string functions": (
+        "SELECT LOWER(SEX) AS sex, SUM(LENGTH(RACE)), ABS(MIN(AGE) - MAX(AGE)) "
+        "FROM clinical GROUP BY 1"
+    ),
+    "coalesce": (
+        "SELECT COALESCE(NULLIF(SEX, 'M'), 'male') AS sex, IFNULL(SUM(EVALFLAG), 0) "
+        "FROM clinical GROUP BY 1"
+    ),
+    "compound": (
+        "SELECT 'M' AS sex, COUNT(*) FROM clinical WHERE SEX = 'M' "
+        "UNION ALL SELECT 'F', COUNT(*) FROM clinical WHERE SEX = 'F'"
+    ),
+    "rollup table": "SELECT SITEID, SUM(row_count) AS n FROM clinical_rollup GROUP BY SITEID",
+}
+# Not portable: must be routed to SQLite
+FALLBACK = {
+    "strftime": "SELECT strftime('%Y-%m', ENRLDT) AS m, COUNT(*) FROM clinical GROUP BY m",
+    "like": "SELECT COUNT(*) FROM clinical WHERE RACE LIKE 'white'",
+    "group_concat": "SELECT SEX, GROUP_CONCAT(DISTINCT RACE) FROM clinical GROUP BY SEX",
+    "scalar max": "SELECT MAX(AGE, 50), COUNT(*) FROM clinical GROUP BY 1",
+    "cast": "SELECT CAST(AVG(AGE) AS INTEGER) FROM clinical",
+    "limit comma": "SELECT SITEID, COUNT(*) FROM clinical GROUP BY SITEID LIMIT 2, 3",
+    "rows": "SELECT AGE, SEX FROM clinical WHERE AGE > 80",
+}
+PARAMS = {"month substr": [65]}
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+    return a == b
+
+
+def _sort_key(row: tuple) -> tuple:
+    return tuple((v is not None, str(type(v).__name__ != "str"), v) for v in row)
+
+
+def compare(expected: list[tuple], actual: list[tuple], ordered: bool) -> str | None:
+    """Description of the first difference between two results, or ``None``."""
+    if len(expected) != len(actual):
+        return f"{len(expected)} rows on SQLite, {len(actual)} on DuckDB"
+    if not ordered:
+        expected, actual = sorted(expected, key=_sort_key), sorted(actual, key=_sort_key)
+    for i, (e, a) in enumerate(zip(expected, actual)):
+        if len(e) != len(a) or not all(_same(x, y) for x, y in zip(e, a)):
+            return f"row {i}: SQLite {e!r}, DuckDB {a!r}"
+    return None
+
+
+async def check(engine: DuckDBEngine, conn: sqlite3.Connection, page: int) -> list[dict]:
+    results = []
+    for name, sql in QUERIES.items():
+        params = PARAMS.get(name, [])
+        started = time.perf_counter()
+        cur = conn.execute(sql, params)
+        expected = [tuple(r) for r in cur.fetchall()]
+        sqlite_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        actual = await engine.fetch(sql, params, 0, len(expected) + 1)
+        duckdb_ms = (time.perf_counter() - started) * 1000
+        problem = unportable(sql) and f"not routed to DuckDB ({unportable(sql)})"
+        problem = problem or compare(expected, actual, has_order_by(sql))
+        if problem is None:
+            paged: list[tuple] = []
+            while len(paged) <= len(expected):
+                chunk = await engine.fetch(sql, params, len(paged), page)
+                paged += chunk
+                if len(chunk) < page:
+                    break
+            if compare(actual, paged, True):
+                problem = f"paging: {compare(actual, paged, True)}"
+        results.append(
+            {
+                "query": name,
+                "rows": len(expected),
+                "problem": problem,
+                "sqlite_ms": sqlite_ms,
+                "duckdb_ms": duckdb_ms,
+            }
+        )
+    for name, sql in FALLBACK.items():
+        if unportable(sql) is None:
+            results.append({"query": name, "rows": 0, "problem": "routed to DuckDB"})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="clinical.db")
+    parser.add_argument("--parquet", help="Check a generate_clinical --parquet export instead")
+    parser.add_argument("--page", type=int, default=3, help="Page size for the paging check")
+    args = parser.parse_args()
+
+    engine = DuckDBEngine(args.db, args.parquet)
+    started = time.perf_counter()
+    engine.open_parquet() if args.parquet else engine.build()
+    print(
+        f"DuckDB {'opened' if args.parquet else 'mirrored'} {args.db} in "
+        f"{time.perf_counter() - started:.2f} s"
+    )
+    with sqlite3.connect(f"file:{args.db}?mode=ro", uri=True) as conn:
+        results = asyncio.run(check(engine, conn, args.page))
+
+    print(f"{'query':<20} {'rows':>6} {'sqlite ms':>10} {'duckdb ms':>10}  result")
+    for r in results:
+        timings = (
+            f"{r['sqlite_ms']:>10.2f} {r['duckdb_ms']:>10.2f}" if "sqlite_ms" in r else " " * 21
+        )
+        print(f"{r['query']:<20} {r['rows']:>6} {timings}  {r['problem'] or 'ok'}")
+    failed = sum(r["problem"] is not None for r in results)
+    print(f"{len(results) - failed} passed, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
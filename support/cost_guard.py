@@ -0,0 +1,122 @@
+"""
+Cost guard for agent-generated queries.
+
+Two layers:
+
+* Admission: ``assess_plan`` reads ``EXPLAIN QUERY PLAN`` output and estimates
+  the rows visited by nested full-table scans (e.g. a cartesian self-join),
+  using table row counts from the schema snapshot. Callers warn or reject above
+  their thresholds.
+* Execution: ``ExecutionBudget`` is installed as SQLite's progress handler and
+  aborts the statement once it exceeds a wall-clock or VM-step budget.
+
+Both raise ``QueryTooExpensive``, whose ``details`` are safe to return to the agent.
+"""
+
+import re
+import time
+from dataclasses import dataclass, field
+
+# "SCAN clinical", "SCAN a USING INDEX ...", older "SCAN TABLE clinical AS a"
+_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\S+)")
+
+
+class QueryTooExpensive(Exception):
+    """A query was refused before running (``stage="plan"``) or stopped (``"runtime"``)."""
+
+    def __init__(self, stage: str, reason: str, **details):
+        super().__init__(reason)
+        self.stage = stage
+        self.reason = reason
+        self.details = details
+
+
+@dataclass
+class PlanAssessment:
+    estimated_rows: int = 0  # rows visited by the worst group of nested full scans
+    nested_scans: int = 0  # full scans in that group (2+ means a full-scan join)
+    scans: list[str] = field(default_factory=list)
+
+    @property
+    def full_scan_join(self) -> bool:
+        return self.nested_scans >= 2
+
+
+def assess_plan(plan: list[tuple], row_counts: dict[str, int]) -> PlanAssessment:
+    """Estimate the cost of a query from ``EXPLAIN QUERY PLAN`` rows ``(id, parent, _, detail)``.
+
+    Full scans listed under the same parent run as nested loops, so their row
+    counts multiply; a correlated subquery multiplies its outer loop by its own
+    cost. Scans of unknown names (aliases, materialised subqueries) are costed
+    as the largest known table.
+    """
+    counts = {name.lower(): n for name, n in row_counts.items()}
+    fallback = max(counts.values(), default=0)
+    children: dict[int, list[tuple[int, str]]] = {}
+    for node_id, parent, _, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    scans: list[str] = []
+    worst = PlanAssessment()
+
+    def visit(parent: int) -> tuple[int, int]:
+        rows, nested = 1, 0
+        for node_id, detail in children.get(parent, []):
+            m = _SCAN_RE.match(detail)
+            if m and m.group(1) != "CONSTANT":
+                scans.append(m.group(1))
+                rows *= max(1, counts.get(m.group(1).lower(), fallback))
+                nested += 1
+            elif node_id in children:
+                sub_rows, sub_nested = visit(node_id)
+                if detail.startswith("CORRELATED"):
+                    # re-run for every outer row
+                    rows *= max(1, sub_rows)
+                    nested += sub_nested
+        if nested > worst.nested_scans or (
+            nested == worst.nested_scans and rows > worst.estimated_rows
+        ):
+            worst.estimated_rows, worst.nested_scans = rows, nested
+        return rows, nested
+
+    visit(0)
+    worst.scans = scans
+    return worst
+
+
+class ExecutionBudget:
+    """Progress handler that aborts a statement past *max_seconds* or *max_steps* VM steps.
+
+    Install with ``set_progress_handler(budget.check, budget.interval)``; ``tripped``
+    names the exhausted budget afterwards. A limit of 0 disables that check.
+    """
+
+    def __init__(self, max_seconds: float, max_steps: int, interval: int = 10_000):
+        self.max_seconds = max_seconds
+        self.max_steps = max_steps
+        self.interval = interval
+        self.steps = 0
+        self.tripped: str | None = None
+        self._deadline = time.monotonic() + max_seconds if max_seconds > 0 else None
+
+    def check(self) -> int:
+        """Called by SQLite every ``interval`` VM steps; non-zero aborts the statement."""
+        self.steps += self.interval
+        if self.max_steps and self.steps > self.max_steps:
+            self.tripped = "steps"
+        elif self._deadline is not None and time.monotonic() > self._deadline:
+            self.tripped = "time"
+        return 1 if self.tripped else 0
+
+    def exceeded(self) -> QueryTooExpensive:
+        limit = (
+            f"{self.max_seconds:g} s wall-clock"
+            if self.tripped == "time"
+            else f"{self.max_steps:,} VM steps"
+        )
+        return QueryTooExpensive(
+            "runtime",
+            f"query stopped after exceeding the {limit} budget",
+            budget=self.tripped,
+            vm_steps=self.steps,
+        )
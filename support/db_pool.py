@@ -0,0 +1,214 @@
+"""
+Bounded pools of long-lived aiosqlite connections.
+
+Opening ``aiosqlite.connect()`` per tool call costs a new thread plus a fresh SQLite
+handle (schema parse, cold page cache). The MCP server instead keeps:
+
+* a read pool of ``mode=ro`` connections for ``run_sql`` / ``list_schema``;
+* a single writer connection (WAL journal) for the audit log.
+
+Read-only connections run agent SQL, and ``mode=ro`` plus ``query_only`` do not
+stop ``ATTACH`` or ``PRAGMA query_only=OFF``. Once they are set up they get
+``read_only_authorizer``. It lets through reads, and the pragmas that only
+report something. ``BEGIN``, ``ATTACH``, writes and the other pragmas fail with
+"not authorized".
+
+Connections use a larger page cache, memory-mapped I/O and a bigger prepared
+statement cache. ``stats()`` reports pool occupancy and acquire wait times.
+``recycle()`` reopens every connection on its next use, e.g. after the database
+file has been replaced (open handles would keep reading the old file).
+``retarget()`` points the pool at another database (such as a ``file:`` URI of an
+in-memory snapshot, see support/snapshot.py) without disturbing connections in use.
+"""
+
+import asyncio
+import contextlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import AsyncIterator
+
+import aiosqlite
+
+_READ_ACTIONS = frozenset(
+    {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+)
+# Pragmas that report something when given no value (with one, most of them set it)
+_REPORT_PRAGMAS = frozenset(
+    {"data_version", "freelist_count", "page_count", "page_size", "schema_version"}
+)
+# Pragmas whose argument only names the table or index to describe
+_DESCRIBE_PRAGMAS = frozenset(
+    {"foreign_key_list", "index_info", "index_list", "index_xinfo", "table_info", "table_xinfo"}
+)
+
+
+def read_only_authorizer(action: int, arg1, arg2, db_name, trigger) -> int:
+    """``sqlite3`` authorizer for connections that must only read (see the module docstring)."""
+    if action in _READ_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_TRANSACTION and arg1 in ("COMMIT", "ROLLBACK"):
+        return sqlite3.SQLITE_OK  # ending a transaction is harmless; starting one is not
+    if action == sqlite3.SQLITE_PRAGMA:
+        name = arg1.lower()
+        if name in _DESCRIBE_PRAGMAS or (name in _REPORT_PRAGMAS and arg2 is None):
+            return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+async def open_connection(
+    path: str,
+    *,
+    read_only: bool = False,
+    cache_size_kib: int = 16384,
+    mmap_size: int = 256 * 1024 * 1024,
+    cached_statements: int = 256,
+    synchronous: str = "NORMAL",
+) -> aiosqlite.Connection:
+    """Open one tuned connection whose worker thread will not block interpreter exit.
+
+    *path* may also be a ``file:`` URI, which is opened as given (plus ``mode=ro``
+    if *read_only*).
+    """
+    if path.startswith("file:"):
+        if read_only:
+            path += "&mode=ro" if "?" in path else "?mode=ro"
+        db = aiosqlite.connect(path, uri=True, cached_statements=cached_statements)
+    elif read_only:
+        db = aiosqlite.connect(
+            f"{Path(path).absolute().as_uri()}?mode=ro",
+            uri=True,
+            cached_statements=cached_statements,
+        )
+    else:
+        db = aiosqlite.connect(path, cached_statements=cached_statements)
+    db.daemon = True
+    await db
+    db.row_factory = aiosqlite.Row
+    await db.execute(f"PRAGMA cache_size=-{int(cache_size_kib)};")
+    await db.execute(f"PRAGMA mmap_size={int(mmap_size)};")
+    await db.execute("PRAGMA temp_store=MEMORY;")
+    if read_only:
+        await db.execute("PRAGMA query_only=ON;")
+        # aiosqlite has no wrapper for it; run it on the connection's own thread
+        await db._execute(db._conn.set_authorizer, read_only_authorizer)
+    else:
+        await db.execute("PRAGMA journal_mode=WAL;")
+        await db.execute(f"PRAGMA synchronous={synchronous};")
+        await db.execute("PRAGMA busy_timeout=5000;")
+    return db
+
+
+class ConnectionPool:
+    """A fixed-size pool of connections, opened lazily on first demand."""
+
+    def __init__(self, path: str, size: int = 4, *, read_only: bool = False, **connect_kwargs):
+        self.path = path
+        self.size = max(1, size)
+        self.read_only = read_only
+        self.connect_kwargs = connect_kwargs
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all: list[aiosqlite.Connection] = []
+        self._opening = 0
+        self._generation = 0
+        self._generations: dict[aiosqlite.Connection, int] = {}
+        self.counters = {
+            "acquisitions": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "recycled": 0,
+            "discarded": 0,
+        }
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a connection; waits (and records the wait) when all are busy."""
+        started = time.perf_counter()
+        if self._idle.empty() and len(self._all) + self._opening < self.size:
+            db = await self._open()
+        else:
+            if self._idle.empty():
+                self.counters["waits"] += 1
+            db = await self._idle.get()
+            if self._generations[db] != self._generation:
+                db = await self._open(replacing=db)
+        waited = time.perf_counter() - started
+        self.counters["acquisitions"] += 1
+        self.counters["wait_seconds_total"] += waited
+        self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"], waited)
+        try:
+            yield db
+        finally:
+            # A transaction left open (even a read) would hold a shared lock, blocking
+            # writers and checkpoints, and show the next borrower a stale view
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            except BaseException as e:
+                # Locked, already closed or cancelled mid-rollback: the connection is in
+                # an unknown state, so it gives up its slot and a new one opens on demand
+                self._forget(db)
+                self.counters["discarded"] += 1
+                with contextlib.suppress(Exception):
+                    await asyncio.shield(db.close())
+                if not isinstance(e, Exception):
+                    raise
+            else:
+                self._idle.put_nowait(db)
+
+    async def _open(self, replacing: aiosqlite.Connection | None = None) -> aiosqlite.Connection:
+        self._opening += 1  # reserve the slot before any await
+        try:
+            if replacing is not None:
+                self._forget(replacing)
+                self.counters["recycled"] += 1
+                await replacing.close()
+            db = await open_connection(self.path, read_only=self.read_only, **self.connect_kwargs)
+        finally:
+            self._opening -= 1
+        self._all.append(db)
+        self._generations[db] = self._generation
+        return db
+
+    def _forget(self, db: aiosqlite.Connection) -> None:
+        self._all.remove(db)
+        del self._generations[db]
+
+    def recycle(self) -> None:
+        """Replace every connection (idle or in use) the next time it is acquired."""
+        self._generation += 1
+
+    async def retarget(self, path: str) -> None:
+        """Open new connections on *path* from now on.
+
+        Idle connections are closed at once; connections in use finish their
+        query on the old database and are replaced when next acquired.
+        """
+        self.path = path
+        self.recycle()
+        while not self._idle.empty():
+            db = self._idle.get_nowait()
+            self._forget(db)
+            self.counters["recycled"] += 1
+            await db.close()
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            "size": self.size,
+            "open": len(self._all),
+            "idle": self._idle.qsize(),
+            "in_use": len(self._all) - self._idle.qsize(),
+            **c,
+            "wait_seconds_avg": c["wait_seconds_total"] / c["acquisitions"]
+            if c["acquisitions"]
+            else 0.0,
+        }
+
+    async def close(self) -> None:
+        for db in self._all:
+            await db.close()
+        self._all.clear()
+        self._generations.clear()
+        self._idle = asyncio.Queue()
@@ -0,0 +1,389 @@
+"""
+Pluggable execution backends for aggregate ``run_sql`` queries.
+
+SQLite stays the reference engine: every query is validated there, and its
+column names are used. With ``RUN_SQL_ENGINE=duckdb``, aggregates that the
+rollup cannot answer run instead on ``DuckDBEngine``, an embedded DuckDB with
+vectorised, multi-threaded execution over a columnar copy of the data. The copy
+is either:
+
+* a mirror of ``clinical.db`` in memory, rebuilt in the background whenever the
+  database's version token changes (queries use SQLite until it is current), or
+* a Parquet export written by ``generate_clinical.py --parquet DIR``, read in
+  place and used only while ``clinical.db`` is the file it was exported from.
+
+DuckDB's dialect is set up to match SQLite where they differ (integer division,
+division by zero, NULL ordering). ``unportable`` limits it to the subset of SQL whose results are
+identical on both engines; anything else, and any DuckDB error, falls back to
+SQLite. ``support/check_engines.py`` runs a shared query suite on both engines
+and compares the results.
+
+An engine provides ``name``, ``unportable(sql)``, ``ready(version)``,
+``fetch(sql, params, offset, limit, max_seconds)`` and ``stats()``;
+``ENGINES`` maps ``RUN_SQL_ENGINE`` values to engine classes. DuckDB is an optional
+dependency (``pip install duckdb``).
+"""
+
+import asyncio
+import contextlib
+import decimal
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from support.cost_guard import QueryTooExpensive
+from support.sql_policy import AGGREGATES, KEYWORDS, SQLParseError, token_spans
+
+logger = logging.getLogger(__name__)
+
+# Functions whose results match on both engines for the types in clinical.db
+PORTABLE_FUNCTIONS = frozenset(
+    {
+        "ABS",
+        "AVG",
+        "COALESCE",
+        "COUNT",
+        "IFNULL",
+        "LENGTH",
+        "LOWER",
+        "MAX",
+        "MIN",
+        "NULLIF",
+        "ROUND",
+        "SUBSTR",
+        "SUBSTRING",
+        "SUM",
+        "UPPER",
+    }
+)
+# Operators SQLite and DuckDB evaluate differently (LIKE is case-insensitive in SQLite)
+UNPORTABLE_KEYWORDS = frozenset({"COLLATE", "GLOB", "LIKE", "MATCH", "REGEXP", "RECURSIVE"})
+
+MANIFEST = "manifest.json"
+PARQUET_CHUNK_ROWS = 500_000
+# GLOBAL, so the per-query cursors inherit them
+_SETTINGS = (
+    "SET GLOBAL integer_division = true",
+    "SET GLOBAL ieee_floating_point_ops = false",  # x / 0 is NULL, not inf
+    "SET GLOBAL default_null_order = 'nulls_first_on_asc_last_on_desc'",
+)
+
+
+class EngineError(Exception):
+    """The engine could not run a query; the caller runs it on SQLite instead."""
+
+
+def unportable(sql: str) -> str | None:
+    """Why *sql* should not run on DuckDB, or ``None`` for a portable aggregate."""
+    try:
+        spans = token_spans(sql)
+    except SQLParseError as exc:
+        return f"unparsed: {exc}"
+    tokens = [tok for tok, _, _ in spans if not (tok.kind == "op" and tok.value == ";")]
+    aggregate = False
+    depth = 0
+    after_limit = False
+    for i, tok in enumerate(tokens):
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if tok.kind == "op" and tok.value in "()":
+            depth += 1 if tok.value == "(" else -1
+        elif tok.kind == "param" and tok.value != "?":
+            return "named or numbered parameters"
+        elif (
+            tok.kind == "word"
+            and (tok.upper not in KEYWORDS or tok.upper == "CAST")
+            and nxt is not None
+            and nxt.kind == "op"
+            and nxt.value == "("
+        ):
+            if tok.upper not in PORTABLE_FUNCTIONS:
+                return f"function {tok.upper}()"
+            if tok.upper in ("MIN", "MAX") and _arguments(tokens, i + 1) != 1:
+                return f"scalar {tok.upper}()"  # DuckDB's two-argument form returns a list
+            aggregate = aggregate or tok.upper in AGGREGATES
+        elif tok.kind == "word" and tok.upper in UNPORTABLE_KEYWORDS:
+            return tok.upper
+        elif tok.kind == "word" and tok.upper == "GROUP":
+            aggregate = True
+        elif depth == 0 and tok.kind == "word" and tok.upper == "LIMIT":
+            after_limit = True
+        elif after_limit and depth == 0 and tok.kind == "op" and tok.value == ",":
+            return "LIMIT offset, count"
+    return None if aggregate else "not an aggregate"
+
+
+def _arguments(tokens: list, open_at: int) -> int:
+    """Number of arguments of the call whose "(" is ``tokens[open_at]``."""
+    depth = 0
+    count = 1
+    for tok in tokens[open_at:]:
+        if tok.kind == "op" and tok.value in "()":
+            depth += 1 if tok.value == "(" else -1
+            if depth == 0:
+                return count
+        elif depth == 1 and tok.kind == "op" and tok.value == ",":
+            count += 1
+    return count
+
+
+def has_order_by(sql: str) -> bool:
+    """True when *sql* ends with a top-level ORDER BY (possibly followed by LIMIT)."""
+    depth = 0
+    found = False
+    for tok, _, _ in token_spans(sql):
+        if tok.kind == "op" and tok.value in "()":
+            depth += 1 if tok.value == "(" else -1
+        elif depth == 0 and tok.kind == "word" and tok.upper == "ORDER":
+            found = True
+        elif depth == 0 and tok.kind == "word" and tok.upper in ("UNION", "INTERSECT", "EXCEPT"):
+            found = False  # an ORDER BY before a compound operator belonged to a subquery
+    return found
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError as exc:
+        raise RuntimeError("RUN_SQL_ENGINE=duckdb requires duckdb (pip install duckdb)") from exc
+    return duckdb
+
+
+def _column_types(conn: sqlite3.Connection, table: str) -> list[tuple[str, str]]:
+    """``(name, DuckDB type)`` per column, from the declared type or, failing that, the data."""
+    columns = []
+    for _, name, declared, *_ in conn.execute(f'PRAGMA table_info("{table}");'):
+        declared = (declared or "").upper()
+        if "INT" in declared:
+            kind = "BIGINT"
+        elif any(t in declared for t in ("CHAR", "CLOB", "TEXT")):
+            kind = "VARCHAR"
+        elif any(t in declared for t in ("REAL", "FLOA", "DOUB")):
+            kind = "DOUBLE"
+        else:
+            # NUMERIC/none affinity (DATETIME, BOOLEAN, untyped): store what SQLite holds
+            row = conn.execute(
+                f'SELECT typeof("{name}") FROM "{table}" WHERE "{name}" IS NOT NULL LIMIT 1;'
+            ).fetchone()
+            kind = {"integer": "BIGINT", "real": "DOUBLE", "blob": "BLOB"}.get(
+                row[0] if row else "text", "VARCHAR"
+            )
+        columns.append((name, kind))
+    return columns
+
+
+def copy_tables(db_path: str, duck, chunk_rows: int = PARQUET_CHUNK_ROWS, on_chunk=None) -> dict:
+    """Copy every table of *db_path* into the DuckDB connection *duck*; returns row counts.
+
+    Read in one transaction, so the tables are a consistent snapshot. *on_chunk*
+    is called with ``(table, chunk index)`` after each chunk is loaded.
+    """
+    import pandas as pd
+
+    counts = {}
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        source.execute("BEGIN;")
+        tables = [
+            name
+            for (name,) in source.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name NOT LIKE 'sqlite_%' AND name != 'audit_log' ORDER BY name;"
+            )
+        ]
+        for table in tables:
+            types = _column_types(source, table)
+            columns = ", ".join(f'"{name}" {kind}' for name, kind in types)
+            duck.execute(f'CREATE OR REPLACE TABLE "{table}" ({columns})')
+            counts[table] = 0
+            frames = pd.read_sql_query(f'SELECT * FROM "{table}"', source, chunksize=chunk_rows)
+            for index, frame in enumerate(frames):
+                duck.register("__chunk", frame)
+                duck.execute(f'INSERT INTO "{table}" SELECT * FROM __chunk')
+                duck.unregister("__chunk")
+                counts[table] += len(frame)
+                if on_chunk is not None:
+                    on_chunk(table, index)
+    finally:
+        source.close()
+    return counts
+
+
+def _source_identity(db_path: str) -> dict:
+    st = os.stat(db_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def export_parquet(db_path: str, out_dir: str) -> dict:
+    """Write every table of *db_path* to ``out_dir/<table>/part-NNNNN.parquet``.
+
+    A manifest records which ``clinical.db`` the files came from, so the engine
+    stops using them once the database is replaced or modified.
+    """
+    duckdb = _duckdb()
+    duck = duckdb.connect()
+    try:
+
+        def write_chunk(table: str, index: int) -> None:
+            os.makedirs(os.path.join(out_dir, table), exist_ok=True)
+            path = os.path.join(out_dir, table, f"part-{index:05d}.parquet")
+            duck.execute(f"COPY \"{table}\" TO '{path}' (FORMAT parquet)")
+            duck.execute(f'DELETE FROM "{table}"')
+
+        counts = copy_tables(db_path, duck, on_chunk=write_chunk)
+    finally:
+        duck.close()
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump({"source": _source_identity(db_path), "tables": counts}, f)
+    return counts
+
+
+def _plain(value):
+    # SQLite has no BOOLEAN or DECIMAL: comparisons give 0/1 and float literals are REAL
+    if isinstance(value, bool):
+        return int(value)
+    return float(value) if isinstance(value, decimal.Decimal) else value
+
+
+class DuckDBEngine:
+    """Runs portable aggregates on DuckDB (see the module docstring)."""
+
+    name = "duckdb"
+
+    def __init__(self, db_path: str, parquet_dir: str | None = None, threads: int = 0):
+        self.db_path = db_path
+        self.parquet_dir = parquet_dir
+        self.threads = threads
+        self._duckdb = _duckdb()
+        self._db = None  # current DuckDB connection; replaced whole on refresh
+        self._version = None  # db_version token the mirror was built from
+        self._source = None  # Parquet mode: identity of the exported clinical.db
+        self._refresh: asyncio.Task | None = None
+        self.counters = {
+            "queries": 0,
+            "errors": 0,
+            "interrupted": 0,
+            "refreshes": 0,
+            "refresh_seconds": 0.0,
+            "rows": {},
+        }
+
+    def unportable(self, sql: str) -> str | None:
+        return unportable(sql)
+
+    def _connect(self):
+        db = self._duckdb.connect()
+        for setting in _SETTINGS:
+            db.execute(setting)
+        if self.threads > 0:
+            db.execute(f"SET GLOBAL threads = {int(self.threads)}")
+        return db
+
+    def open_parquet(self) -> None:
+        with open(os.path.join(self.parquet_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+        db = self._connect()
+        for table in manifest["tables"]:
+            pattern = os.path.join(self.parquet_dir, table, "*.parquet").replace("'", "''")
+            db.execute(f"CREATE VIEW \"{table}\" AS SELECT * FROM read_parquet('{pattern}')")
+        self._db, self._source = db, manifest["source"]
+        self.counters["rows"] = manifest["tables"]
+
+    def build(self, version=None) -> None:
+        """Mirror clinical.db now (blocking); *version* is the token it corresponds to."""
+        started = time.perf_counter()
+        db = self._connect()
+        self.counters["rows"] = copy_tables(self.db_path, db)
+        self._db, self._version = db, version  # in-flight queries keep the old connection
+        self.counters["refreshes"] += 1
+        self.counters["refresh_seconds"] += time.perf_counter() - started
+
+    def ready(self, version) -> bool:
+        """Whether the engine's data matches *version*; starts a rebuild if it does not."""
+        if self.parquet_dir:
+            if self._db is None:
+                try:
+                    self.open_parquet()
+                except (OSError, ValueError, self._duckdb.Error):
+                    logger.exception("Cannot open the Parquet export in %s", self.parquet_dir)
+                    self.parquet_dir = None  # mirror clinical.db instead
+                    return False
+            try:
+                return _source_identity(self.db_path) == self._source
+            except FileNotFoundError:
+                return False
+        if version is not None and version == self._version:
+            return True
+        if version is not None and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.create_task(asyncio.to_thread(self.build, version))
+            self._refresh.add_done_callback(_log_refresh_error)
+        return False
+
+    def _run(self, cursor, sql: str, args: list) -> list[tuple]:
+        try:
+            rows = cursor.execute(sql, args).fetchall()
+        except self._duckdb.InterruptException:
+            raise
+        except self._duckdb.Error as exc:
+            raise EngineError(str(exc)) from exc
+        finally:
+            cursor.close()
+        return [tuple(_plain(v) for v in row) for row in rows]
+
+    async def fetch(
+        self, sql: str, params: list, offset: int, limit: int, max_seconds: float = 0
+    ) -> list[tuple]:
+        """Rows ``offset .. offset + limit`` of *sql*'s result, stopped past *max_seconds*.
+
+        Without an ORDER BY the rows are sorted by every column, so pages of the
+        same result never overlap.
+        """
+        self.counters["queries"] += 1
+        body = sql.strip().rstrip(";").rstrip()
+        order = "" if has_order_by(sql) else " ORDER BY ALL"
+        page_sql = f"SELECT * FROM (\n{body}\n){order} LIMIT ? OFFSET ?"
+        cursor = self._db.cursor()
+        timer = None
+        if max_seconds > 0:
+            timer = threading.Timer(max_seconds, _interrupt, (cursor,))
+            timer.start()
+        try:
+            return await asyncio.to_thread(self._run, cursor, page_sql, [*params, limit, offset])
+        except asyncio.CancelledError:
+            _interrupt(cursor)  # the worker thread keeps running the query otherwise
+            raise
+        except self._duckdb.InterruptException as exc:
+            self.counters["interrupted"] += 1
+            raise QueryTooExpensive(
+                "runtime",
+                f"query stopped after exceeding the {max_seconds:g} s wall-clock budget",
+                budget="time",
+            ) from exc
+        except EngineError:
+            self.counters["errors"] += 1
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "source": "parquet" if self.parquet_dir else "mirror",
+            "current": self._db is not None,
+        }
+
+
+def _log_refresh_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("DuckDB mirror refresh failed", exc_info=task.exception())
+
+
+def _interrupt(cursor) -> None:
+    with contextlib.suppress(Exception):  # the query may have just finished
+        cursor.interrupt()
+
+
+ENGINES = {"duckdb": DuckDBEngine}
@@ -1,69 +1,240 @@
+"""
+Generate the synthetic ``clinical`` table.
+
+Rows are produced in fixed-size chunks, each from its own NumPy generator seeded
+with ``(seed, chunk index)``, so the output depends only on the seed, chunk size
+and end date, not on how many worker processes generated it. Chunks are
+bulk-inserted in order into a temporary file with journaling and syncing off,
+which is renamed over the target once the indexes and rollup are built.
+
+    python -m support.generate_clinical                      # 2,000 rows -> clinical.db
+    python -m support.generate_clinical --rows 10000000 --sites 200 --workers 4 --force
+    python -m support.generate_clinical --parquet clinical_parquet   # + export for DuckDB
+
+``--parquet DIR`` also writes every table to Parquet files for the DuckDB
+engine (``RUN_SQL_ENGINE=duckdb DUCKDB_PARQUET_DIR=DIR``; needs duckdb).
+"""
+
+import argparse
 import os
-from datetime import datetime, timedelta
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
 
 import numpy as np
-import pandas as pd
-from sqlalchemy import Boolean, DateTime, Integer, String, create_engine
-
-# Set random seed for reproducibility
-np.random.seed(123)
-n = 2000
-
-# Generate random dates within the past year
-today = datetime.now().date()
-random_days = np.random.choice(range(0, 365), size=n, replace=True)
-enrollment_dates = [today - timedelta(days=int(days)) for days in random_days]
-
-# Create subject IDs
-subject_ids = [f"001-{i:04d}" for i in range(1, n + 1)]
-
-# Generate site IDs
-site_ids = [f"SITE{i:02d}" for i in range(1, 26)]
-random_sites = np.random.choice(site_ids, size=n, replace=True)
-
-# Simple evaluability logic - 80% chance of being evaluable
-eval_flags = np.random.binomial(1, 0.80, size=n).astype(bool)
-
-# Generate other demographic data
-ages = np.random.choice(range(18, 86), size=n, replace=True)
-sexes = np.random.choice(["M", "F"], size=n, replace=True)
-races = np.random.choice(["White", "Black", "Asian", "Other"], size=n, replace=True)
-
-clinical_data = pd.DataFrame(
-    {
-        "STUDYID": ["DEMO-101"] * n,
-        "USUBJID": subject_ids,
-        "SITEID": random_sites,
-        "ENRLDT": enrollment_dates,
-        "EVALFLAG": eval_flags,
-        "AGE": ages,
-        "SEX": sexes,
-        "RACE": races,
-    }
-)
-
-# Set database path in the project root directory
-db_file = "clinical.db"
-
-# Check if database exists
-if os.path.exists(db_file):
-    print(f"{db_file} already exists. Skipping database creation.")
-else:
-    # Create SQLAlchemy engine
-    engine = create_engine(f"sqlite:///{db_file}")
-
-    # Define column types explicitly for all columns
-    dtype_mapping = {
-        "STUDYID": String,
-        "USUBJID": String,
-        "SITEID": String,
-        "ENRLDT": DateTime,
-        "EVALFLAG": Boolean,
-        "AGE": Integer,
-        "SEX": String,
-        "RACE": String,
-    }
-
-    clinical_data.to_sql("clinical", engine, if_exists="replace", index=False, dtype=dtype_mapping)
-
-    print(f"Generated {n} subject records and saved to {db_file}")
+
+from support.rollups import ROLLUP_TABLE, build_rollups
+
+MAX_ROWS = 100_000_000
+
+# Same declared types as the original pandas/SQLAlchemy export
+CREATE_TABLE = """
+CREATE TABLE clinical (
+    "STUDYID" VARCHAR,
+    "USUBJID" VARCHAR,
+    "SITEID" VARCHAR,
+    "ENRLDT" DATETIME,
+    "EVALFLAG" BOOLEAN,
+    "AGE" INTEGER,
+    "SEX" VARCHAR,
+    "RACE" VARCHAR
+)"""
+COLUMNS = ("STUDYID", "USUBJID", "SITEID", "ENRLDT", "EVALFLAG", "AGE", "SEX", "RACE")
+
+SEXES = np.array(["M", "F"])
+RACES = np.array(["White", "Black", "Asian", "Other"])
+EVALUABLE_RATE = 0.80
+ENROLMENT_DAYS = 365
+
+
+@dataclass(frozen=True)
+class Spec:
+    rows: int
+    studies: int = 1
+    sites: int = 25
+    seed: int = 123
+    chunk_size: int = 500_000
+    end_date: str = ""  # ISO date of the latest possible enrolment
+
+    @property
+    def chunks(self) -> int:
+        return -(-self.rows // self.chunk_size)
+
+
+def generate_chunk(spec: Spec, index: int) -> list[np.ndarray]:
+    """Columns (in ``COLUMNS`` order) for rows ``[index * chunk_size, ...)``."""
+    start = index * spec.chunk_size
+    size = min(spec.chunk_size, spec.rows - start)
+    rng = np.random.default_rng([spec.seed, index])
+
+    study = rng.integers(0, spec.studies, size)
+    site = rng.integers(0, spec.sites, size)
+    days = rng.integers(0, ENROLMENT_DAYS, size)
+    evaluable = (rng.random(size) < EVALUABLE_RATE).astype(np.int8)
+    age = rng.integers(18, 86, size)
+    sex = rng.integers(0, len(SEXES), size)
+    race = rng.integers(0, len(RACES), size)
+
+    # Small lookup tables indexed by the random draws keep string building vectorised
+    study_ids = np.array([f"DEMO-{101 + s}" for s in range(spec.studies)])
+    subject_prefixes = np.array([f"{s + 1:03d}-" for s in range(spec.studies)])
+    site_ids = np.array(
+        [f"SITE{s + 1:0{max(2, len(str(spec.sites)))}d}" for s in range(spec.sites)]
+    )
+    end = np.datetime64(spec.end_date, "D")
+    dates = np.char.add((end - np.arange(ENROLMENT_DAYS)).astype(str), " 00:00:00.000000")
+    numbers = np.arange(start + 1, start + size + 1).astype(str)
+    subject_ids = np.char.add(
+        subject_prefixes[study], np.char.zfill(numbers, max(4, len(str(spec.rows))))
+    )
+    return [
+        study_ids[study],
+        subject_ids,
+        site_ids[site],
+        dates[days],
+        evaluable,
+        age,
+        SEXES[sex],
+        RACES[race],
+    ]
+
+
+def _chunks(spec: Spec, workers: int):
+    """Yield chunks in order, generating up to ``2 * workers`` ahead in a process pool."""
+    if workers <= 1:
+        for index in range(spec.chunks):
+            yield generate_chunk(spec, index)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        indexes = iter(range(spec.chunks))
+        for index in indexes:
+            pending.append(pool.submit(generate_chunk, spec, index))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            yield pending.popleft().result()
+            index = next(indexes, None)
+            if index is not None:
+                pending.append(pool.submit(generate_chunk, spec, index))
+
+
+def write_database(spec: Spec, db_file: str, workers: int = 1) -> None:
+    """Generate *spec* into *db_file* (replaced atomically) with indexes and rollup."""
+    tmp_file = f"{db_file}.tmp"
+    for path in (tmp_file, f"{tmp_file}-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = sqlite3.connect(tmp_file, isolation_level=None)
+    # Bulk-load settings: a failed run just leaves a temporary file to discard
+    conn.execute("PRAGMA journal_mode=OFF;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute("PRAGMA locking_mode=EXCLUSIVE;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-262144;")  # 256 MiB
+    conn.execute(CREATE_TABLE)
+
+    insert = f"INSERT INTO clinical VALUES ({', '.join('?' * len(COLUMNS))});"
+    started = time.perf_counter()
+    written = 0
+    for columns in _chunks(spec, workers):
+        conn.execute("BEGIN;")
+        conn.executemany(insert, zip(*(c.tolist() for c in columns)))
+        conn.execute("COMMIT;")
+        written += len(columns[0])
+        if spec.chunks > 1:
+            rate = written / (time.perf_counter() - started)
+            print(f"  {written:,}/{spec.rows:,} rows ({rate:,.0f} rows/s)", flush=True)
+
+    rollup_rows = build_rollups(conn)
+    conn.execute("PRAGMA analysis_limit=1000;")
+    conn.execute("ANALYZE;")
+    conn.close()
+
+    # The old file's WAL must not be replayed onto the new one
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_file + suffix):
+            os.remove(db_file + suffix)
+    os.replace(tmp_file, db_file)
+    print(
+        f"Generated {spec.rows:,} subject records and saved to {db_file} "
+        f"in {time.perf_counter() - started:.1f} s ({rollup_rows:,} {ROLLUP_TABLE} rows)"
+    )
+
+
+def ensure_rollups(db_file: str) -> None:
+    """Add indexes and the rollup to a database generated before they existed."""
+    conn = sqlite3.connect(db_file)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (ROLLUP_TABLE,)
+    ).fetchone()
+    if not exists:
+        print(f"Built {build_rollups(conn)} {ROLLUP_TABLE} rows and indexes")
+    conn.close()
+
+
+def write_parquet(db_file: str, out_dir: str) -> None:
+    """Export *db_file* to Parquet for the DuckDB engine (support/engines.py)."""
+    from support.engines import export_parquet
+
+    started = time.perf_counter()
+    counts = export_parquet(db_file, out_dir)
+    print(
+        f"Exported {', '.join(f'{n:,} {t}' for t, n in counts.items())} rows to {out_dir} "
+        f"in {time.perf_counter() - started:.1f} s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=2000, help=f"Subjects (max {MAX_ROWS:,})")
+    parser.add_argument("--studies", type=int, default=1, help="Studies (DEMO-101, DEMO-102, ...)")
+    parser.add_argument("--sites", type=int, default=25, help="Sites (SITE01, SITE02, ...)")
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--chunk-size", type=int, default=500_000, help="Rows per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="Generator processes")
+    parser.add_argument(
+        "--end-date", default=date.today().isoformat(), help="Latest enrolment date (ISO)"
+    )
+    parser.add_argument("--db", default="clinical.db", help="Output SQLite file")
+    parser.add_argument(
+        "--force", action="store_true", help="Replace an existing database (stop the server first)"
+    )
+    parser.add_argument("--parquet", metavar="DIR", help="Also export the tables to Parquet")
+    args = parser.parse_args()
+    if not 1 <= args.rows <= MAX_ROWS:
+        parser.error(f"--rows must be between 1 and {MAX_ROWS:,}")
+    if not 1 <= args.studies <= 999:
+        parser.error("--studies must be between 1 and 999")
+    if args.sites < 1 or args.chunk_size < 1 or args.workers < 1:
+        parser.error("--sites, --chunk-size and --workers must be positive")
+    try:
+        date.fromisoformat(args.end_date)
+    except ValueError:
+        parser.error("--end-date must be an ISO date (YYYY-MM-DD)")
+
+    if os.path.exists(args.db) and not args.force:
+        print(f"{args.db} already exists. Skipping database creation.")
+        ensure_rollups(args.db)
+        if args.parquet:
+            write_parquet(args.db, args.parquet)
+        return
+    spec = Spec(
+        rows=args.rows,
+        studies=args.studies,
+        sites=args.sites,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        end_date=args.end_date,
+    )
+    write_database(spec, args.db, args.workers)
+    if args.parquet:
+        write_parquet(args.db, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
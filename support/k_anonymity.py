@@ -0,0 +1,112 @@
+"""
+Post-execution enforcement of the protocol's minimum-subjects rule (§4).
+
+A result with subject-level rows must cover at least ``k`` (5) unique subjects.
+The SQL text alone cannot show that, so for queries that ``sql_policy.precheck``
+marks ``row_level``, ``run_sql`` asks the database instead. ``subject_probe``
+builds a companion statement: the original query with the subject column
+appended to its select list. It returns exactly the rows the result does
+(WHERE, ORDER BY and LIMIT included), each tagged with its subject.
+
+* ``subjects_sql`` counts the distinct subjects behind the result, stopping at
+  ``k``. In reject mode, a non-empty result with fewer than ``k`` subjects is
+  refused as a whole.
+* ``small_classes_sql`` lists the value combinations (equivalence classes) of
+  the result that fewer than ``k`` subjects share. In suppress mode,
+  ``suppress`` drops the rows that carry one of them.
+
+All of them run inside SQLite and return only counts or the small classes, so
+nothing is copied to Python. The capped count usually stops after a handful of
+rows; ``count_sql`` and ``small_classes_sql`` (suppress mode) make full passes over
+the result (see ``support/bench_k_anonymity.py``).
+"""
+
+from typing import NamedTuple
+
+from support.sql_policy import SUBJECT_ID, SQLParseError, token_spans
+
+SUBJECT_ALIAS = "__k_subject"
+
+
+class SubjectCheck(NamedTuple):
+    subjects: int  # at most k when counted with subjects_sql
+    rows: int | None  # None when only the subjects were counted
+    small_classes: frozenset[tuple] = frozenset()
+    suppressed_rows: int = 0  # rows in the small classes
+
+
+def subject_probe(sql: str, subject_column: str = SUBJECT_ID) -> str | None:
+    """*sql* with ``, <subject_column> AS __k_subject`` appended to its select list.
+
+    Returns ``None`` when the probe would not return the same rows: there is no
+    top-level FROM, or SELECT DISTINCT is combined with LIMIT/OFFSET (DISTINCT on
+    the wider row keeps every (row, subject) pair, so it is only equivalent
+    without a limit).
+    """
+    try:
+        spans = token_spans(sql)
+    except SQLParseError:
+        return None
+    while spans and spans[-1][0].kind == "op" and spans[-1][0].value == ";":
+        spans.pop()
+    if not spans:
+        return None
+    depth = 0
+    from_at = None
+    distinct = limited = False
+    for i, (tok, start, _) in enumerate(spans):
+        if tok.kind == "op" and tok.value in "()":
+            depth += 1 if tok.value == "(" else -1
+        elif depth == 0 and tok.kind == "word":
+            word = tok.upper
+            if i == 1 and word == "DISTINCT":
+                distinct = True
+            elif word == "FROM" and from_at is None:
+                from_at = start
+            elif word in ("LIMIT", "OFFSET"):
+                limited = True
+    if from_at is None or (distinct and limited):
+        return None
+    body = sql[: spans[-1][2]]
+    return f"{body[:from_at].rstrip()}, {subject_column} AS {SUBJECT_ALIAS} {body[from_at:]}"
+
+
+def subjects_sql(probe: str, k: int) -> str:
+    """Distinct subjects behind the result of *probe*'s query, counted up to *k*."""
+    return f"SELECT COUNT(*) FROM (SELECT DISTINCT {SUBJECT_ALIAS} FROM ({probe}) LIMIT {int(k)})"
+
+
+def count_sql(probe: str) -> str:
+    """Distinct subjects behind the result of *probe*'s query, and its row count."""
+    return f"SELECT COUNT(DISTINCT {SUBJECT_ALIAS}), COUNT(*) FROM ({probe})"
+
+
+def small_classes_sql(probe: str, width: int, k: int, limit: int) -> str:
+    """Up to *limit* combinations of the *width* result values shared by fewer than *k* subjects.
+
+    Each row holds the values followed by the number of result rows carrying them.
+    """
+    columns = ", ".join(f"c{i}" for i in range(width))
+    return (
+        f"WITH __k_result({columns}, {SUBJECT_ALIAS}) AS ({probe}) "
+        f"SELECT {columns}, COUNT(*) FROM __k_result GROUP BY {columns} "
+        f"HAVING COUNT(DISTINCT {SUBJECT_ALIAS}) < {int(k)} LIMIT {int(limit)}"
+    )
+
+
+def suppress(rows: list[tuple], small_classes: frozenset[tuple]) -> tuple[list[tuple], list[int]]:
+    """Drop rows whose values form a small class; returns the kept rows and their indices."""
+    if not small_classes:
+        return rows, list(range(len(rows)))
+    kept = [i for i, row in enumerate(rows) if row not in small_classes]
+    return [rows[i] for i in kept], kept
+
+
+class TooFewSubjects(Exception):
+    """The result would identify fewer subjects than the protocol allows."""
+
+    def __init__(self, reason: str, subjects: int, k: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.subjects = subjects
+        self.k = k
@@ -0,0 +1,167 @@
+"""
+Latency histograms for the MCP server.
+
+Code wraps each stage of a tool call in ``metrics.span("stage")`` (or reports a
+duration with ``metrics.record``). Every observation goes into a cumulative,
+fixed-bucket histogram per stage, and, inside ``metrics.call_stages()``, into a
+per-call ``{stage: seconds}`` dict as well, so one slow call can be broken down.
+Work whose result may be thrown away (a speculative read) can ``hold`` its
+observations and have them ``replay``ed only if the result is used.
+
+``render_prometheus()`` produces the text exposition format for a ``/metrics``
+route; ``snapshot()`` summarises the histograms (count, mean, max and estimated
+p50/p95/p99) as JSON.
+"""
+
+import bisect
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Upper bounds in seconds; the last bucket (+Inf) is implicit
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)  # fmt: skip
+
+_call_stages: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "call_stages", default=None
+)
+_held: contextvars.ContextVar[list | None] = contextvars.ContextVar("held_stages", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate the *q* quantile by interpolating within its bucket (clamped to min/max)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                estimate = lower + (upper - lower) * (rank - seen) / n
+                return min(max(estimate, self.min), self.max)
+            seen += n
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_seconds": self.sum,
+            "mean_ms": self.sum / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.50) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Metrics:
+    """Named families of histograms, each keyed by a single label value."""
+
+    def __init__(self, namespace: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        # family -> (label name, {label value: Histogram})
+        self._families: dict[str, tuple[str, dict[str, Histogram]]] = {}
+
+    def observe(self, family: str, label: str, value: str, seconds: float) -> None:
+        _, histograms = self._families.setdefault(family, (label, {}))
+        if value not in histograms:
+            histograms[value] = Histogram(self.buckets)
+        histograms[value].observe(seconds)
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Add a stage duration to its histogram and to the current call, if any."""
+        held = _held.get()
+        if held is not None:
+            held.append((stage, seconds))
+            return
+        self.observe("stage", "stage", stage, seconds)
+        stages = _call_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    @contextmanager
+    def call_stages(self) -> Iterator[dict]:
+        """Collect the stages recorded by this call (and tasks it starts) into a dict."""
+        token = _call_stages.set({})
+        try:
+            yield _call_stages.get()
+        finally:
+            _call_stages.reset(token)
+
+    def hold(self, into: list) -> None:
+        """Keep stages recorded from now on in this task (and tasks it starts) in *into*."""
+        _held.set(into)
+
+    def replay(self, held: list) -> None:
+        """Record stages kept by ``hold``, into the histograms and the current call."""
+        for stage, seconds in held:
+            self.record(stage, seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            family: {value: h.summary() for value, h in sorted(histograms.items())}
+            for family, (_, histograms) in sorted(self._families.items())
+        }
+
+    def render_prometheus(self, gauges: dict[str, float] | None = None) -> str:
+        """Histograms (``<namespace>_<family>_seconds``) plus optional extra gauges."""
+        lines = []
+        for family, (label, histograms) in sorted(self._families.items()):
+            name = f"{self.namespace}_{family}_seconds"
+            lines.append(f"# HELP {name} Duration of each {label}.")
+            lines.append(f"# TYPE {name} histogram")
+            for value, h in sorted(histograms.items()):
+                cumulative = 0
+                for bound, n in zip((*h.buckets, math.inf), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {h.sum!r}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {h.count}')
+        for key, number in sorted((gauges or {}).items()):
+            name = f"{self.namespace}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {number!r}")
+        return "\n".join(lines) + "\n"
+
+
+def flatten_numbers(data: dict, prefix: str = "") -> dict[str, float]:
+    """``{"a": {"b": 1}}`` -> ``{"a_b": 1}``, keeping only numeric (and boolean) leaves."""
+    out: dict[str, float] = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(flatten_numbers(value, f"{name}_"))
+        elif isinstance(value, (int, float)):
+            out[name] = float(value)
+    return out
@@ -0,0 +1,210 @@
+"""
+Persistent cache of LLM policy verdicts.
+
+Entries are keyed on the canonical SQL text (see ``sql_policy.canonical``: case
+and whitespace are normalised, literals are kept, since ``LIMIT 1`` and
+``LIMIT 100`` may get different verdicts) plus a hash of the study protocol, and
+stored in a small SQLite file so they survive server restarts. Whenever the
+protocol text changes, verdicts recorded under the old protocol are purged.
+Eviction is LRU (by last use) with a maximum age.
+
+A hit only reads. Its ``last_used``/``hits`` update is kept in memory and
+written with the next store, or at most every ``flush_seconds``.
+"""
+
+import asyncio
+import hashlib
+import time
+
+import aiosqlite
+
+from support.sql_policy import SQLParseError, canonical
+
+# Mixed into every key: entries stored under the old literal-blind fingerprint never match
+KEY_VERSION = "canonical"
+
+
+def protocol_hash(protocol_text: str) -> str:
+    return hashlib.sha256(protocol_text.encode("utf-8")).hexdigest()
+
+
+def sql_key(sql: str) -> str:
+    """Hash of the canonical query; falls back to the raw text if it cannot be tokenised."""
+    try:
+        normalised = canonical(sql)
+    except SQLParseError:
+        normalised = " ".join(sql.split())
+    return hashlib.sha256(f"{KEY_VERSION}\n{normalised}".encode("utf-8")).hexdigest()
+
+
+class PolicyCache:
+    """SQLite-backed LRU/TTL cache of ``(allowed, reason)`` verdicts."""
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 5000,
+        ttl_seconds: float = 7 * 24 * 3600,
+        flush_seconds: float = 5.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.flush_seconds = flush_seconds
+        self._db: aiosqlite.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._protocol_hash: str | None = None
+        # (key, protocol hash) -> (last_used, hits) of hits not yet written
+        self._touched: dict[tuple[str, str], tuple[float, int]] = {}
+        self._flushed_at = time.monotonic()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "stores": 0,
+            "llm_calls": 0,
+            "llm_seconds": 0.0,
+            "llm_prompt_tokens": 0,
+            "llm_cached_prompt_tokens": 0,
+            "llm_completion_tokens": 0,
+        }
+
+    async def _connect(self) -> aiosqlite.Connection:
+        if self._db is None:
+            db = aiosqlite.connect(self.path)
+            db.daemon = True  # long-lived worker thread must not block interpreter exit
+            await db
+            await db.execute("PRAGMA journal_mode=WAL;")
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS policy_verdicts (
+                fingerprint TEXT NOT NULL,
+                protocol_hash TEXT NOT NULL,
+                allowed BOOLEAN NOT NULL,
+                reason TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (fingerprint, protocol_hash)
+            )
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_policy_verdicts_last_used "
+                "ON policy_verdicts (last_used);"
+            )
+            await db.commit()
+            self._db = db
+        return self._db
+
+    async def _sync_protocol(self, db: aiosqlite.Connection, digest: str) -> None:
+        """Drop verdicts that were given under a different protocol version."""
+        if digest == self._protocol_hash:
+            return
+        cur = await db.execute("DELETE FROM policy_verdicts WHERE protocol_hash != ?;", (digest,))
+        self.counters["invalidations"] += max(cur.rowcount, 0)
+        await db.commit()
+        self._protocol_hash = digest
+        self._touched = {k: v for k, v in self._touched.items() if k[1] == digest}
+
+    async def _flush_touched(self, db: aiosqlite.Connection) -> None:
+        """Write the batched hit updates (the caller holds the lock and commits)."""
+        touched, self._touched = self._touched, {}
+        self._flushed_at = time.monotonic()
+        if touched:
+            await db.executemany(
+                "UPDATE policy_verdicts SET last_used = MAX(last_used, ?), hits = hits + ? "
+                "WHERE fingerprint = ? AND protocol_hash = ?;",
+                [(used, hits, key, digest) for (key, digest), (used, hits) in touched.items()],
+            )
+
+    async def get(self, sql: str, protocol_text: str) -> tuple[bool, str] | None:
+        """Return the cached verdict for *sql*, or ``None`` on a miss."""
+        key, digest = sql_key(sql), protocol_hash(protocol_text)
+        now = time.time()
+        async with self._lock:
+            db = await self._connect()
+            await self._sync_protocol(db, digest)
+            cur = await db.execute(
+                "SELECT allowed, reason, created_at FROM policy_verdicts "
+                "WHERE fingerprint = ? AND protocol_hash = ?;",
+                (key, digest),
+            )
+            row = await cur.fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            allowed, reason, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._touched.pop((key, digest), None)
+                await db.execute(
+                    "DELETE FROM policy_verdicts WHERE fingerprint = ? AND protocol_hash = ?;",
+                    (key, digest),
+                )
+                await db.commit()
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            _, hits = self._touched.get((key, digest), (now, 0))
+            self._touched[(key, digest)] = (now, hits + 1)
+            if time.monotonic() - self._flushed_at >= self.flush_seconds:
+                await self._flush_touched(db)
+                await db.commit()
+            self.counters["hits"] += 1
+            return bool(allowed), reason
+
+    async def put(self, sql: str, protocol_text: str, allowed: bool, reason: str) -> None:
+        """Store a verdict and evict the least recently used entries beyond ``max_entries``."""
+        key, digest = sql_key(sql), protocol_hash(protocol_text)
+        now = time.time()
+        async with self._lock:
+            db = await self._connect()
+            await self._sync_protocol(db, digest)
+            await self._flush_touched(db)  # eviction below goes by last_used
+            await db.execute(
+                "INSERT OR REPLACE INTO policy_verdicts "
+                "(fingerprint, protocol_hash, allowed, reason, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?);",
+                (key, digest, allowed, reason, now, now),
+            )
+            cur = await db.execute(
+                "DELETE FROM policy_verdicts WHERE rowid IN ("
+                "SELECT rowid FROM policy_verdicts ORDER BY last_used DESC LIMIT -1 OFFSET ?);",
+                (self.max_entries,),
+            )
+            self.counters["evictions"] += max(cur.rowcount, 0)
+            await db.commit()
+            self.counters["stores"] += 1
+
+    def record_llm_call(self, seconds: float, usage=None) -> None:
+        """Track the latency and token usage of a real LLM round-trip.
+
+        *usage* is the response's ``usage`` object, if the API reported one.
+        """
+        self.counters["llm_calls"] += 1
+        self.counters["llm_seconds"] += seconds
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.counters["llm_prompt_tokens"] += usage.prompt_tokens or 0
+            self.counters["llm_cached_prompt_tokens"] += getattr(details, "cached_tokens", 0) or 0
+            self.counters["llm_completion_tokens"] += usage.completion_tokens or 0
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        avg_llm = c["llm_seconds"] / c["llm_calls"] if c["llm_calls"] else 0.0
+        return {
+            **c,
+            "hit_rate": c["hits"] / lookups if lookups else 0.0,
+            "avg_llm_seconds": avg_llm,
+            "avg_prompt_tokens": c["llm_prompt_tokens"] / c["llm_calls"] if c["llm_calls"] else 0.0,
+            "estimated_seconds_saved": c["hits"] * avg_llm,
+        }
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._db is not None:
+                await self._flush_touched(self._db)
+                await self._db.commit()
+                await self._db.close()
+                self._db = None
@@ -0,0 +1,159 @@
+"""
+Prompt for the LLM policy gate (``clinical_mcp.llm_policy_check``).
+
+The gate only needs the protocol's rules, so ``compile_digest`` keeps sections 3-5
+(approved operations, privacy protection, prohibited queries) and drops the
+overview, data dictionary, examples and revision history, along with markdown
+emphasis. The digest is compiled once per protocol version.
+
+``build_messages`` lays the request out as one system message (instructions plus
+digest) followed by the SQL, so every call shares a byte-identical prefix that
+providers can cache. The model must answer with ``RESPONSE_FORMAT``, a strict
+JSON schema, which ``parse_verdict`` validates. ``build_batch_messages`` sends
+several queries after the same prefix as a JSON array of numbered entries (JSON
+escaping keeps one query's text from posing as another entry); the answer then
+follows ``BATCH_RESPONSE_FORMAT``, one verdict per query (``parse_verdicts``).
+
+``python -m support.bench_policy_prompt`` compares prompt sizes with the previous
+layout (the whole protocol as a second system message).
+"""
+
+import functools
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+RULE_SECTIONS = ("3", "4", "5")
+
+INSTRUCTIONS = (
+    "You are a data-governance gatekeeper for a clinical trial database. The user message "
+    "is a SQL query, or a JSON array of numbered SQL queries to judge one by one. Decide whether "
+    "it violates the study protocol rules below. Set allowed to false only when a rule is "
+    "explicitly and clearly violated, and name that rule (by section) in reason; otherwise "
+    "set allowed to true."
+)
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "policy_verdict",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"allowed": {"type": "boolean"}, "reason": {"type": "string"}},
+            "required": ["allowed", "reason"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "policy_verdicts",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "verdicts": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "query": {"type": "integer"},
+                            "allowed": {"type": "boolean"},
+                            "reason": {"type": "string"},
+                        },
+                        "required": ["query", "allowed", "reason"],
+                        "additionalProperties": False,
+                    },
+                }
+            },
+            "required": ["verdicts"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_HEADING = re.compile(r"^##\s+(\d+)\.\s*(.+?)\s*$", re.MULTILINE)
+_EMPHASIS = re.compile(r"\*\*|__|`|(?<![\w*])\*(?=\S)|(?<=\S)\*(?![\w*])")
+
+
+@functools.lru_cache(maxsize=4)
+def compile_digest(protocol_text: str, sections: tuple[str, ...] = RULE_SECTIONS) -> str:
+    """The rule *sections* of *protocol_text*, as compact plain text.
+
+    Falls back to the whole protocol if any of them is missing, so a
+    restructured protocol never silently drops rules.
+    """
+    headings = list(_HEADING.finditer(protocol_text))
+    found = {}
+    for heading, following in zip(headings, [*headings[1:], None]):
+        body = protocol_text[heading.end() : following.start() if following else None]
+        lines = [" ".join(_EMPHASIS.sub("", line).split()) for line in body.splitlines()]
+        found[heading.group(1)] = f"§{heading.group(1)} {heading.group(2)}\n" + "\n".join(
+            line for line in lines if line
+        )
+    missing = [s for s in sections if s not in found]
+    if missing:
+        logger.warning("Protocol has no section(s) %s; sending it whole", ", ".join(missing))
+        return protocol_text.strip()
+    return "\n".join(found[s] for s in sections)
+
+
+def system_prompt(protocol_text: str) -> str:
+    """The stable prefix of every policy request (also keys ``policy_cache``)."""
+    return f"{INSTRUCTIONS}\n\nStudy protocol rules:\n{compile_digest(protocol_text)}"
+
+
+def build_messages(protocol_text: str, sql: str) -> list[dict]:
+    return [
+        {"role": "system", "content": system_prompt(protocol_text)},
+        {"role": "user", "content": sql},
+    ]
+
+
+def parse_verdict(content: str | None) -> tuple[bool, str]:
+    """``(allowed, reason)`` from a ``RESPONSE_FORMAT`` reply; ``ValueError`` if malformed."""
+    try:
+        data = json.loads(content or "")
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"policy reply is not JSON: {exc}. Reply was: {content!r}") from exc
+    if not isinstance(data, dict) or not isinstance(data.get("allowed"), bool):
+        raise ValueError(f"policy reply does not match the verdict schema: {content!r}")
+    return data["allowed"], str(data.get("reason") or "")
+
+
+def build_batch_messages(protocol_text: str, sqls: list[str]) -> list[dict]:
+    """Like ``build_messages``, for several queries numbered from 1."""
+    listing = json.dumps(
+        [{"query": i, "sql": sql} for i, sql in enumerate(sqls, 1)], ensure_ascii=False
+    )
+    return [
+        {"role": "system", "content": system_prompt(protocol_text)},
+        {"role": "user", "content": listing},
+    ]
+
+
+def parse_verdicts(content: str | None, count: int) -> list[tuple[bool, str]]:
+    """One ``(allowed, reason)`` per query from a ``BATCH_RESPONSE_FORMAT`` reply, in order.
+
+    Raises ``ValueError`` if the reply is malformed or does not judge every query once.
+    """
+    try:
+        data = json.loads(content or "")
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"policy reply is not JSON: {exc}. Reply was: {content!r}") from exc
+    verdicts = data.get("verdicts") if isinstance(data, dict) else None
+    if not isinstance(verdicts, list):
+        raise ValueError(f"policy reply does not match the verdicts schema: {content!r}")
+    found = {}
+    for verdict in verdicts:
+        if not isinstance(verdict, dict) or not isinstance(verdict.get("allowed"), bool):
+            raise ValueError(f"policy reply does not match the verdicts schema: {content!r}")
+        found[verdict.get("query")] = (verdict["allowed"], str(verdict.get("reason") or ""))
+    if len(verdicts) != count or set(found) != set(range(1, count + 1)):
+        raise ValueError(f"policy reply does not judge queries 1-{count} once each: {content!r}")
+    return [found[i] for i in range(1, count + 1)]
@@ -14,7 +14,9 @@ WORKFLOW_INSTRUCTIONS = (
     "  4. Think about which table(s)/column(s) are required.\n"
     "  5. Write ONE read‑only, parameterised SELECT statement that *only*\n"
     "     references tables/columns that were present in step 1.\n"
-    "  6. Call the tool `run_sql` with that statement (and parameters, if any).\n\n"
+    "  6. Call the tool `run_sql` with that statement (and parameters, if any).\n"
+    "     If the question needs several queries that do not depend on each other's\n"
+    "     results, send them together in one `run_sql_batch` call instead.\n\n"
     "Never reference a table or column that does not exist. If the user asks\n"
     "for something unavailable, apologise and explain what *is* available.\n\n"
     "The assistant must rely on the\n"
@@ -0,0 +1,106 @@
+"""
+In-memory cache of query result pages.
+
+Entries are keyed on the canonical SQL text (see ``sql_policy.canonical``), the
+bound parameters and the page window, and are only valid for the data version
+they were read under. Every lookup first asks ``version_probe`` for the current
+version of the database; when it differs from the last one seen, the whole cache
+is dropped. A probe returning ``None`` (e.g. the file is missing) bypasses the cache.
+
+Memory is bounded by an estimate of each entry's size; least recently used
+entries are evicted once ``max_bytes`` is exceeded.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+import pydantic_core
+
+from support.sql_policy import SQLParseError, canonical
+
+
+def result_key(query: str, params: list, offset: int, limit: int) -> str:
+    try:
+        normalised = canonical(query)
+    except SQLParseError:
+        normalised = " ".join(query.split())
+    payload = json.dumps([normalised, params, offset, limit], default=repr)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """LRU cache of ``(columns, rows)`` pages, invalidated when the data version changes."""
+
+    def __init__(
+        self,
+        version_probe: Callable[[], Awaitable[Hashable | None]],
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.version_probe = version_probe
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[list[str], list[tuple], int]] = OrderedDict()
+        self._bytes = 0
+        self._version: Hashable | None = None
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "oversized": 0,
+        }
+
+    async def get(self, key: str) -> tuple[tuple[list[str], list[tuple]] | None, Hashable | None]:
+        """Return ``(page, version)``; *page* is ``None`` on a miss.
+
+        Pass *version* back to ``put`` so a page read while the data changed is not stored.
+        """
+        if self.max_bytes <= 0:
+            return None, None
+        version = await self.version_probe()
+        if version != self._version:
+            if self._entries:
+                self.counters["invalidations"] += 1
+            self.clear()
+            self._version = version
+        entry = self._entries.get(key) if version is not None else None
+        if entry is None:
+            self.counters["misses"] += 1
+            return None, version
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return (entry[0], entry[1]), version
+
+    def put(self, key: str, columns: list[str], rows: list[tuple], version: Hashable) -> None:
+        if version is None or version != self._version:
+            return
+        size = len(pydantic_core.to_json([columns, rows], fallback=str)) + 64
+        if size > self.max_bytes // 4:
+            self.counters["oversized"] += 1
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (columns, rows, size)
+        self._bytes += size
+        self.counters["stores"] += 1
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.counters["evictions"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        return {
+            **c,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hit_rate": c["hits"] / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,190 @@
+"""
+Paging and encoding of ``run_sql`` results.
+
+``run_sql`` returns at most one page of rows; when more remain it registers a
+continuation with ``CursorStore`` and hands the agent an opaque token for the
+``fetch_more`` tool. The token maps to server-side state (the approved query,
+its parameters and the next offset), so it cannot be used to run anything else.
+
+Pages can be encoded as row dicts (the default), a compact columnar layout, or
+base64 Arrow IPC / Parquet for bulk exports (these need the optional ``pyarrow``).
+"""
+
+import base64
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pydantic_core
+
+RESULT_FORMATS = ("rows", "columnar", "arrow", "parquet")
+
+
+@dataclass
+class Continuation:
+    query: str
+    params: list
+    offset: int
+    page_size: int
+    expires: float
+    fmt: str = "rows"
+    small_classes: frozenset = frozenset()  # rows to suppress (support/k_anonymity.py)
+
+
+class CursorStore:
+    """Single-use continuation tokens with a TTL and a bounded number of live entries."""
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Continuation] = OrderedDict()
+
+    def register(
+        self,
+        query: str,
+        params: list,
+        offset: int,
+        page_size: int,
+        fmt: str = "rows",
+        small_classes: frozenset = frozenset(),
+    ) -> str:
+        self._expire()
+        token = secrets.token_urlsafe(16)
+        self._entries[token] = Continuation(
+            query,
+            list(params),
+            offset,
+            page_size,
+            time.monotonic() + self.ttl_seconds,
+            fmt,
+            small_classes,
+        )
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return token
+
+    def take(self, token: str) -> Continuation | None:
+        """Remove and return the continuation for *token* (``None`` if unknown or expired)."""
+        self._expire()
+        return self._entries.pop(token, None)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            token, entry = next(iter(self._entries.items()))
+            if entry.expires > now:
+                break
+            del self._entries[token]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def paged_query(query: str) -> str:
+    """Wrap *query* so a later page can be read with ``LIMIT ? OFFSET ?`` appended params."""
+    body = query.strip().rstrip(";").rstrip()
+    # newline before ")" so a trailing "-- comment" cannot swallow it
+    return f"SELECT * FROM (\n{body}\n) LIMIT ? OFFSET ?"
+
+
+def to_json(data) -> str:
+    """Compact JSON for tool results (FastMCP's default serializer pretty-prints)."""
+    return pydantic_core.to_json(data, fallback=str).decode()
+
+
+def take_within_budget(
+    rows: list[tuple], max_bytes: int, per_row_overhead: int = 0
+) -> tuple[list[tuple], bool]:
+    """Return the longest prefix of *rows* whose JSON size fits *max_bytes* (at least one row).
+
+    *per_row_overhead* accounts for bytes the encoding adds to every row (e.g. the
+    repeated keys of the ``rows`` format). The second value is True when rows had
+    to be dropped to respect the budget.
+    """
+    size = 2  # "[]"
+    for i, row in enumerate(rows):
+        size += len(pydantic_core.to_json(row, fallback=str)) + per_row_overhead + 1
+        if size > max_bytes and i > 0:
+            return rows[:i], True
+    return rows, False
+
+
+def row_overhead(columns: list[str], fmt: str) -> int:
+    """Extra JSON bytes per row for *fmt* beyond the bare list of values."""
+    if fmt == "rows":
+        return sum(len(c) + 3 for c in columns)  # "name":
+    return 0
+
+
+def _sqlite_type(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool | int):
+        return "INTEGER"
+    if isinstance(value, float):
+        return "REAL"
+    if isinstance(value, bytes):
+        return "BLOB"
+    return "TEXT"
+
+
+def column_types(columns: list[str], rows: list[tuple]) -> list[str]:
+    """Storage class of the first non-NULL value in each column (SQLite typing is per value)."""
+    types = ["NULL"] * len(columns)
+    pending = set(range(len(columns)))
+    for row in rows:
+        for i in list(pending):
+            if row[i] is not None:
+                types[i] = _sqlite_type(row[i])
+                pending.discard(i)
+        if not pending:
+            break
+    return types
+
+
+def _arrow_table(columns: list[str], rows: list[tuple]):
+    try:
+        import pyarrow as pa
+    except ImportError as exc:
+        raise ValueError("the arrow/parquet formats require pyarrow (pip install pyarrow)") from exc
+    try:
+        return pa.table({name: [row[i] for row in rows] for i, name in enumerate(columns)})
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as exc:
+        raise ValueError(f"result cannot be encoded as Arrow: {exc}") from exc
+
+
+def encode_page(columns: list[str], rows: list[tuple], fmt: str) -> dict:
+    """Encode one page of *rows* in the requested result format.
+
+    Raises:
+        ValueError: for an unknown format, or when Arrow encoding is unavailable/impossible.
+    """
+    if fmt == "rows":
+        return {"rows": [dict(zip(columns, row)) for row in rows]}
+    if fmt == "columnar":
+        return {
+            "columns": columns,
+            "types": column_types(columns, rows),
+            "data": [list(row) for row in rows],
+        }
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; use one of {', '.join(RESULT_FORMATS)}")
+
+    table = _arrow_table(columns, rows)
+    import pyarrow as pa
+
+    sink = pa.BufferOutputStream()
+    if fmt == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, sink, compression="zstd")
+    payload = sink.getvalue().to_pybytes()
+    return {
+        "columns": columns,
+        "encoding": "base64",
+        fmt: base64.b64encode(payload).decode("ascii"),
+    }
@@ -0,0 +1,418 @@
+"""
+Covering indexes and a materialised rollup of the ``clinical`` table.
+
+``build_rollups`` (run by ``generate_clinical.py``) creates an index set for the
+usual GROUP BY columns and ``clinical_rollup``: one row per combination of
+study, site, enrolment month, sex, race and evaluability flag, holding the row
+count and AGE sum/count/min/max. Triggers on ``clinical`` keep the rollup in step
+with any later INSERT, UPDATE or DELETE.
+
+``rewrite`` turns a matching aggregate query over ``clinical`` into the same
+query over ``clinical_rollup`` (a few thousand rows at most, whatever the table
+size), or returns ``None`` when the query cannot be answered from the rollup.
+Output column names are preserved; the order of rows that tie under ORDER BY
+may differ from the original query.
+"""
+
+import sqlite3
+
+from support.sql_policy import KEYWORDS, SQLParseError, Token, token_spans
+
+SOURCE_TABLE = "clinical"
+ROLLUP_TABLE = "clinical_rollup"
+
+# Rollup key columns: dimensions copied verbatim, and enrolment month in the two
+# spellings agents use (strftime('%Y-%m', ENRLDT) and substr(ENRLDT, 1, 7))
+DIMENSIONS = ("STUDYID", "SITEID", "SEX", "RACE", "EVALFLAG")
+MONTH_COLUMNS = {
+    "ENRLMONTH": "strftime('%Y-%m', {ref}ENRLDT)",
+    "ENRLPREFIX": "substr({ref}ENRLDT, 1, 7)",
+}
+MEASURES = ("row_count", "age_sum", "age_count", "age_min", "age_max")
+
+INDEXES = {
+    # covers every rollup dimension plus AGE: cell maintenance and dimension filters
+    "idx_clinical_cell": ("SITEID", "SEX", "RACE", "EVALFLAG", "STUDYID", "ENRLDT", "AGE"),
+    "idx_clinical_sex_age": ("SEX", "AGE"),
+    "idx_clinical_race_age": ("RACE", "AGE"),
+    "idx_clinical_evalflag_age": ("EVALFLAG", "AGE"),
+    "idx_clinical_enrldt_age": ("ENRLDT", "AGE"),
+}
+
+# (aggregate, argument) -> expression over the rollup
+_AGGREGATE_REWRITES = {
+    ("COUNT", "*"): "COALESCE(SUM(row_count), 0)",
+    ("COUNT", "AGE"): "COALESCE(SUM(age_count), 0)",
+    ("SUM", "AGE"): "SUM(age_sum)",
+    ("TOTAL", "AGE"): "TOTAL(age_sum)",
+    ("AVG", "AGE"): "(SUM(age_sum) * 1.0 / SUM(age_count))",
+    ("MIN", "AGE"): "MIN(age_min)",
+    ("MAX", "AGE"): "MAX(age_max)",
+}
+# Scalar functions that give the same value per rollup cell as per clinical row. Any
+# other call (another aggregate such as GROUP_CONCAT, random(), ...) keeps the query
+# on clinical: over the rollup it would see one value per cell, not one per row.
+_CELL_FUNCTIONS = frozenset(
+    {
+        "ABS",
+        "COALESCE",
+        "IFNULL",
+        "IIF",
+        "INSTR",
+        "LENGTH",
+        "LOWER",
+        "LTRIM",
+        "NULLIF",
+        "PRINTF",
+        "REPLACE",
+        "ROUND",
+        "RTRIM",
+        "SUBSTR",
+        "SUBSTRING",
+        "TRIM",
+        "UPPER",
+    }
+)
+_UNSUPPORTED_WORDS = frozenset(
+    {"SELECT", "WITH", "UNION", "INTERSECT", "EXCEPT", "JOIN", "OVER", "WINDOW", "FILTER"}
+)
+_FROM_FOLLOWERS = frozenset({"WHERE", "GROUP", "HAVING", "ORDER", "LIMIT"})
+
+
+# ---------------------------------------------------------------------------
+# Build / maintenance
+# ---------------------------------------------------------------------------
+
+
+def _key_columns() -> list[str]:
+    return [*DIMENSIONS, *MONTH_COLUMNS]
+
+
+def _key_values(ref: str) -> list[str]:
+    """Expressions for the rollup key of row *ref* (``"NEW."``, ``"OLD."`` or ``""``)."""
+    return [f"{ref}{d}" for d in DIMENSIONS] + [e.format(ref=ref) for e in MONTH_COLUMNS.values()]
+
+
+def _cell(ref: str) -> str:
+    return " AND ".join(f"{c} IS {v}" for c, v in zip(_key_columns(), _key_values(ref)))
+
+
+def _add_row_sql(ref: str) -> str:
+    return f"""
+    INSERT INTO {ROLLUP_TABLE} ({", ".join(_key_columns())}, row_count, age_count)
+    SELECT {", ".join(_key_values(ref))}, 0, 0
+    WHERE NOT EXISTS (SELECT 1 FROM {ROLLUP_TABLE} WHERE {_cell(ref)});
+    UPDATE {ROLLUP_TABLE} SET
+        row_count = row_count + 1,
+        age_sum = CASE WHEN {ref}AGE IS NULL THEN age_sum ELSE COALESCE(age_sum, 0) + {ref}AGE END,
+        age_count = age_count + ({ref}AGE IS NOT NULL),
+        age_min = CASE WHEN age_min IS NULL OR {ref}AGE < age_min THEN {ref}AGE ELSE age_min END,
+        age_max = CASE WHEN age_max IS NULL OR {ref}AGE > age_max THEN {ref}AGE ELSE age_max END
+    WHERE {_cell(ref)};"""
+
+
+def _remove_row_sql(ref: str) -> str:
+    # counts and sums step down; min/max are recomputed only when the removed AGE was one
+    source_cell = " AND ".join(
+        f"{bare} IS {old}" for bare, old in zip(_key_values(""), _key_values(ref))
+    )
+    return f"""
+    UPDATE {ROLLUP_TABLE} SET
+        row_count = row_count - 1,
+        age_sum = CASE WHEN {ref}AGE IS NULL THEN age_sum ELSE age_sum - {ref}AGE END,
+        age_count = age_count - ({ref}AGE IS NOT NULL)
+    WHERE {_cell(ref)};
+    UPDATE {ROLLUP_TABLE} SET
+        (age_min, age_max) = (SELECT MIN(AGE), MAX(AGE) FROM {SOURCE_TABLE} WHERE {source_cell}),
+        age_sum = CASE WHEN age_count = 0 THEN NULL ELSE age_sum END
+    WHERE {_cell(ref)} AND ({ref}AGE = age_min OR {ref}AGE = age_max OR age_count = 0);
+    DELETE FROM {ROLLUP_TABLE} WHERE row_count = 0 AND {_cell(ref)};"""
+
+
+def build_rollups(conn: sqlite3.Connection) -> int:
+    """(Re)create the index set, ``clinical_rollup`` and its maintenance triggers.
+
+    Returns the number of rollup rows. Runs in one transaction.
+    """
+    keys = _key_columns()
+    # Explicit: the sqlite3 module does not open transactions for DDL
+    conn.execute("BEGIN;")
+    try:
+        for name, columns in INDEXES.items():
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON {SOURCE_TABLE} ({', '.join(columns)});"
+            )
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {ROLLUP_TABLE}_{event};")
+        conn.execute(f"DROP TABLE IF EXISTS {ROLLUP_TABLE};")
+        # Untyped key columns keep values exactly as stored in clinical (no affinity)
+        conn.execute(f"""
+        CREATE TABLE {ROLLUP_TABLE} (
+            {", ".join(keys)},
+            row_count INTEGER NOT NULL,
+            age_sum INTEGER,
+            age_count INTEGER NOT NULL,
+            age_min INTEGER,
+            age_max INTEGER
+        )""")
+        conn.execute(
+            f"INSERT INTO {ROLLUP_TABLE} "
+            f"SELECT {', '.join(_key_values(''))}, "
+            f"COUNT(*), SUM(AGE), COUNT(AGE), MIN(AGE), MAX(AGE) "
+            f"FROM {SOURCE_TABLE} GROUP BY {', '.join(str(i + 1) for i in range(len(keys)))};"
+        )
+        conn.execute(f"CREATE INDEX idx_{ROLLUP_TABLE}_cell ON {ROLLUP_TABLE} ({', '.join(keys)});")
+        conn.execute(f"""
+        CREATE TRIGGER {ROLLUP_TABLE}_insert AFTER INSERT ON {SOURCE_TABLE} BEGIN
+            {_add_row_sql("NEW.")}
+        END;""")
+        conn.execute(f"""
+        CREATE TRIGGER {ROLLUP_TABLE}_delete AFTER DELETE ON {SOURCE_TABLE} BEGIN
+            {_remove_row_sql("OLD.")}
+        END;""")
+        conn.execute(f"""
+        CREATE TRIGGER {ROLLUP_TABLE}_update AFTER UPDATE ON {SOURCE_TABLE} BEGIN
+            {_remove_row_sql("OLD.")}
+            {_add_row_sql("NEW.")}
+        END;""")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+    (rows,) = conn.execute(f"SELECT COUNT(*) FROM {ROLLUP_TABLE};").fetchone()
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Query rewrite
+# ---------------------------------------------------------------------------
+
+
+def _name(tok: Token) -> str:
+    if tok.kind == "quoted":
+        return tok.value[1:-1].replace('""', '"').upper()
+    return tok.upper
+
+
+def _closing(spans: list, i: int) -> int:
+    """Index of the ")" matching the "(" at *i*."""
+    depth = 0
+    for j in range(i, len(spans)):
+        value = spans[j][0].value if spans[j][0].kind == "op" else None
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise SQLParseError("Unbalanced '('")
+
+
+def _column_ref(toks: list[Token], qualifiers: set[str]) -> tuple[str, str] | None:
+    """``(qualifier_text, COLUMN)`` if *toks* is ``col`` or ``qualifier.col``."""
+    if len(toks) == 1 and toks[0].kind in ("word", "quoted"):
+        return "", _name(toks[0])
+    if (
+        len(toks) == 3
+        and toks[1].kind == "op"
+        and toks[1].value == "."
+        and _name(toks[0]) in qualifiers
+        and toks[2].kind in ("word", "quoted")
+    ):
+        return toks[0].value + ".", _name(toks[2])
+    return None
+
+
+def _month_column(func: str, args: list[Token], qualifiers: set[str]) -> str | None:
+    parts: list[list[Token]] = [[]]
+    for tok in args:
+        if tok.kind == "op" and tok.value == ",":
+            parts.append([])
+        else:
+            parts[-1].append(tok)
+    if func == "STRFTIME" and len(parts) == 2:
+        fmt, col = parts
+        if len(fmt) == 1 and fmt[0].value == "'%Y-%m'":
+            ref = _column_ref(col, qualifiers)
+            if ref and ref[1] == "ENRLDT":
+                return f"{ref[0]}ENRLMONTH"
+    if func in ("SUBSTR", "SUBSTRING") and len(parts) == 3:
+        col, start, length = parts
+        ref = _column_ref(col, qualifiers)
+        if ref and ref[1] == "ENRLDT" and [t.value for t in start + length] == ["1", "7"]:
+            return f"{ref[0]}ENRLPREFIX"
+    return None
+
+
+def rewrite(sql: str) -> str | None:
+    """Return *sql* rewritten against ``clinical_rollup``, or ``None`` if it does not match.
+
+    Matches a single SELECT over ``clinical`` (no joins, subqueries or window
+    functions) with at least one aggregate, where every column outside an
+    aggregate is a rollup dimension or the enrolment month, and every aggregate
+    is COUNT(*), COUNT/MIN/MAX(<dimension>), COUNT(DISTINCT <dimension>) or
+    COUNT/SUM/TOTAL/AVG/MIN/MAX(AGE). Other functions must be simple scalar ones
+    (``_CELL_FUNCTIONS``).
+    """
+    try:
+        return _rewrite(sql)
+    except SQLParseError:
+        return None
+
+
+def _rewrite(sql: str) -> str | None:
+    spans = token_spans(sql)
+    while spans and spans[-1][0].kind == "op" and spans[-1][0].value == ";":
+        spans.pop()
+    toks = [t for t, _, _ in spans]
+    if not toks or toks[0].upper != "SELECT":
+        return None
+    if any(t.kind == "op" and t.value == ";" for t in toks):
+        return None
+
+    # FROM clinical [[AS] alias] must be the only source
+    depth, from_at = 0, None
+    for i, tok in enumerate(toks):
+        if tok.kind == "op" and tok.value in "()":
+            depth += 1 if tok.value == "(" else -1
+        elif depth == 0 and tok.kind == "word" and tok.upper == "FROM":
+            from_at = i
+            break
+    if from_at is None or from_at + 1 >= len(toks) or _name(toks[from_at + 1]) != "CLINICAL":
+        return None
+    end = from_at + 2
+    alias = None
+    if end < len(toks) and toks[end].upper == "AS":
+        end += 1
+    if (
+        end < len(toks)
+        and toks[end].kind in ("word", "quoted")
+        and toks[end].upper not in _FROM_FOLLOWERS
+    ):
+        alias = _name(toks[end])
+        end += 1
+    if end < len(toks) and not (toks[end].kind == "word" and toks[end].upper in _FROM_FOLLOWERS):
+        return None
+    qualifiers = {SOURCE_TABLE.upper()} | ({alias} if alias else set())
+
+    # Select items (for output names) and their aliases
+    first = 2 if len(toks) > 1 and toks[1].upper in ("DISTINCT", "ALL") else 1
+    items: list[tuple[int, int]] = []  # token index ranges [start, stop)
+    depth, start = 0, first
+    for i in range(first, from_at):
+        tok = toks[i]
+        if tok.kind == "op" and tok.value in "()":
+            depth += 1 if tok.value == "(" else -1
+        elif depth == 0 and tok.kind == "op" and tok.value == ",":
+            items.append((start, i))
+            start = i + 1
+    items.append((start, from_at))
+    aliases: set[str] = set()
+    unaliased: list[tuple[int, int]] = []
+    for a, b in items:
+        if b - a >= 3 and toks[b - 2].upper == "AS":
+            aliases.add(_name(toks[b - 1]))
+        elif (
+            b - a >= 2
+            and toks[b - 1].kind in ("word", "quoted")
+            and not (toks[b - 1].kind == "word" and toks[b - 1].upper in KEYWORDS)
+            and (toks[b - 2].kind != "op" or toks[b - 2].value == ")")
+        ):  # bare alias, as in "strftime('%Y-%m', ENRLDT) month"
+            aliases.add(_name(toks[b - 1]))
+        else:
+            unaliased.append((a, b))
+    if aliases & {c.upper() for c in (*MEASURES, *MONTH_COLUMNS)}:
+        return None  # would be shadowed by rollup columns in WHERE/HAVING
+
+    # Walk every token outside the FROM clause, collecting replacements
+    edits: list[tuple[int, int, str]] = []  # (first token, last token, replacement)
+    aggregates = 0
+    i = 0
+    while i < len(toks):
+        if from_at <= i < end:
+            i = end
+            continue
+        tok = toks[i]
+        nxt = toks[i + 1] if i + 1 < len(toks) else None
+        if tok.kind == "word" and tok.upper in _UNSUPPORTED_WORDS and i > 0:
+            return None
+        if tok.kind == "op" and tok.value == "*":
+            # a bare * is either multiplication (fine) or SELECT * (not rewritable)
+            prev = toks[i - 1]
+            if prev.upper in ("SELECT", "DISTINCT", "ALL") or (
+                prev.kind == "op" and prev.value in (",", ".")
+            ):
+                return None
+        if tok.kind == "word" and nxt is not None and nxt.kind == "op" and nxt.value == "(":
+            close = _closing(spans, i + 1)
+            args = toks[i + 2 : close]
+            func = tok.upper
+            if func in ("COUNT", "SUM", "TOTAL", "AVG", "MIN", "MAX"):
+                if func == "COUNT" and len(args) == 1 and args[0].value == "*":
+                    edits.append((i, close, _AGGREGATE_REWRITES[("COUNT", "*")]))
+                elif func == "COUNT" and args and args[0].upper == "DISTINCT":
+                    ref = _column_ref(args[1:], qualifiers)
+                    if ref is None or ref[1] not in DIMENSIONS:
+                        return None
+                elif (ref := _column_ref(args, qualifiers)) and ref[1] in DIMENSIONS:
+                    # MIN/MAX of a dimension are the same over cells; COUNT skips NULLs
+                    if func == "COUNT":
+                        edits.append(
+                            (
+                                i,
+                                close,
+                                f"COALESCE(SUM(CASE WHEN {ref[0]}{ref[1]} IS NOT NULL "
+                                f"THEN row_count END), 0)",
+                            )
+                        )
+                    elif func not in ("MIN", "MAX"):
+                        return None
+                else:
+                    if ref is None or (func, ref[1]) not in _AGGREGATE_REWRITES:
+                        return None
+                    edits.append((i, close, _AGGREGATE_REWRITES[(func, ref[1])]))
+                aggregates += 1
+                i = close + 1
+                continue
+            month = _month_column(func, args, qualifiers)
+            if month is not None:
+                edits.append((i, close, month))
+                i = close + 1
+                continue
+            if func not in _CELL_FUNCTIONS and func not in KEYWORDS:
+                return None
+            i += 1  # scalar function or "IN (", "CAST (": arguments are checked as we go
+            continue
+        if tok.kind in ("word", "quoted"):
+            name = _name(tok)
+            is_qualifier = nxt is not None and nxt.kind == "op" and nxt.value == "."
+            if is_qualifier:
+                if name not in qualifiers:
+                    return None
+            elif tok.kind == "word" and tok.upper in KEYWORDS:
+                pass
+            elif name not in DIMENSIONS and name not in aliases:
+                return None
+        i += 1
+    if not aggregates:
+        return None
+
+    # Replace the source table, keeping "clinical." qualifiers valid
+    source = ROLLUP_TABLE if alias else f"{ROLLUP_TABLE} AS {SOURCE_TABLE}"
+    edits.append((from_at + 1, from_at + 1, source))
+
+    # Keep SQLite's column names for unaliased items whose text changes
+    changes = [(spans[a][1], spans[b][2], text) for a, b, text in edits]
+    for a, b in unaliased:
+        if any(a <= e[0] < b for e in edits):
+            original = sql[spans[a][1] : spans[b - 1][2]]
+            at = spans[b - 1][2]
+            changes.append((at, at, ' AS "' + original.replace('"', '""') + '"'))
+
+    out, pos = [], 0
+    for start, stop, text in sorted(changes):
+        out.append(sql[pos:start])
+        out.append(text)
+        pos = stop
+    out.append(sql[pos : spans[-1][2]])
+    return "".join(out)
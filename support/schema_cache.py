@@ -0,0 +1,128 @@
+"""
+Cached schema introspection for ``list_schema``.
+
+The snapshot (columns and types, row counts, indexes and per-column cardinality
+estimates) is gathered once and served from memory until the database version
+changes: ``version_probe`` should return a token that includes
+``PRAGMA schema_version`` (and the data version, since row counts depend on it).
+
+Cardinalities are estimated from a sample of ``sample_rows`` rows, so building a
+snapshot stays cheap on large tables.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Collection, Hashable
+
+import aiosqlite
+
+from support.db_pool import ConnectionPool
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def estimate_cardinality(distinct: int, sampled: int, total: int) -> int:
+    """Scale the number of distinct values in a sample up to the whole table."""
+    if sampled >= total or distinct * 10 <= sampled:
+        # whole table seen, or a low-cardinality column (values repeat within the sample)
+        return distinct
+    return min(total, round(distinct * total / sampled))
+
+
+async def introspect(
+    db: aiosqlite.Connection, exclude: Collection[str] = (), sample_rows: int = 10_000
+) -> dict:
+    """Describe every user table: columns, row count, indexes and cardinality estimates."""
+    cur = await db.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY name;"
+    )
+    excluded = {name.lower() for name in exclude}
+    tables = [row[0] for row in await cur.fetchall() if row[0].lower() not in excluded]
+
+    schema: dict[str, dict] = {}
+    for table in tables:
+        qt = _quote(table)
+        cur = await db.execute(f"PRAGMA table_info({qt});")
+        # SQLite PRAGMA table_info columns: cid, name, type, notnull, dflt_value, pk
+        columns = {row[1]: row[2] for row in await cur.fetchall()}
+
+        cur = await db.execute(f"SELECT COUNT(*) FROM {qt};")
+        (row_count,) = await cur.fetchone()
+
+        indexes = []
+        cur = await db.execute(f"PRAGMA index_list({qt});")
+        # PRAGMA index_list columns: seq, name, unique, origin, partial
+        for row in await cur.fetchall():
+            info = await db.execute(f"PRAGMA index_info({_quote(row[1])});")
+            indexes.append(
+                {
+                    "name": row[1],
+                    "columns": [c[2] for c in await info.fetchall()],
+                    "unique": bool(row[2]),
+                }
+            )
+
+        cardinality: dict[str, int] = {}
+        if columns and row_count:
+            distinct = ", ".join(f"COUNT(DISTINCT {_quote(c)})" for c in columns)
+            cur = await db.execute(
+                f"SELECT COUNT(*), {distinct} FROM (SELECT * FROM {qt} LIMIT ?);",
+                (sample_rows,),
+            )
+            sampled, *counts = await cur.fetchone()
+            cardinality = {
+                name: estimate_cardinality(count, sampled, row_count)
+                for name, count in zip(columns, counts)
+            }
+
+        schema[table] = {
+            "columns": columns,
+            "row_count": row_count,
+            "indexes": indexes,
+            "cardinality": cardinality,
+        }
+    return schema
+
+
+class SchemaCache:
+    """Holds the latest ``introspect()`` snapshot and rebuilds it when the version changes."""
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        version_probe: Callable[[], Awaitable[Hashable | None]],
+        exclude: Collection[str] = (),
+        sample_rows: int = 10_000,
+    ):
+        self.pool = pool
+        self.version_probe = version_probe
+        self.exclude = exclude
+        self.sample_rows = sample_rows
+        self._snapshot: dict | None = None
+        self._version: Hashable | None = None
+        self._lock = asyncio.Lock()
+        self.counters = {"hits": 0, "builds": 0, "build_seconds_total": 0.0}
+
+    async def get(self) -> tuple[dict, bool]:
+        """Return ``(schema, cached)``; concurrent callers share one rebuild."""
+        version = await self.version_probe()
+        if self._snapshot is not None and version is not None and version == self._version:
+            self.counters["hits"] += 1
+            return self._snapshot, True
+        async with self._lock:
+            if self._snapshot is not None and version is not None and version == self._version:
+                self.counters["hits"] += 1
+                return self._snapshot, True
+            started = time.perf_counter()
+            async with self.pool.acquire() as db:
+                snapshot = await introspect(db, self.exclude, self.sample_rows)
+            self.counters["builds"] += 1
+            self.counters["build_seconds_total"] += time.perf_counter() - started
+            self._snapshot, self._version = snapshot, version
+            return snapshot, False
+
+    def stats(self) -> dict:
+        return {**self.counters, "tables": len(self._snapshot or {})}
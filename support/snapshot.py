@@ -0,0 +1,153 @@
+"""
+In-memory read snapshot of the clinical database.
+
+``Snapshot.load()`` copies the database file into an in-memory database (the
+``memdb`` VFS, under a name every connection in the process can open) with
+SQLite's backup API, or with ``VACUUM INTO`` if the file is in WAL mode, then
+points the given connection pools at it. Reads no longer touch the file, so
+their latency does not depend on the OS page cache or on a generator rewriting
+``clinical.db``. The pools open the copy read-only (``mode=ro`` and the
+authorizer in support/db_pool.py): every reader in the process shares it, so
+no query may change it.
+
+The copy runs in a worker thread. ``refresh()`` starts a new one in the
+background when the caller sees a new data version. Once a copy is complete,
+the pools are switched to it in one step: queries already running finish on
+the old copy, which is freed when its last connection closes.
+
+A ``memdb`` database holds at most ``MEMDB_MAX_BYTES`` (SQLite's default, not
+configurable from Python). A larger database is not copied. When a copy fails,
+reads go back to the file until the next change. ``stats()`` reports the
+snapshot's size and load times.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+from support.db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+MEMDB_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def _size(conn: sqlite3.Connection) -> int:
+    (page_count,) = conn.execute("PRAGMA page_count;").fetchone()
+    (page_size,) = conn.execute("PRAGMA page_size;").fetchone()
+    return page_count * page_size
+
+
+class Snapshot:
+    """Serves *pools* from an in-memory copy of the database at *path*."""
+
+    def __init__(self, path: str, pools: tuple[ConnectionPool, ...], name: str = "snapshot"):
+        self.path = path
+        self.pools = pools
+        self.name = name
+        self.uri: str | None = None  # the copy being served, None until one is loaded
+        self.version = None  # data version the copy was taken at (as given to load())
+        self._requested = None
+        self._holder: sqlite3.Connection | None = None  # keeps the memdb alive
+        self._loading: asyncio.Task | None = None
+        self._generation = 0
+        self.loaded_at: datetime.datetime | None = None
+        self.last_error: str | None = None
+        self.counters = {
+            "bytes": 0,
+            "loads": 0,
+            "failures": 0,
+            "load_seconds_last": 0.0,
+            "load_seconds_total": 0.0,
+        }
+
+    def _copy(self, uri: str) -> tuple[sqlite3.Connection, int]:
+        source_uri = f"{Path(self.path).absolute().as_uri()}?mode=ro"
+        with contextlib.closing(sqlite3.connect(source_uri, uri=True)) as source:
+            size = _size(source)
+            if size > MEMDB_MAX_BYTES:
+                raise sqlite3.DataError(
+                    f"{self.path} is {size / 2**20:,.0f} MiB; an in-memory snapshot "
+                    f"holds at most {MEMDB_MAX_BYTES / 2**20:,.0f} MiB"
+                )
+            (journal_mode,) = source.execute("PRAGMA journal_mode;").fetchone()
+            target = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            try:
+                if journal_mode.lower() == "wal":
+                    # A page-for-page copy would still be marked WAL, which memdb cannot
+                    # open; VACUUM INTO writes a rollback-journal copy (about 4x slower)
+                    source.execute("VACUUM INTO ?;", (uri,))
+                else:
+                    source.backup(target)
+            except BaseException:
+                target.close()
+                raise
+        return target, size
+
+    async def load(self, version) -> bool:
+        """Copy the database and serve reads from the copy; ``False`` if the copy failed.
+
+        *version* is the caller's data-version token read before the copy started.
+        """
+        self._requested = version
+        self._generation += 1
+        uri = f"file:/{self.name}-{self._generation}?vfs=memdb"
+        started = time.perf_counter()
+        try:
+            holder, size = await asyncio.to_thread(self._copy, uri)
+        except sqlite3.Error as e:
+            self.counters["failures"] += 1
+            self.last_error = str(e)
+            logger.warning("Snapshot of %s not loaded (%s); reading the file", self.path, e)
+            # An older copy would be out of date by now
+            await self._switch(None, None, self.path, None)
+            return False
+        seconds = time.perf_counter() - started
+
+        await self._switch(holder, uri, uri, version)
+
+        self.loaded_at = datetime.datetime.now()
+        self.last_error = None
+        c = self.counters
+        c["bytes"] = size
+        c["loads"] += 1
+        c["load_seconds_last"] = seconds
+        c["load_seconds_total"] += seconds
+        return True
+
+    async def _switch(self, holder, uri: str | None, target: str, version) -> None:
+        old, self._holder = self._holder, holder
+        self.uri, self.version = uri, version
+        if old is not None or uri is not None:
+            for pool in self.pools:
+                await pool.retarget(target)
+        if old is not None:
+            old.close()  # the old copy goes once the connections still reading it close
+
+    def refresh(self, version) -> None:
+        """Load *version* in the background, unless it is already loaded or being tried."""
+        if version == self._requested or (self._loading and not self._loading.done()):
+            return
+        self._loading = asyncio.create_task(self.load(version), name="snapshot-reload")
+
+    def stats(self) -> dict:
+        c = self.counters
+        return {
+            "serving": "memory" if self.uri else "file",
+            **c,
+            "load_seconds_avg": c["load_seconds_total"] / c["loads"] if c["loads"] else 0.0,
+            "reloading": bool(self._loading and not self._loading.done()),
+            "loaded_at": self.loaded_at.isoformat(timespec="seconds") if self.loaded_at else None,
+            "last_error": self.last_error,
+        }
+
+    def close(self) -> None:
+        if self._loading is not None:
+            self._loading.cancel()
+        if self._holder is not None:
+            self._holder.close()
+            self._holder = None
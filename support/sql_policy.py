@@ -0,0 +1,702 @@
+"""
+Deterministic, local enforcement of the machine-checkable rules in study_protocol.md.
+
+The checker tokenises a query, builds a small syntax tree of the statement and
+returns one of three verdicts:
+
+* ``deny``     - the query clearly violates the protocol (non-SELECT statement,
+                 multiple statements, USUBJID projected, datasets combined).
+* ``allow``    - the query is a single-dataset aggregate that cannot expose
+                 subject identifiers.
+* ``escalate`` - anything else; the LLM policy gate makes the call. Plain
+                 row queries on one dataset are marked ``row_level``: only the
+                 minimum-subjects rule is open, and it can be checked on the result.
+
+Everything here is pure Python and runs in microseconds, so it sits in front of
+the (slow, expensive) LLM check in ``clinical_mcp.py``.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Collection, Iterator, NamedTuple
+
+ALLOW = "allow"
+DENY = "deny"
+ESCALATE = "escalate"
+
+# Column that must never be returned (protocol §4)
+SUBJECT_ID = "USUBJID"
+
+# Aggregates per protocol §3. MIN/MAX with more than one argument are scalar in SQLite.
+AGGREGATES = frozenset(
+    {
+        "AVG",
+        "COUNT",
+        "GROUP_CONCAT",
+        "JSON_GROUP_ARRAY",
+        "JSON_GROUP_OBJECT",
+        "MAX",
+        "MIN",
+        "STRING_AGG",
+        "SUM",
+        "TOTAL",
+    }
+)
+# Aggregates that return member values verbatim, and so leak whatever they wrap
+VALUE_AGGREGATES = frozenset(
+    {"GROUP_CONCAT", "JSON_GROUP_ARRAY", "JSON_GROUP_OBJECT", "MAX", "MIN", "STRING_AGG"}
+)
+
+KEYWORDS = frozenset(
+    """
+    ALL AND AS ASC BETWEEN BY CASE CAST COLLATE CROSS CURRENT_DATE CURRENT_TIME
+    CURRENT_TIMESTAMP DESC DISTINCT ELSE END ESCAPE EXCEPT EXISTS FALSE FILTER FROM
+    FULL GLOB GROUP HAVING IN INNER INTERSECT IS ISNULL JOIN LEFT LIKE LIMIT MATCH
+    NATURAL NOCASE NOT NOTNULL NULL OFFSET ON OR ORDER OUTER OVER PARTITION REGEXP
+    RIGHT SELECT THEN TRUE UNION USING VALUES WHEN WHERE WINDOW WITH
+    BLOB INTEGER NUMERIC REAL TEXT
+    """.split()
+)
+
+_CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "WINDOW", "ORDER", "LIMIT")
+_COMPOUND = frozenset({"UNION", "INTERSECT", "EXCEPT"})
+_JOIN_WORDS = frozenset({"JOIN", "LEFT", "RIGHT", "FULL", "INNER", "OUTER", "CROSS", "NATURAL"})
+
+
+class PolicyDecision(NamedTuple):
+    verdict: str
+    reason: str
+    # Escalated only because the query returns subject-level rows from one dataset, so
+    # the minimum-subjects rule is all that is left to decide (support/k_anonymity.py)
+    row_level: bool = False
+    # The query parsed as one SELECT statement, whatever the verdict
+    single_select: bool = False
+
+
+class SQLParseError(ValueError):
+    """Raised when a query cannot be tokenised or structured."""
+
+
+class NonSelectStatement(Exception):
+    """Raised when the statement is not a SELECT; carries the leading keyword."""
+
+    def __init__(self, keyword: str):
+        super().__init__(keyword)
+        self.keyword = keyword
+
+
+# ---------------------------------------------------------------------------
+# Tokeniser
+# ---------------------------------------------------------------------------
+
+
+class Token(NamedTuple):
+    kind: str  # word | quoted | string | number | blob | param | op
+    value: str
+
+    @property
+    def upper(self) -> str:
+        return self.value.upper()
+
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<blob>[xX]'[0-9a-fA-F]*')
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<param>\?\d*|[:@$][A-Za-z_]\w*)
+    | (?P<word>[A-Za-z_][\w$]*)
+    | (?P<op>\|\||->>|->|<<|>>|<=|>=|==|!=|<>|[(),;.*+\-/%<>=&|~])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def token_spans(sql: str) -> list[tuple[Token, int, int]]:
+    """Like ``tokenize`` but with each token's ``(start, end)`` offsets in *sql*."""
+    spans = []
+    pos, end = 0, len(sql)
+    while pos < end:
+        m = _TOKEN_RE.match(sql, pos)
+        if m is None:
+            raise SQLParseError(f"Unexpected character {sql[pos]!r} at offset {pos}")
+        kind = m.lastgroup
+        if kind not in ("ws", "comment"):
+            spans.append((Token(kind, m.group()), pos, m.end()))
+        pos = m.end()
+    return spans
+
+
+def tokenize(sql: str) -> list[Token]:
+    """Split *sql* into tokens, dropping whitespace and comments."""
+    return [tok for tok, _, _ in token_spans(sql)]
+
+
+def fingerprint(sql: str) -> str:
+    """Return a normalised form of *sql* for cache keys.
+
+    Whitespace and comments are collapsed, keywords/identifiers are upper-cased
+    and every literal becomes ``?`` so queries differing only in values match.
+    """
+    out = []
+    for tok in tokenize(sql):
+        if tok.kind in ("string", "number", "blob", "param"):
+            out.append("?")
+        elif tok.kind == "op" and tok.value == ";":
+            continue
+        else:
+            out.append(tok.upper)
+    return " ".join(out)
+
+
+def canonical(sql: str) -> str:
+    """Like ``fingerprint`` but keeps literal values, so equal keys mean equal results."""
+    return " ".join(
+        tok.value if tok.kind in ("string", "quoted", "blob") else tok.upper
+        for tok in tokenize(sql)
+        if not (tok.kind == "op" and tok.value == ";")
+    )
+
+
+# ---------------------------------------------------------------------------
+# Syntax tree
+# ---------------------------------------------------------------------------
+
+
+class Group(list):
+    """Tokens between a matching pair of parentheses."""
+
+
+@dataclass
+class Column:
+    name: str
+    qualifier: str | None = None
+
+
+@dataclass
+class Star:
+    qualifier: str | None = None
+
+
+@dataclass
+class Func:
+    name: str
+    args: list[list] = field(default_factory=list)
+    star: bool = False
+
+
+@dataclass
+class Paren:
+    nodes: list
+
+
+@dataclass
+class Subquery:
+    select: "Select"
+
+
+@dataclass
+class SelectItem:
+    nodes: list
+    alias: str | None
+    text: str
+
+
+@dataclass
+class Source:
+    table: str | None = None
+    alias: str | None = None
+    subquery: "Select | None" = None
+    is_function: bool = False
+
+
+@dataclass
+class Core:
+    distinct: bool = False
+    items: list[SelectItem] = field(default_factory=list)
+    sources: list[Source] = field(default_factory=list)
+    where: list = field(default_factory=list)
+    group_by: list[list] = field(default_factory=list)
+    group_text: list[str] = field(default_factory=list)
+    having: list = field(default_factory=list)
+    window: list = field(default_factory=list)
+    order_by: list = field(default_factory=list)
+    limit: list = field(default_factory=list)  # LIMIT and OFFSET expressions
+    windowed: bool = False
+
+
+@dataclass
+class Select:
+    cores: list[Core]
+    ctes: dict[str, "Select"] = field(default_factory=dict)
+
+
+def _nest(tokens: list[Token]) -> list:
+    """Fold parenthesised runs of *tokens* into nested ``Group`` lists."""
+    stack: list[list] = [[]]
+    for tok in tokens:
+        if tok.kind == "op" and tok.value == "(":
+            group = Group()
+            stack[-1].append(group)
+            stack.append(group)
+        elif tok.kind == "op" and tok.value == ")":
+            if len(stack) == 1:
+                raise SQLParseError("Unbalanced ')'")
+            stack.pop()
+        else:
+            stack[-1].append(tok)
+    if len(stack) != 1:
+        raise SQLParseError("Unbalanced '('")
+    return stack[0]
+
+
+def _is_word(item, *values: str) -> bool:
+    return isinstance(item, Token) and item.kind == "word" and (not values or item.upper in values)
+
+
+def _is_op(item, value: str) -> bool:
+    return isinstance(item, Token) and item.kind == "op" and item.value == value
+
+
+def _is_select(items: list) -> bool:
+    return bool(items) and _is_word(items[0], "SELECT", "WITH", "VALUES")
+
+
+def _split(items: list, sep: str = ",") -> list[list]:
+    parts: list[list] = [[]]
+    for item in items:
+        if _is_op(item, sep):
+            parts.append([])
+        else:
+            parts[-1].append(item)
+    return parts
+
+
+def _ident(item) -> str:
+    if item.kind == "quoted":
+        return item.value[1:-1].replace('""', '"').upper()
+    return item.upper
+
+
+def _text(items: list) -> str:
+    out = []
+    for item in items:
+        out.append(f"({_text(item)})" if isinstance(item, Group) else item.upper)
+    return " ".join(out)
+
+
+def _expr(items: list) -> list:
+    """Turn a flat run of tokens/groups into expression nodes."""
+    nodes: list = []
+    i = 0
+    while i < len(items):
+        item = items[i]
+        nxt = items[i + 1] if i + 1 < len(items) else None
+        if isinstance(item, Group):
+            if _is_select(item):
+                nodes.append(Subquery(parse_select(list(item))))
+            else:
+                nodes.append(Paren(_expr(list(item))))
+        elif (
+            item.kind == "word"
+            and (item.upper not in KEYWORDS or item.upper == "CAST")
+            and isinstance(nxt, Group)
+            and not _is_select(nxt)
+        ):
+            args = [] if not nxt else _split(list(nxt))
+            if args and args[0] and _is_word(args[0][0], "DISTINCT", "ALL"):
+                args[0] = args[0][1:]
+            star = len(args) == 1 and len(args[0]) == 1 and _is_op(args[0][0], "*")
+            nodes.append(Func(item.upper, [] if star else [_expr(a) for a in args], star))
+            i += 1
+        elif item.kind in ("word", "quoted") and not (
+            item.kind == "word" and item.upper in KEYWORDS
+        ):
+            # qualified names: schema.table.column / table.column / table.*
+            parts = [_ident(item)]
+            while (
+                i + 2 < len(items)
+                and _is_op(items[i + 1], ".")
+                and isinstance(items[i + 2], Token)
+                and (items[i + 2].kind in ("word", "quoted") or _is_op(items[i + 2], "*"))
+            ):
+                parts.append(_ident(items[i + 2]) if items[i + 2].kind != "op" else "*")
+                i += 2
+            qualifier = parts[-2] if len(parts) > 1 else None
+            nodes.append(Star(qualifier) if parts[-1] == "*" else Column(parts[-1], qualifier))
+        else:
+            nodes.append(item)
+        i += 1
+    return nodes
+
+
+def _select_item(items: list) -> SelectItem:
+    alias = None
+    if len(items) >= 3 and _is_word(items[-2], "AS"):
+        alias, items = _ident(items[-1]), items[:-2]
+    elif (
+        len(items) >= 2
+        and isinstance(items[-1], Token)
+        and items[-1].kind in ("word", "quoted")
+        and not (items[-1].kind == "word" and items[-1].upper in KEYWORDS)
+        and not (isinstance(items[-2], Token) and items[-2].kind == "op")
+    ):
+        alias, items = _ident(items[-1]), items[:-1]
+    if len(items) == 1 and _is_op(items[0], "*"):
+        return SelectItem([Star()], alias, "*")
+    return SelectItem(_expr(items), alias, _text(items))
+
+
+def _sources(items: list) -> list[Source]:
+    """Parse a FROM clause into its table/subquery sources."""
+    sources = []
+    current: list = []
+    chunks: list[list] = []
+    skip_condition = False
+    for item in items:
+        if _is_op(item, ",") or _is_word(item, *_JOIN_WORDS):
+            skip_condition = False
+            if current:
+                chunks.append(current)
+            current = []
+        elif _is_word(item, "ON", "USING"):
+            skip_condition = True
+        elif not skip_condition:
+            current.append(item)
+    if current:
+        chunks.append(current)
+
+    for chunk in chunks:
+        head, rest = chunk[0], chunk[1:]
+        if isinstance(head, Group):
+            src = Source(subquery=parse_select(list(head))) if _is_select(head) else Source()
+        else:
+            name = [_ident(head)]
+            while len(rest) >= 2 and _is_op(rest[0], ".") and isinstance(rest[1], Token):
+                name.append(_ident(rest[1]))
+                rest = rest[2:]
+            src = Source(table=name[-1])
+            if rest and isinstance(rest[0], Group):
+                src.is_function = True
+                rest = rest[1:]
+        rest = [r for r in rest if not _is_word(r, "AS")]
+        if rest and isinstance(rest[0], Token) and rest[0].kind in ("word", "quoted"):
+            src.alias = _ident(rest[0])
+        sources.append(src)
+    return sources
+
+
+def _core(items: list) -> Core:
+    core = Core()
+    clauses: dict[str, list] = {}
+    current = None
+    for i, item in enumerate(items):
+        nxt = items[i + 1] if i + 1 < len(items) else None
+        if _is_word(item, *_CLAUSES) and (
+            item.upper not in ("GROUP", "ORDER") or _is_word(nxt, "BY")
+        ):
+            current = item.upper
+            clauses[current] = []
+        elif _is_word(item, "OVER"):
+            core.windowed = True
+            clauses.setdefault(current, []).append(item)
+        elif current is not None:
+            clauses[current].append(item)
+
+    select = clauses.get("SELECT", [])
+    if select and _is_word(select[0], "DISTINCT", "ALL"):
+        core.distinct = select[0].upper == "DISTINCT"
+        select = select[1:]
+    core.items = [_select_item(part) for part in _split(select) if part]
+    core.sources = _sources(clauses.get("FROM", []))
+    core.where = _expr(clauses.get("WHERE", []))
+    group = clauses.get("GROUP", [])[1:]  # drop BY
+    core.group_by = [_expr(part) for part in _split(group) if part]
+    core.group_text = [_text(part) for part in _split(group) if part]
+    core.having = _expr(clauses.get("HAVING", []))
+    core.window = _expr(clauses.get("WINDOW", []))
+    core.order_by = _expr(clauses.get("ORDER", [])[1:])
+    core.limit = _expr(clauses.get("LIMIT", []))
+    return core
+
+
+def parse_select(items: list) -> Select:
+    """Parse a nested token list holding a WITH/SELECT/VALUES statement."""
+    ctes: dict[str, Select] = {}
+    if _is_word(items[0], "WITH"):
+        i = 1
+        if i < len(items) and _is_word(items[i], "RECURSIVE"):
+            i += 1
+        while i < len(items):
+            name = _ident(items[i])
+            i += 1
+            if i < len(items) and isinstance(items[i], Group):  # column list
+                i += 1
+            while i < len(items) and _is_word(items[i], "AS", "NOT", "MATERIALIZED"):
+                i += 1
+            if i >= len(items) or not isinstance(items[i], Group):
+                raise SQLParseError("Malformed WITH clause")
+            ctes[name] = parse_select(list(items[i]))
+            i += 1
+            if i < len(items) and _is_op(items[i], ","):
+                i += 1
+                continue
+            break
+        items = items[i:]
+        if not (items and _is_word(items[0], "SELECT", "VALUES")):
+            raise NonSelectStatement(_text(items[:1]) or "WITH")
+
+    cores: list[list] = [[]]
+    for item in items:
+        if _is_word(item, *_COMPOUND):
+            cores.append([])
+        elif not (_is_word(item, "ALL") and not cores[-1]):
+            cores[-1].append(item)
+    return Select([_core(c) for c in cores if c], ctes)
+
+
+# ---------------------------------------------------------------------------
+# Tree walkers
+# ---------------------------------------------------------------------------
+
+
+def _is_aggregate(func: Func) -> bool:
+    if func.name in ("MIN", "MAX"):
+        return len(func.args) == 1
+    return func.name in AGGREGATES
+
+
+def _walk(nodes: list, funcs: tuple = ()) -> Iterator[tuple[object, tuple]]:
+    """Yield ``(node, enclosing function names)`` for every node, depth first.
+
+    Aggregate calls are reported by name; scalar calls (including multi-argument
+    MIN/MAX) are reported as ``"name()"`` so callers can tell the two apart.
+    """
+    for node in nodes:
+        yield node, funcs
+        if isinstance(node, Func):
+            name = node.name if _is_aggregate(node) else f"{node.name}()"
+            for arg in node.args:
+                yield from _walk(arg, funcs + (name,))
+        elif isinstance(node, Paren):
+            yield from _walk(node.nodes, funcs)
+
+
+def _subqueries(select: Select) -> Iterator[Select]:
+    """Yield every SELECT nested anywhere inside *select* (not including itself)."""
+    for cte in select.ctes.values():
+        yield cte
+        yield from _subqueries(cte)
+    for core in select.cores:
+        exprs = [item.nodes for item in core.items]
+        exprs += [core.where, core.having, core.window, core.order_by, core.limit, *core.group_by]
+        for nodes in exprs:
+            for node, _ in _walk(nodes):
+                if isinstance(node, Subquery):
+                    yield node.select
+                    yield from _subqueries(node.select)
+        for src in core.sources:
+            if src.subquery is not None:
+                yield src.subquery
+                yield from _subqueries(src.subquery)
+
+
+def _base_tables(select: Select) -> set[str]:
+    ctes = set(select.ctes)
+    tables = set()
+    for sel in (select, *_subqueries(select)):
+        ctes |= set(sel.ctes)
+        for core in sel.cores:
+            tables |= {s.table for s in core.sources if s.table and not s.is_function}
+    return tables - ctes
+
+
+def _unwrap(nodes: list) -> list:
+    while len(nodes) == 1 and isinstance(nodes[0], Paren):
+        nodes = nodes[0].nodes
+    return nodes
+
+
+def _is_subject_id(nodes: list) -> bool:
+    nodes = _unwrap(nodes)
+    return len(nodes) == 1 and isinstance(nodes[0], Column) and nodes[0].name == SUBJECT_ID
+
+
+def _projects_subject_id(select: Select, subject_tables: Collection[str]) -> str | None:
+    """Return ``DENY``/``ESCALATE`` if *select*'s result columns may expose USUBJID.
+
+    Only ``COUNT(...)`` is treated as hiding the identifier; value-returning
+    aggregates (``MIN``, ``GROUP_CONCAT`` ...) hand it back verbatim.
+    """
+    worst = None
+    for core in select.cores:
+        tables = {s.alias or s.table: s.table for s in core.sources if s.table}
+        derived = any(s.table is None for s in core.sources)
+        for item in core.items:
+            nodes = _unwrap(item.nodes)
+            if _is_subject_id(nodes):
+                return DENY
+            if (
+                len(nodes) == 1
+                and isinstance(nodes[0], Func)
+                and nodes[0].name in VALUE_AGGREGATES
+                and any(_is_subject_id(arg) for arg in nodes[0].args)
+            ):
+                return DENY
+            if any(_is_op(n, "||") for n in nodes) and any(
+                isinstance(n, Column) and n.name == SUBJECT_ID for n in nodes
+            ):
+                return DENY
+            for node, funcs in _walk(nodes):
+                if "COUNT" in funcs:
+                    continue
+                if isinstance(node, Star) and not funcs:
+                    base = [tables.get(node.qualifier)] if node.qualifier else tables.values()
+                    if not derived and any(t in subject_tables for t in base):
+                        return DENY
+                    worst = ESCALATE
+                elif isinstance(node, Column) and node.name == SUBJECT_ID:
+                    worst = ESCALATE
+                elif isinstance(node, Subquery):
+                    verdict = _projects_subject_id(node.select, subject_tables)
+                    if verdict == DENY and not funcs:
+                        return DENY
+                    worst = worst or (verdict and ESCALATE)
+        # Derived tables/CTEs that project USUBJID may be re-exposed by the outer query
+        for src in core.sources:
+            if src.subquery is not None and _projects_subject_id(src.subquery, subject_tables):
+                worst = ESCALATE
+    for cte in select.ctes.values():
+        if _projects_subject_id(cte, subject_tables):
+            worst = ESCALATE
+    return worst
+
+
+def _is_safe_aggregate(core: Core) -> bool:
+    """True when every result column of *core* is an aggregate or a grouping key."""
+    if core.windowed:
+        return False
+    group_cols = set()
+    group_keys = set(core.group_text)
+    for expr in core.group_by:
+        for node, _ in _walk(expr):
+            if isinstance(node, Column):
+                if node.name == SUBJECT_ID:
+                    return False
+                group_cols.add(node.name)
+        if len(expr) == 1 and isinstance(expr[0], Token) and expr[0].kind == "number":
+            idx = int(expr[0].value) - 1
+            if 0 <= idx < len(core.items):
+                group_keys.add(core.items[idx].text)
+
+    has_aggregate = False
+    for item in core.items:
+        outside = set()
+        for node, funcs in _walk(item.nodes):
+            if isinstance(node, (Star, Subquery)):
+                return False
+            if isinstance(node, Func) and _is_aggregate(node):
+                has_aggregate = True
+            elif isinstance(node, Column) and not any(f in AGGREGATES for f in funcs):
+                outside.add(node.name)
+        if not outside or outside <= group_cols:
+            continue
+        if item.text in group_keys or (item.alias and item.alias in group_keys):
+            continue
+        return False
+    return has_aggregate or bool(core.group_by)
+
+
+# ---------------------------------------------------------------------------
+# Public entry point
+# ---------------------------------------------------------------------------
+
+
+def precheck(
+    sql: str,
+    subject_tables: Collection[str] = ("clinical",),
+    internal_tables: Collection[str] = ("audit_log",),
+) -> PolicyDecision:
+    """Classify *sql* against the study protocol without calling an LLM.
+
+    Parameters:
+        sql: The query submitted to ``run_sql``.
+        subject_tables: Datasets that carry a USUBJID column (``SELECT *`` on them is denied).
+        internal_tables: Server-side tables that are never auto-approved.
+
+    Returns:
+        A ``PolicyDecision`` whose verdict is ``ALLOW``, ``DENY`` or ``ESCALATE``.
+    """
+    try:
+        tokens = tokenize(sql)
+    except SQLParseError as exc:
+        return PolicyDecision(ESCALATE, f"Could not tokenise query: {exc}")
+
+    statements = [s for s in _split(tokens, ";") if s]
+    if not statements:
+        return PolicyDecision(DENY, "Empty query.")
+    if len(statements) > 1:
+        return PolicyDecision(
+            DENY, "Multiple statements are not allowed; submit a single SELECT statement."
+        )
+
+    try:
+        tree = _nest(statements[0])
+        if not _is_select(tree):
+            raise NonSelectStatement(_text(tree[:1]))
+        select = parse_select(tree)
+    except NonSelectStatement as exc:
+        return PolicyDecision(
+            DENY, f"Non-SELECT statement ({exc.keyword}) is prohibited; only SELECT is allowed."
+        )
+    except (SQLParseError, IndexError, AttributeError) as exc:
+        return PolicyDecision(ESCALATE, f"Could not parse query: {exc}")
+    return _classify(select, subject_tables, internal_tables)._replace(single_select=True)
+
+
+def _classify(
+    select: Select, subject_tables: Collection[str], internal_tables: Collection[str]
+) -> PolicyDecision:
+    """``precheck``'s verdict on a query that parsed as *select*."""
+    tables = _base_tables(select)
+    internal = {t.upper() for t in internal_tables}
+    datasets = {t for t in tables if t not in internal and not t.startswith("SQLITE_")}
+    if len(datasets) > 1:
+        return PolicyDecision(
+            DENY,
+            f"Query combines multiple datasets ({', '.join(sorted(datasets))}); "
+            "joining datasets is prohibited.",
+        )
+
+    subject_tables = {t.upper() for t in subject_tables}
+    projection = _projects_subject_id(select, subject_tables)
+    if projection == DENY:
+        return PolicyDecision(DENY, f"{SUBJECT_ID} must never be selected or returned.")
+    if projection == ESCALATE:
+        return PolicyDecision(ESCALATE, f"{SUBJECT_ID} may be derived in the result columns.")
+
+    if tables != datasets:
+        return PolicyDecision(ESCALATE, "Query reads a server-internal table.")
+    if select.ctes or len(select.cores) != 1 or any(True for _ in _subqueries(select)):
+        return PolicyDecision(ESCALATE, "Compound or nested query needs review.")
+
+    core = select.cores[0]
+    if len(core.sources) != 1 or core.sources[0].table is None or core.sources[0].is_function:
+        return PolicyDecision(ESCALATE, "Query does not read a single dataset.")
+    if _is_safe_aggregate(core):
+        return PolicyDecision(
+            ALLOW, "Aggregate query over a single dataset; no subject identifiers returned."
+        )
+    row_level = (
+        core.sources[0].table in subject_tables
+        and not (core.group_by or core.having or core.windowed)
+        and not any(
+            isinstance(node, Func) and _is_aggregate(node)
+            for item in core.items
+            for node, _ in _walk(item.nodes)
+        )
+    )
+    return PolicyDecision(ESCALATE, "Query may return subject-level rows.", row_level)
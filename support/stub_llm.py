@@ -0,0 +1,125 @@
+"""
+Minimal stand-in for the OpenAI chat completions API, used to exercise the
+policy gate in ``clinical_mcp.py`` without network access or API cost.
+
+Run it, then point the MCP server at it:
+
+    python support/stub_llm.py --port 8001 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python clinical_mcp.py
+
+Verdicts are ``allow``, ``deny`` or ``auto`` (deny when the SQL mentions USUBJID).
+Batch requests (the ``policy_verdicts`` response format) get one verdict per
+entry of the JSON array of queries.
+"""
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection reuse is observable
+
+    # Set by serve()
+    latency = 0.0
+    verdict = "auto"
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _judge(self, sql: str) -> tuple[bool, str]:
+        if self.verdict == "auto":
+            allowed = "USUBJID" not in sql.upper()
+        else:
+            allowed = self.verdict == "allow"
+        return allowed, "stub: query allowed" if allowed else "stub: query denied"
+
+    def _send(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self._send(500, {"error": {"message": "stub: injected server error"}})
+            return
+
+        sql = request["messages"][-1]["content"]
+        schema = (request.get("response_format") or {}).get("json_schema") or {}
+        if schema.get("name") == "policy_verdicts":
+            # [{"query": 1, "sql": "SELECT ..."}, ...]
+            verdicts = []
+            for entry in json.loads(sql):
+                allowed, reason = self._judge(entry["sql"])
+                verdicts.append({"query": entry["query"], "allowed": allowed, "reason": reason})
+            content = json.dumps({"verdicts": verdicts})
+        else:
+            allowed, reason = self._judge(sql)
+            content = json.dumps({"allowed": allowed, "reason": reason})
+        # Rough token counts (about 4 characters per token) for usage accounting
+        prompt_tokens = sum(len(m["content"]) for m in request["messages"]) // 4
+        completion_tokens = len(content) // 4
+        self._send(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8001,
+    latency: float = 0.0,
+    verdict: str = "auto",
+    error_rate: float = 0.0,
+) -> ThreadingHTTPServer:
+    """Create (but do not start) a stub server; call ``serve_forever()`` on the result."""
+    handler = type(
+        "ConfiguredStubHandler",
+        (StubHandler,),
+        {"latency": latency, "verdict": verdict, "error_rate": error_rate},
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per response")
+    parser.add_argument("--verdict", choices=["allow", "deny", "auto"], default="auto")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of HTTP 500s")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.verdict, args.error_rate)
+    print(f"Stub policy LLM listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
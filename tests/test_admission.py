@@ -0,0 +1,81 @@
+"""Per-session rate limits and fair per-tool queues (support/admission.py)."""
+
+import asyncio
+
+import pytest
+
+from support.admission import AdmissionController, FairGate, Overloaded
+
+
+def controller(**kwargs) -> AdmissionController:
+    options = {"max_queue": 4, "session_max_queue": 2, "queue_timeout": 0.05, **kwargs}
+    return AdmissionController(rate=1.0, burst=3, concurrency={"run_sql": 1}, **options)
+
+
+async def hold(admission: AdmissionController, session: str, release: asyncio.Event) -> None:
+    async with admission.admit("run_sql", session):
+        await release.wait()
+
+
+def test_rate_limit_per_session():
+    admission = controller()
+
+    async def run():
+        for _ in range(3):
+            async with admission.admit("run_sql", "a"):
+                pass
+        with pytest.raises(Overloaded) as rejected:
+            async with admission.admit("run_sql", "a"):
+                pass
+        async with admission.admit("run_sql", "b"):  # another session has its own tokens
+            pass
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.retry_after > 0
+    assert admission.counters["run_sql"]["rejected"]["rate_limit"] == 1
+
+
+@pytest.mark.parametrize("reason", ["queue_full", "queue_timeout"])
+def test_calls_turned_away_by_the_queue_get_their_tokens_back(reason):
+    admission = controller(session_max_queue=0 if reason == "queue_full" else 2)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(admission, "other", release))
+        await asyncio.sleep(0)
+        for _ in range(5):  # more than the burst of 3
+            with pytest.raises(Overloaded):
+                async with admission.admit("run_sql", "a"):
+                    pass
+        release.set()
+        await holder
+        async with admission.admit("run_sql", "a"):  # still has tokens to spend
+            pass
+
+    asyncio.run(run())
+    assert admission.counters["run_sql"]["rejected"][reason] == 5
+    assert admission.counters["run_sql"]["rejected"]["rate_limit"] == 0
+
+
+def test_waiters_are_served_round_robin_by_session():
+    gate = FairGate(1)
+    order = []
+
+    async def call(session: str, name: str) -> None:
+        assert await gate.acquire(session, timeout=1)
+        order.append(name)
+        await asyncio.sleep(0)
+        gate.release()
+
+    async def run():
+        assert await gate.acquire("first", timeout=1)
+        calls = [
+            asyncio.create_task(call(s, n)) for s, n in [("a", "a1"), ("a", "a2"), ("b", "b1")]
+        ]
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*calls)
+
+    asyncio.run(run())
+    assert order == ["a1", "b1", "a2"]
@@ -0,0 +1,87 @@
+"""Audit log retention, archival and reads across live and archived rows."""
+
+import datetime
+import sqlite3
+
+import pytest
+
+from support.audit_archive import AuditArchiver, archive_partitions, query_audit
+from support.audit_query import COLUMNS, AuditFilter
+
+NOW = datetime.datetime(2026, 3, 15, 12, 0)
+
+
+@pytest.fixture
+def audit_db(tmp_path):
+    path = str(tmp_path / "audit.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            f"CREATE TABLE audit_log (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            f"{', '.join(COLUMNS[1:])})"
+        )
+        # Two rows a day from November to mid-March, alternating tool and verdict
+        day = datetime.datetime(2025, 11, 1)
+        while day < NOW:
+            for tool, approved in (("run_sql", 1), ("list_schema", 0)):
+                conn.execute(
+                    "INSERT INTO audit_log (timestamp, tool_name, arguments, approved) "
+                    "VALUES (?, ?, '{}', ?)",
+                    (str(day), tool, approved),
+                )
+            day += datetime.timedelta(days=1)
+    return path
+
+
+def live_ids(path: str) -> list[int]:
+    with sqlite3.connect(path) as conn:
+        return [i for (i,) in conn.execute("SELECT id FROM audit_log ORDER BY id DESC")]
+
+
+def test_rows_past_retention_move_to_monthly_partitions(audit_db, tmp_path):
+    everything = live_ids(audit_db)
+    archiver = AuditArchiver(audit_db, str(tmp_path / "archive"), retention_days=60)
+    moved = archiver.run(NOW)
+
+    with sqlite3.connect(audit_db) as conn:
+        (oldest,) = conn.execute("SELECT MIN(timestamp) FROM audit_log").fetchone()
+    assert oldest >= str(NOW - datetime.timedelta(days=60))
+    assert moved == len(everything) - len(live_ids(audit_db))
+    assert [m for m, _ in archive_partitions(str(tmp_path / "archive"))] == [
+        "2026-01",
+        "2025-12",
+        "2025-11",
+    ]
+
+    with sqlite3.connect(audit_db) as conn:
+        rows = query_audit(conn, str(tmp_path / "archive"), AuditFilter(), limit=len(everything))
+    assert [r[0] for r in rows] == everything
+
+
+def test_query_audit_pages_and_filters_across_the_archive(audit_db, tmp_path):
+    archive = str(tmp_path / "archive")
+    AuditArchiver(audit_db, archive, retention_days=60).run(NOW)
+    flt = AuditFilter(tools=("run_sql",), since="2025-12-20", until="2026-01-20")
+
+    with sqlite3.connect(audit_db) as conn:
+        pages, before = [], None
+        while page := query_audit(conn, archive, flt, before_id=before, limit=7):
+            pages += page
+            before = page[-1][0]
+    timestamps = [r[COLUMNS.index("timestamp")] for r in pages]
+    assert len(pages) == 31
+    assert timestamps == sorted(timestamps, reverse=True)
+    assert {r[COLUMNS.index("tool_name")] for r in pages} == {"run_sql"}
+    assert min(timestamps) >= "2025-12-20" and max(timestamps) < "2026-01-20"
+
+
+def test_row_left_in_both_places_is_returned_once(audit_db, tmp_path):
+    archive = str(tmp_path / "archive")
+    archiver = AuditArchiver(audit_db, archive, retention_days=60)
+    with sqlite3.connect(audit_db) as conn:
+        old = conn.execute("SELECT * FROM audit_log WHERE id <= 10").fetchall()
+    archiver.run(NOW)
+    with sqlite3.connect(audit_db) as conn:
+        # A crash after the partition was written but before the delete
+        conn.executemany(f"INSERT INTO audit_log VALUES ({', '.join('?' * len(COLUMNS))})", old)
+        rows = query_audit(conn, archive, AuditFilter(until="2025-11-06"), limit=50)
+    assert [r[0] for r in rows] == list(range(10, 0, -1))
@@ -0,0 +1,58 @@
+"""Connections given back to a ConnectionPool (support/db_pool.py)."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from support.db_pool import ConnectionPool
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "pool.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (x)")
+    return str(path)
+
+
+def test_open_transaction_is_rolled_back_on_release(db_path):
+    async def run() -> list:
+        pool = ConnectionPool(db_path, size=1)
+        async with pool.acquire() as db:
+            await db.execute("INSERT INTO t VALUES (1)")
+            assert db.in_transaction
+        async with pool.acquire() as db:
+            assert not db.in_transaction
+            rows = await db.execute_fetchall("SELECT * FROM t")
+        await pool.close()
+        return rows
+
+    assert asyncio.run(run()) == []
+
+
+@pytest.mark.parametrize("breakage", ["rollback fails", "closed while borrowed"])
+def test_broken_connection_gives_up_its_slot(db_path, breakage):
+    async def run() -> dict:
+        pool = ConnectionPool(db_path, size=1)
+        async with pool.acquire() as broken:
+            await broken.execute("INSERT INTO t VALUES (1)")
+            if breakage == "rollback fails":
+
+                async def rollback():
+                    raise sqlite3.OperationalError("database is locked")
+
+                broken.rollback = rollback
+            else:
+                await broken.close()
+        async with asyncio.timeout(1):  # a lost slot would wait forever
+            async with pool.acquire() as db:
+                assert db is not broken
+                (count,) = (await db.execute_fetchall("SELECT COUNT(*) FROM t"))[0]
+                assert count == 0
+        stats = pool.stats()
+        await pool.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert (stats["open"], stats["idle"], stats["discarded"]) == (1, 1, 1)
@@ -0,0 +1,60 @@
+"""DuckDB engine parity with SQLite, and when run_sql routes to it (support/engines.py)."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+import clinical_mcp
+from support.check_engines import check
+from support.engines import DuckDBEngine
+from support.generate_clinical import Spec, write_database
+
+pytest.importorskip("duckdb")
+
+# Portable, and not something clinical_rollup can answer
+PORTABLE = "SELECT SITEID, SUM(EVALFLAG) * 100 / COUNT(*) AS pct FROM clinical GROUP BY SITEID"
+
+
+@pytest.fixture(scope="module")
+def db_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("engines")
+    write_database(Spec(rows=3000, sites=12, end_date="2025-06-30"), str(path / "clinical.db"))
+    return path
+
+
+def test_duckdb_matches_sqlite(db_dir):
+    engine = DuckDBEngine(str(db_dir / "clinical.db"))
+    engine.build()
+    with sqlite3.connect(db_dir / "clinical.db") as conn:
+        results = asyncio.run(check(engine, conn, page=3))
+    assert [(r["query"], r["problem"]) for r in results if r["problem"]] == []
+
+
+@pytest.mark.parametrize("cache_bytes", [0, 1024 * 1024], ids=["cache off", "cache on"])
+def test_fetch_page_uses_the_engine_once_it_is_current(db_dir, monkeypatch, cache_bytes):
+    monkeypatch.chdir(db_dir)
+    engine = DuckDBEngine(clinical_mcp.DB_PATH)
+    monkeypatch.setattr(clinical_mcp, "analytic_engine", engine)
+    monkeypatch.setattr(clinical_mcp.result_cache, "max_bytes", cache_bytes)
+    monkeypatch.setattr(clinical_mcp, "_db_identity", None)
+
+    async def fetch_twice() -> list[str | None]:
+        routes = []
+        try:
+            for _ in range(2):
+                details = {}
+                clinical_mcp._audit_details.set(details)
+                page = await clinical_mcp.fetch_page(clinical_mcp.read_pool, PORTABLE, [], 0, 100)
+                assert len(page.rows) == 12
+                routes.append(details["engine"])
+                if engine._refresh is not None:
+                    await engine._refresh  # the first call starts mirroring clinical.db
+                clinical_mcp.result_cache.clear()
+        finally:
+            for pool in (clinical_mcp.read_pool, clinical_mcp.version_pool):
+                await pool.close()
+        return routes
+
+    assert asyncio.run(fetch_twice()) == ["sqlite: duckdb data not current", "duckdb"]
+    assert engine.counters["queries"] == 1
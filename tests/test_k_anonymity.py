@@ -0,0 +1,77 @@
+"""The minimum-subjects probe and its checks (support/k_anonymity.py)."""
+
+import sqlite3
+
+import pytest
+
+from support.k_anonymity import (
+    count_sql,
+    small_classes_sql,
+    subject_probe,
+    subjects_sql,
+    suppress,
+)
+
+# 12 subjects: 7 at SITE01, 4 at SITE02 and 1 at SITE03
+SUBJECTS = [(f"S{i:02d}", ("SITE01",) * 7 + ("SITE02",) * 4 + ("SITE03",), i) for i in range(12)]
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE clinical (USUBJID, SITEID, AGE)")
+    conn.executemany(
+        "INSERT INTO clinical VALUES (?, ?, ?)",
+        [(subject, sites[i], 30 + i) for subject, sites, i in SUBJECTS],
+    )
+    return conn
+
+
+PROBED = {
+    "filter": "SELECT SITEID, AGE FROM clinical WHERE AGE > 33",
+    "order and limit": "SELECT SITEID FROM clinical ORDER BY AGE DESC LIMIT 3 OFFSET 2",
+    "distinct": "SELECT DISTINCT SITEID FROM clinical",
+    "parameters": "SELECT AGE FROM clinical WHERE SITEID = ?;",
+    "subquery": "SELECT SITEID FROM clinical WHERE AGE > (SELECT AVG(AGE) FROM clinical)",
+}
+PARAMS = {"parameters": ["SITE02"]}
+
+
+@pytest.mark.parametrize("name", PROBED)
+def test_probe_returns_the_rows_of_the_query(conn, name):
+    sql, params = PROBED[name], PARAMS.get(name, [])
+    probe = subject_probe(sql)
+    rows = conn.execute(sql, params).fetchall()
+    probed = [r[:-1] for r in conn.execute(probe, params)]
+    if name == "distinct":  # one row per (row, subject) pair
+        probed = list(dict.fromkeys(probed))
+    assert probed == rows
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT DISTINCT SITEID FROM clinical LIMIT 2",
+        "SELECT 1",
+        "SELECT SITEID FROM clinical WHERE AGE # 1",
+    ],
+)
+def test_no_probe_when_it_could_return_other_rows(sql):
+    assert subject_probe(sql) is None
+
+
+def test_subject_counts(conn):
+    probe = subject_probe("SELECT SITEID FROM clinical WHERE SITEID != 'SITE01'")
+    assert conn.execute(subjects_sql(probe, 5)).fetchone() == (5,)  # stops at k
+    assert conn.execute(subjects_sql(probe, 10)).fetchone() == (5,)
+    assert conn.execute(count_sql(probe)).fetchone() == (5, 5)
+
+
+def test_small_classes_are_suppressed(conn):
+    sql = "SELECT SITEID FROM clinical"
+    small = conn.execute(small_classes_sql(subject_probe(sql), 1, 5, 100)).fetchall()
+    assert sorted(small) == [("SITE02", 4), ("SITE03", 1)]
+    rows = conn.execute(sql).fetchall()
+    kept, positions = suppress(rows, frozenset(r[:-1] for r in small))
+    assert kept == [("SITE01",)] * 7
+    assert positions == list(range(7))
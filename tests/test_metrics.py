@@ -0,0 +1,28 @@
+"""Per-call stage timings and held observations (support/metrics.py)."""
+
+import asyncio
+
+from support.metrics import Metrics
+
+
+def test_held_stages_count_only_when_replayed():
+    metrics = Metrics("test")
+
+    async def speculative(stages: list) -> None:
+        metrics.hold(stages)
+        metrics.record("db.query", 0.5)
+
+    async def call(use: bool) -> dict:
+        with metrics.call_stages() as stages:
+            held: list = []
+            await asyncio.create_task(speculative(held))
+            metrics.record("policy.check", 0.25)
+            if use:
+                metrics.replay(held)
+        return stages
+
+    assert asyncio.run(call(False)) == {"policy.check": 0.25}
+    assert "db.query" not in metrics.snapshot()["stage"]
+    assert asyncio.run(call(True)) == {"policy.check": 0.25, "db.query": 0.5}
+    assert metrics.snapshot()["stage"]["db.query"]["count"] == 1
+    assert metrics.snapshot()["stage"]["policy.check"]["count"] == 2
@@ -0,0 +1,81 @@
+"""Result pages cached per data version (support/result_cache.py)."""
+
+import asyncio
+
+from support.result_cache import ResultCache, result_key
+
+COLUMNS, ROWS = ["SEX", "n"], [("F", 10), ("M", 12)]
+
+
+class Probe:
+    def __init__(self, version=1):
+        self.version = version
+
+    async def __call__(self):
+        return self.version
+
+
+def test_key_ignores_layout_but_not_literals_or_window():
+    key = result_key("SELECT COUNT(*) FROM clinical WHERE AGE > 60", [], 0, 500)
+    assert key == result_key("select count(*)\n  from clinical where AGE>60;", [], 0, 500)
+    assert key != result_key("SELECT COUNT(*) FROM clinical WHERE AGE > 61", [], 0, 500)
+    assert key != result_key("SELECT COUNT(*) FROM clinical WHERE AGE > 60", [], 500, 500)
+    assert result_key("SELECT ?", [1], 0, 1) != result_key("SELECT ?", ["1"], 0, 1)
+
+
+def test_new_data_version_drops_every_page():
+    probe = Probe()
+    cache = ResultCache(probe)
+
+    async def run():
+        _, version = await cache.get("k")
+        cache.put("k", COLUMNS, ROWS, version)
+        hit = await cache.get("k")
+        probe.version = 2
+        miss = await cache.get("k")
+        return hit, miss
+
+    hit, miss = asyncio.run(run())
+    assert hit == ((COLUMNS, ROWS), 1)
+    assert miss == (None, 2)
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_page_read_under_an_older_version_is_not_stored():
+    probe = Probe()
+    cache = ResultCache(probe)
+
+    async def run():
+        _, version = await cache.get("k")
+        probe.version = 2
+        await cache.get("other")  # the cache has moved on to version 2
+        cache.put("k", COLUMNS, ROWS, version)
+        return await cache.get("k")
+
+    assert asyncio.run(run()) == (None, 2)
+
+
+def test_missing_database_or_zero_size_bypasses_the_cache():
+    for cache in (ResultCache(Probe(None)), ResultCache(Probe(), max_bytes=0)):
+
+        async def run(cache=cache):
+            _, version = await cache.get("k")
+            cache.put("k", COLUMNS, ROWS, version)
+            return await cache.get("k")
+
+        assert asyncio.run(run()) == (None, None)
+
+
+def test_least_recently_used_page_is_evicted():
+    cache = ResultCache(Probe(), max_bytes=400)  # four pages of about 100 bytes
+
+    async def run():
+        for key in "abcd":
+            _, version = await cache.get(key)
+            cache.put(key, COLUMNS, ROWS, version)
+        await cache.get("a")
+        cache.put("e", COLUMNS, ROWS, 1)
+        return [(await cache.get(key))[0] is not None for key in "abcde"]
+
+    assert asyncio.run(run()) == [True, False, True, True, True]
+    assert cache.stats()["evictions"] == 1
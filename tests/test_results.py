@@ -0,0 +1,52 @@
+"""Continuation tokens and page encoding for run_sql/fetch_more (support/results.py)."""
+
+import sqlite3
+
+from support.results import CursorStore, encode_page, paged_query, take_within_budget
+
+
+def test_token_is_single_use():
+    store = CursorStore()
+    token = store.register("SELECT 1", [2], 500, 500, "columnar")
+    continuation = store.take(token)
+    assert (continuation.query, continuation.params, continuation.offset) == ("SELECT 1", [2], 500)
+    assert continuation.fmt == "columnar"
+    assert store.take(token) is None
+    assert store.take("made-up") is None
+
+
+def test_tokens_expire_and_are_bounded():
+    expired = CursorStore(ttl_seconds=0)
+    assert expired.take(expired.register("SELECT 1", [], 1, 1)) is None
+
+    store = CursorStore(max_entries=2)
+    tokens = [store.register("SELECT 1", [], i, 1) for i in range(3)]
+    assert len(store) == 2
+    assert store.take(tokens[0]) is None
+    assert store.take(tokens[2]).offset == 2
+
+
+def test_paged_query_survives_a_trailing_comment():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (value)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(1, 11)])
+    query = "SELECT value FROM t ORDER BY value -- the numbers;"
+    rows = conn.execute(paged_query(query), [3, 4]).fetchall()
+    assert rows == [(5,), (6,), (7,)]
+
+
+def test_budget_keeps_at_least_one_row():
+    rows = [("x" * 100,)] * 5
+    assert take_within_budget(rows, 10) == (rows[:1], True)
+    kept, cut = take_within_budget(rows, 250)
+    assert (len(kept), cut) == (2, True)
+    assert take_within_budget(rows, 10_000) == (rows, False)
+
+
+def test_columnar_encoding():
+    page = encode_page(["SEX", "n", "avg"], [("F", 10, None), ("M", 12, 41.5)], "columnar")
+    assert page == {
+        "columns": ["SEX", "n", "avg"],
+        "types": ["TEXT", "INTEGER", "REAL"],
+        "data": [["F", 10, None], ["M", 12, 41.5]],
+    }
@@ -0,0 +1,113 @@
+"""Queries rewritten onto clinical_rollup (support/rollups.py) return what clinical does."""
+
+import sqlite3
+
+import pytest
+
+from support.generate_clinical import COLUMNS, CREATE_TABLE, Spec, generate_chunk
+from support.rollups import ROLLUP_TABLE, build_rollups, rewrite
+
+# Answered from the rollup
+REWRITTEN = {
+    "count": "SELECT COUNT(*) FROM clinical",
+    "by site": "SELECT SITEID, COUNT(*) AS n, AVG(AGE) FROM clinical GROUP BY SITEID",
+    "age measures": (
+        "SELECT SEX, RACE, COUNT(AGE), SUM(AGE), TOTAL(AGE), MIN(AGE), MAX(AGE) "
+        "FROM clinical GROUP BY SEX, RACE"
+    ),
+    "month": (
+        "SELECT strftime('%Y-%m', ENRLDT) AS month, COUNT(*) FROM clinical "
+        "GROUP BY month ORDER BY month"
+    ),
+    "month without AS": (
+        "SELECT strftime('%Y-%m', ENRLDT) month, COUNT(*) n FROM clinical GROUP BY month"
+    ),
+    "month prefix": "SELECT substr(c.ENRLDT, 1, 7), COUNT(*) FROM clinical c GROUP BY 1",
+    "filtered": (
+        "SELECT EVALFLAG, COUNT(*) FROM clinical "
+        "WHERE SEX = 'F' AND RACE IN ('Asian', 'Other') GROUP BY EVALFLAG"
+    ),
+    "having": "SELECT SITEID FROM clinical GROUP BY SITEID HAVING COUNT(*) > 80",
+    "distinct dimension": "SELECT SEX, COUNT(DISTINCT SITEID) FROM clinical GROUP BY SEX",
+    "dimension MIN/MAX": "SELECT MIN(SITEID), MAX(RACE), COUNT(SEX) FROM clinical",
+    "scalar functions": (
+        "SELECT lower(SEX) AS sex, ROUND(AVG(AGE), 1) FROM clinical GROUP BY lower(SEX)"
+    ),
+    "cast": "SELECT CAST(AVG(AGE) AS INTEGER) FROM clinical",
+}
+
+# Aggregates and functions that would see one value per rollup cell instead of per row
+KEPT = {
+    "GROUP_CONCAT(DISTINCT SITEID)": (
+        "SELECT SEX, COUNT(*), GROUP_CONCAT(DISTINCT SITEID) FROM clinical GROUP BY SEX"
+    ),
+    "GROUP_CONCAT(SEX)": (
+        "SELECT SITEID, COUNT(*), length(GROUP_CONCAT(SEX)) FROM clinical GROUP BY SITEID"
+    ),
+    "json_group_array": (
+        "SELECT COUNT(*), json_array_length(json_group_array(RACE)) FROM clinical"
+    ),
+    "json_group_object": (
+        "SELECT COUNT(*), length(json_group_object(SITEID, SEX)) FROM clinical GROUP BY SEX"
+    ),
+    "column outside the rollup": "SELECT COUNT(*) FROM clinical WHERE AGE > 60",
+    "SUM(DISTINCT AGE)": "SELECT SUM(DISTINCT AGE) FROM clinical",
+}
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.execute(CREATE_TABLE)
+    columns = generate_chunk(Spec(rows=3000, sites=12, end_date="2025-06-30"), 0)
+    conn.executemany(
+        f"INSERT INTO clinical VALUES ({', '.join('?' * len(COLUMNS))})",
+        zip(*(c.tolist() for c in columns)),
+    )
+    conn.execute("UPDATE clinical SET AGE = NULL WHERE rowid % 97 = 0")
+    build_rollups(conn)
+    yield conn
+    conn.close()
+
+
+def rows(conn: sqlite3.Connection, sql: str) -> list[tuple]:
+    result = conn.execute(sql).fetchall()
+    return sorted(tuple(round(v, 9) if isinstance(v, float) else v for v in r) for r in result)
+
+
+@pytest.mark.parametrize("sql", [*REWRITTEN.values(), *KEPT.values()], ids=[*REWRITTEN, *KEPT])
+def test_answer_matches_clinical(conn, sql):
+    answered = rewrite(sql) or sql  # as run_sql does
+    assert rows(conn, answered) == rows(conn, sql)
+    names = [d[0] for d in conn.execute(answered).description]
+    assert names == [d[0] for d in conn.execute(sql).description]
+
+
+@pytest.mark.parametrize("sql", REWRITTEN.values(), ids=REWRITTEN.keys())
+def test_answered_from_the_rollup(sql):
+    assert ROLLUP_TABLE in (rewrite(sql) or "")
+
+
+@pytest.mark.parametrize("sql", KEPT.values(), ids=KEPT.keys())
+def test_stays_on_clinical(sql):
+    assert rewrite(sql) is None
+
+
+def test_random_sample_stays_on_clinical():
+    # over the rollup, random() would keep or drop whole cells
+    assert rewrite("SELECT COUNT(*) FROM clinical WHERE random() % 2 = 0") is None
+
+
+def test_triggers_keep_the_rollup_in_step(conn):
+    sql = REWRITTEN["age measures"]
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DELETE FROM clinical WHERE rowid % 7 = 0")
+        conn.execute("UPDATE clinical SET SEX = 'F', AGE = AGE + 1 WHERE rowid % 5 = 0")
+        conn.execute(
+            "INSERT INTO clinical SELECT STUDYID, USUBJID || 'x', SITEID, ENRLDT, EVALFLAG, "
+            "NULL, SEX, RACE FROM clinical WHERE rowid % 11 = 0"
+        )
+        assert rows(conn, rewrite(sql)) == rows(conn, sql)
+    finally:
+        conn.execute("ROLLBACK")
@@ -0,0 +1,132 @@
+"""Verdicts of the local policy pre-check (support/sql_policy.py)."""
+
+import pytest
+
+from support.sql_policy import ALLOW, DENY, ESCALATE, canonical, fingerprint, precheck
+
+# One entry per DENY rule of precheck()
+DENIED = {
+    "empty": ";",
+    "multiple statements": "SELECT COUNT(*) FROM clinical; DROP TABLE clinical",
+    "insert": "INSERT INTO clinical (SITEID) VALUES ('x')",
+    "update": "UPDATE clinical SET AGE = 0",
+    "delete": "DELETE FROM clinical",
+    "drop": "DROP TABLE clinical",
+    "attach": "ATTACH DATABASE 'audit.db' AS a",
+    "pragma": "PRAGMA query_only=OFF",
+    "with ... delete": "WITH t AS (SELECT 1) DELETE FROM clinical",
+    "datasets joined": "SELECT COUNT(*) FROM clinical JOIN vitals USING (USUBJID)",
+    "datasets in a subquery": (
+        "SELECT COUNT(*) FROM clinical WHERE SITEID IN (SELECT SITEID FROM vitals)"
+    ),
+    "datasets in a union": "SELECT SITEID FROM clinical UNION SELECT SITEID FROM vitals",
+    "USUBJID": "SELECT USUBJID FROM clinical",
+    "USUBJID aliased": "SELECT USUBJID AS id, AGE FROM clinical",
+    "USUBJID qualified": "SELECT c.USUBJID FROM clinical c",
+    "USUBJID schema-qualified": "SELECT main.clinical.USUBJID FROM clinical",
+    "USUBJID lower case": "select usubjid from clinical",
+    "USUBJID double-quoted": 'SELECT "USUBJID" FROM clinical',
+    "USUBJID bracket-quoted": "SELECT [USUBJID] FROM clinical",
+    "USUBJID backquoted": "SELECT `USUBJID` FROM clinical",
+    "USUBJID in parentheses": "SELECT ((USUBJID)) FROM clinical",
+    "USUBJID after a comment": "SELECT /* AGE, */ USUBJID FROM clinical",
+    "USUBJID concatenated": "SELECT 'id:' || USUBJID FROM clinical",
+    "MIN(USUBJID)": "SELECT MIN(USUBJID) FROM clinical",
+    "scalar MAX(USUBJID, ...)": "SELECT MAX(USUBJID, '') FROM clinical",
+    "GROUP_CONCAT(USUBJID)": "SELECT SITEID, GROUP_CONCAT(USUBJID) FROM clinical GROUP BY SITEID",
+    "JSON_GROUP_ARRAY(USUBJID)": "SELECT JSON_GROUP_ARRAY(USUBJID) FROM clinical",
+    "SELECT *": "SELECT * FROM clinical WHERE AGE > 80",
+    "SELECT t.*": "SELECT c.* FROM clinical c",
+    "USUBJID in a union branch": "SELECT SITEID FROM clinical UNION SELECT USUBJID FROM clinical",
+    "USUBJID from a scalar subquery": (
+        "SELECT (SELECT USUBJID FROM clinical LIMIT 1) AS x FROM clinical"
+    ),
+}
+
+ALLOWED = {
+    "count": "SELECT COUNT(*) FROM clinical",
+    "grouped": "SELECT SITEID, COUNT(*) AS n, AVG(AGE) FROM clinical GROUP BY SITEID",
+    "group by position": "SELECT SITEID, COUNT(*) FROM clinical GROUP BY 1",
+    "distinct subjects": "SELECT SITEID, COUNT(DISTINCT USUBJID) FROM clinical GROUP BY SITEID",
+    "parameters": "SELECT COUNT(*) FROM clinical WHERE SITEID = ? AND AGE > ?",
+    "literal LIMIT/OFFSET": "SELECT SEX, COUNT(*) FROM clinical GROUP BY SEX LIMIT 5 OFFSET 10",
+    "parameter LIMIT": "SELECT SEX, COUNT(*) FROM clinical GROUP BY SEX LIMIT ?, ?",
+    "semicolon in a string": "SELECT COUNT(*) FROM clinical WHERE SITEID = 'a;b';",
+    "USUBJID only in a comment": "SELECT COUNT(*) /* , USUBJID */ FROM clinical",
+}
+
+# Attempts to get something past the local rules; the LLM (or the result check) must decide
+ESCALATED = {
+    "subquery in OFFSET": (
+        "SELECT SITEID, COUNT(*) FROM clinical GROUP BY SITEID LIMIT 1 OFFSET (SELECT 1)"
+    ),
+    "USUBJID read in LIMIT": (
+        "SELECT SITEID, COUNT(*) FROM clinical GROUP BY SITEID "
+        "LIMIT (SELECT length(USUBJID) FROM clinical LIMIT 1)"
+    ),
+    "subquery in a LIMIT function": (
+        "SELECT SEX, COUNT(*) FROM clinical GROUP BY SEX LIMIT abs((SELECT MAX(AGE) FROM clinical))"
+    ),
+    "subquery in WINDOW": (
+        "SELECT COUNT(*) FROM clinical WINDOW w AS (ORDER BY (SELECT USUBJID FROM clinical))"
+    ),
+    "subquery in WHERE": (
+        "SELECT COUNT(*) FROM clinical WHERE AGE > (SELECT AVG(AGE) FROM clinical)"
+    ),
+    "subquery in HAVING": (
+        "SELECT SITEID, COUNT(*) FROM clinical GROUP BY SITEID HAVING COUNT(*) > (SELECT 1)"
+    ),
+    "subquery in ORDER BY": (
+        "SELECT SEX, COUNT(*) FROM clinical GROUP BY SEX ORDER BY (SELECT USUBJID FROM clinical)"
+    ),
+    "CTE": "WITH t AS (SELECT SITEID FROM clinical) SELECT SITEID, COUNT(*) FROM t GROUP BY SITEID",
+    "derived table re-exposing USUBJID": "SELECT id FROM (SELECT USUBJID AS id FROM clinical)",
+    "USUBJID wrapped in a function": "SELECT substr(USUBJID, 1, 20) FROM clinical",
+    "USUBJID in CASE": "SELECT CASE WHEN AGE > 0 THEN USUBJID END FROM clinical",
+    "grouped by USUBJID": "SELECT COUNT(*) FROM clinical GROUP BY USUBJID",
+    "ungrouped column next to an aggregate": "SELECT AGE, COUNT(*) FROM clinical",
+    "window function": "SELECT SITEID, AVG(AGE) OVER (PARTITION BY SITEID) FROM clinical",
+    "internal table": "SELECT COUNT(*) FROM audit_log",
+    "internal table joined": "SELECT COUNT(*) FROM clinical, audit_log",
+    "table-valued function": "SELECT COUNT(*) FROM pragma_table_info('clinical')",
+    "unbalanced parentheses": "SELECT COUNT(*) FROM clinical WHERE (AGE > 1",
+    "unknown character": "SELECT COUNT(*) FROM clinical WHERE AGE # 1",
+}
+
+
+@pytest.mark.parametrize("sql", DENIED.values(), ids=DENIED.keys())
+def test_denied(sql):
+    assert precheck(sql, subject_tables=("clinical", "vitals")).verdict == DENY
+
+
+@pytest.mark.parametrize("sql", ALLOWED.values(), ids=ALLOWED.keys())
+def test_allowed(sql):
+    decision = precheck(sql)
+    assert decision.verdict == ALLOW
+    assert decision.single_select
+
+
+@pytest.mark.parametrize("sql", ESCALATED.values(), ids=ESCALATED.keys())
+def test_escalated(sql):
+    assert precheck(sql).verdict == ESCALATE
+
+
+def test_row_level_only_for_plain_rows_of_one_dataset():
+    assert precheck("SELECT AGE, SEX FROM clinical WHERE SITEID = ?").row_level
+    assert not precheck("SELECT substr(USUBJID, 1, 20) FROM clinical").row_level
+    assert not precheck("SELECT SITEID FROM clinical LIMIT (SELECT 1)").row_level
+
+
+def test_single_select_only_when_parsed_as_one_select():
+    assert precheck("SELECT USUBJID FROM clinical").single_select  # denied, but parsed
+    assert not precheck("SELECT 1; ATTACH DATABASE 'x' AS y").single_select
+    assert not precheck("PRAGMA query_only=OFF").single_select
+    assert not precheck("SELECT COUNT(*) FROM clinical WHERE (AGE > 1").single_select
+
+
+def test_canonical_keeps_literals_fingerprint_does_not():
+    a = "select substr(USUBJID, 1, 0) from clinical limit 1"
+    b = "SELECT substr(USUBJID, 1, 20)  FROM clinical LIMIT 100"
+    assert fingerprint(a) == fingerprint(b)
+    assert canonical(a) != canonical(b)
+    assert canonical(a) == canonical("SELECT SUBSTR(usubjid,1,0) FROM CLINICAL LIMIT 1;")